@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# coding=UTF-8
+#
+# E-ARK Validation
+# Copyright (C) 2019
+# All rights reserved.
+#
+# Licensed to the E-ARK project under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The E-ARK project licenses
+# this file to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+E-ARK : Information package validation
+        METS schema validation memory benchmark
+
+Tracks the peak RSS of MetsValidator schema validation on generated METS
+files of increasing size, with a mets:file and structural map div per file.
+Each file is validated in a fresh interpreter. Schema validation runs in
+constant memory so the RSS growth between the smallest and largest files
+should stay flat, the benchmark exits with an error if it exceeds
+--max-growth MB:
+
+    python benchmarks/bench_mets.py --files 10000 100000 1000000
+"""
+import argparse
+import os.path
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# pylint: disable-msg=C0413
+from benchmarks.utils import generate_mets, peak_rss_mb, run_isolated
+from ip_validation.infopacks.mets import MetsValidator
+
+def run_validation(mets_path):
+    """Schema validate mets_path, returns (result, secs, baseline RSS, peak RSS).
+    The baseline is taken once the schema is compiled."""
+    validator = MetsValidator(os.path.dirname(mets_path))
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    is_valid = validator.validate_mets(mets_path)
+    return is_valid, time.perf_counter() - start, baseline, peak_rss_mb()
+
+def main():
+    """Run the benchmark, each METS file in its own interpreter."""
+    parser = argparse.ArgumentParser(description='METS schema validation memory benchmark.')
+    parser.add_argument('--files', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='Numbers of mets:file entries in the generated METS files.')
+    parser.add_argument('--max-growth', type=float, default=64.0,
+                        help='Largest acceptable peak RSS growth, in MB, between the '
+                             'smallest and largest METS files.')
+    parser.add_argument('--mets', help='Existing METS file to validate in process.')
+    args = parser.parse_args()
+    if args.mets:
+        is_valid, secs, baseline, peak = run_validation(args.mets)
+        print('{} {:.3f} {:.1f} {:.1f}'.format(is_valid, secs, baseline, peak))
+        return
+    growths = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for file_count in sorted(args.files):
+            mets_path = generate_mets(os.path.join(temp_dir, 'METS.xml'), file_count,
+                                      divs=True)
+            size_mb = os.path.getsize(mets_path) / (1024 * 1024)
+            is_valid, secs, baseline, peak = run_isolated(__file__, '--mets',
+                                                          mets_path).split()
+            growths[file_count] = float(peak) - float(baseline)
+            print('{:>9} files {:8.1f}MB  valid {:<5}  {:8.3f}s  peak RSS {:8.1f}MB '
+                  '(+{:.1f}MB)'.format(file_count, size_mb, is_valid, float(secs),
+                                       float(peak), growths[file_count]))
+            os.remove(mets_path)
+    growth = growths[max(growths)] - growths[min(growths)]
+    print('RSS growth {:.1f}MB, limit {:.1f}MB'.format(growth, args.max_growth))
+    if growth > args.max_growth:
+        sys.exit('Schema validation memory grew with the METS file size.')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# coding=UTF-8
+#
+# E-ARK Validation
+# Copyright (C) 2019
+# All rights reserved.
+#
+# Licensed to the E-ARK project under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The E-ARK project licenses
+# this file to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+E-ARK : Information package validation
+        Schematron profile benchmark
+
+Compares parse time, validation time and peak RSS for the ValidationProfile
+modes on a generated METS file:
+
+    python benchmarks/bench_profile.py --files 100000
+"""
+import argparse
+import os.path
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# pylint: disable-msg=C0413
+from benchmarks.utils import generate_mets, peak_rss_mb, run_isolated
+from ip_validation.infopacks.rules import ValidationProfile, ValidationRules, parse_document
+
+MODES = ['sections', 'once', 'threads', 'fused']
+
+def run_mode(mode, mets_path):
+    """Validate mets_path in the given mode, returns (parse secs, total secs)."""
+    parse_time = 0.0
+    start = time.perf_counter()
+    if mode == 'sections':
+        # Pre profile behaviour, every ruleset parses the document itself.
+        for section in ValidationProfile.SECTIONS:
+            rules = ValidationRules(section)
+            parse_start = time.perf_counter()
+            xml_file = parse_document(mets_path)
+            parse_time += time.perf_counter() - parse_start
+            rules.validate(xml_file)
+            rules.get_report()
+    else:
+        profile = ValidationProfile(fused=mode == 'fused')
+        parse_start = time.perf_counter()
+        xml_file = parse_document(mets_path)
+        parse_time = time.perf_counter() - parse_start
+        profile.validate(xml_file, workers=len(ValidationProfile.SECTIONS)
+                         if mode == 'threads' else 1)
+        print('{:<10} sections {}'.format(mode, ', '.join(
+            '{} {:.3f}s'.format(name, secs) for name, secs in profile.timings.items())))
+    return parse_time, time.perf_counter() - start
+
+def main():
+    """Run the benchmark, each mode in its own interpreter."""
+    parser = argparse.ArgumentParser(description='ValidationProfile benchmark.')
+    parser.add_argument('--files', type=int, default=10000,
+                        help='Number of mets:file entries in the generated METS.')
+    parser.add_argument('--mode', choices=MODES, help='Run a single mode in process.')
+    parser.add_argument('--mets', help='Existing METS file to validate.')
+    args = parser.parse_args()
+    if args.mode:
+        parse_time, total_time = run_mode(args.mode, args.mets)
+        print('{:<10} parse {:8.3f}s  total {:8.3f}s  peak RSS {:8.1f}MB'.format(
+            args.mode, parse_time, total_time, peak_rss_mb()))
+        return
+    with tempfile.TemporaryDirectory() as temp_dir:
+        mets_path = generate_mets(os.path.join(temp_dir, 'METS.xml'), args.files)
+        print('METS with {} extra files, {:.1f}MB'.format(
+            args.files, os.path.getsize(mets_path) / (1024 * 1024)))
+        for mode in MODES:
+            print(run_isolated(__file__, '--mode', mode, '--mets', mets_path))
+
+if __name__ == "__main__":
+    main()
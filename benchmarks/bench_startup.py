@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# coding=UTF-8
+#
+# E-ARK Validation
+# Copyright (C) 2019
+# All rights reserved.
+#
+# Licensed to the E-ARK project under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The E-ARK project licenses
+# this file to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+E-ARK : Information package validation
+        ip-check start-up benchmark
+
+Measures the import time of the ip-check module, from python -X importtime,
+listing the slowest imports, and the time to first result of ip-check on a
+single small package, each run in a fresh interpreter:
+
+    python benchmarks/bench_startup.py --runs 10
+
+Exits with an error if the median time to first result exceeds --max-ms.
+"""
+import argparse
+import os.path
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULE = 'ip_validation.cli.app'
+PACKAGE = os.path.join(ROOT, 'tests', 'resources', 'ips', 'minimal', 'minimal_IP_with_schemas.zip')
+
+def import_times():
+    """Import MODULE in a fresh interpreter, returns a list of (cumulative
+    microseconds, module name) tuples, slowest first."""
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + MODULE],
+                            check=True, cwd=ROOT, stderr=subprocess.PIPE,
+                            universal_newlines=True).stderr
+    times = []
+    for line in output.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split('|')
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            times.append((int(fields[1]), fields[2].strip()))
+    return sorted(times, reverse=True)
+
+def first_result_secs(package):
+    """Return the seconds from starting ip-check on package to its first line
+    of output."""
+    start = time.perf_counter()
+    with subprocess.Popen([sys.executable, '-m', MODULE, package], cwd=ROOT,
+                          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                          universal_newlines=True) as check:
+        check.stdout.readline()
+        elapsed = time.perf_counter() - start
+        check.communicate()
+    return elapsed
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description='ip-check start-up benchmark.')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Number of ip-check runs to time.')
+    parser.add_argument('--top', type=int, default=15,
+                        help='Number of the slowest imports to list.')
+    parser.add_argument('--package', default=PACKAGE, help='Package to check.')
+    parser.add_argument('--max-ms', type=float,
+                        help='Largest acceptable median time to first result in ms.')
+    args = parser.parse_args()
+    times = import_times()
+    print('Import {} {:.1f}ms, slowest imports:'.format(MODULE, times[0][0] / 1000))
+    for cumulative, name in times[1:args.top + 1]:
+        print('  {:8.1f}ms  {}'.format(cumulative / 1000, name))
+    runs = sorted(first_result_secs(args.package) * 1000 for _ in range(args.runs))
+    median = statistics.median(runs)
+    print('Time to first result over {} runs: min {:.1f}ms  median {:.1f}ms  max {:.1f}ms'.format(
+        args.runs, runs[0], median, runs[-1]))
+    if args.max_ms is not None and median > args.max_ms:
+        sys.exit('ip-check start-up exceeded {:.1f}ms.'.format(args.max_ms))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# coding=UTF-8
+#
+# E-ARK Validation
+# Copyright (C) 2019
+# All rights reserved.
+#
+# Licensed to the E-ARK project under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The E-ARK project licenses
+# this file to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+E-ARK : Information package validation
+        Benchmark utilities, METS generation and resource measurement
+"""
+import os.path
+import resource
+import subprocess
+import sys
+
+from lxml import etree
+
+METS_NS = 'http://www.loc.gov/METS/'
+XLINK_NS = 'http://www.w3.org/1999/xlink'
+TEMPLATE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        'tests', 'resources', 'xml', 'METS-valid.xml')
+
+FILE_ENTRY = ('<{mets}file ID="ID-bench-{index}" MIMETYPE="text/plain" SIZE="0" '
+              'CREATED="2020-01-01T00:00:00" '
+              'CHECKSUM="da39a3ee5e6b4b0d3255bfef95601890afd80709" CHECKSUMTYPE="SHA-1">'
+              '<{mets}FLocat LOCTYPE="URL" {xlink}:type="simple" '
+              '{xlink}:href="data/{index}.txt"/></{mets}file>\n')
+DIV_ENTRY = ('<{mets}div LABEL="data/{index}.txt"><{mets}fptr FILEID="ID-bench-{index}"/>'
+             '</{mets}div>\n')
+MARKER = 'bench-entries'
+
+def generate_mets(dest, file_count, divs=False):
+    """Write a METS file to dest that's a copy of the valid METS test file with
+    file_count extra mets:file entries in its first file group, and if divs is
+    True a structural map div pointing to each of them. The entries are
+    written as they're generated so METS files with millions of entries can be
+    created without holding them in memory."""
+    tree = etree.parse(TEMPLATE)
+    file_grp = tree.find('.//{{{}}}fileGrp'.format(METS_NS))
+    prefixes = {'mets': file_grp.prefix + ':' if file_grp.prefix else '',
+                'xlink': next(prefix for prefix, uri in file_grp.nsmap.items()
+                              if uri == XLINK_NS)}
+    templates = [FILE_ENTRY]
+    file_grp.append(etree.Comment(MARKER))
+    if divs:
+        templates.append(DIV_ENTRY)
+        tree.find('.//{{{0}}}structMap/{{{0}}}div'.format(METS_NS)).append(
+            etree.Comment(MARKER))
+    parts = etree.tostring(tree, xml_declaration=True,
+                           encoding='UTF-8').split('<!--{}-->'.format(MARKER).encode())
+    with open(dest, 'wb') as dest_file:
+        for part, template in zip(parts, templates):
+            dest_file.write(part)
+            for index in range(file_count):
+                dest_file.write(template.format(index=index, **prefixes).encode())
+        dest_file.write(parts[-1])
+    return dest
+
+def peak_rss_mb():
+    """Return the peak resident set size of this process in MB."""
+    # ru_maxrss is KB on Linux, bytes on macOS.
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor
+
+def run_isolated(script, *args):
+    """Run a benchmark script in a fresh interpreter so that peak RSS figures are
+    not polluted by earlier runs, returns the script output."""
+    output = subprocess.run([sys.executable, script] + [str(arg) for arg in args],
+                            check=True, stdout=subprocess.PIPE, universal_newlines=True)
+    return output.stdout.strip()
@@ -25,6 +25,13 @@
 """
 E-ARK : Python information package validation
 
-Initialisation module for package, kicks of the flask app.
+Initialisation module for package. The flask app is created by create_app(),
+which flask finds for FLASK_APP='ip_validation', so the command line tools
+don't load flask and its configuration. WSGI servers can use the
+'ip_validation:create_app()' factory or 'ip_validation.webapp:APP'.
 """
-from .webapp import APP
+
+def create_app():
+    """Return the flask app, creating it on the first call."""
+    from .webapp import APP # pylint: disable-msg=C0415
+    return APP
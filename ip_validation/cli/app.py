@@ -27,15 +27,32 @@ E-ARK : Information package validation
         Command line validation application
 """
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from functools import lru_cache, partial
+import io
+import json
 from pprint import pprint
 import os.path
 import sys
 
+from lxml import etree
+
 import ip_validation.cli.testcases as TC
+from ip_validation.infopacks.fixity import FixityCache
 import ip_validation.infopacks.information_package as IP
+from ip_validation.infopacks.workspace import WORKSPACE
+from ip_validation.validator import PackageValidator
 
 __version__ = "0.1.0"
 
+FIXITY_DB = 'fixity.db'
+
+TEXT = 'text'
+JSONL = 'jsonl'
+XML = 'xml'
+FORMATS = [TEXT, JSONL, XML]
+
 defaults = {
     'description': """E-ARK Information Package validation (ip-check).
 ip-check is a command-line tool to analyse and validate the structure and
@@ -70,6 +87,31 @@ def parse_command_line():
                         dest="inputChecksumFlag",
                         default=False,
                         help="Calculate and verify file checksums in packages.")
+    PARSER.add_argument('--no-fixity-cache',
+                        action="store_false",
+                        dest="fixityCache",
+                        default=True,
+                        help="Hash every file, rather than reusing digests of unchanged "
+                             "files from previous runs.")
+    PARSER.add_argument('--jobs', '-j',
+                        type=int,
+                        dest="jobs",
+                        default=1,
+                        metavar='N',
+                        help="Validate N packages at once in separate processes, "
+                             "0 for one per CPU.")
+    PARSER.add_argument('--completion-order',
+                        action="store_true",
+                        dest="completionOrder",
+                        default=False,
+                        help="With --jobs, report packages as they finish rather than in "
+                             "the order given.")
+    PARSER.add_argument('--format', '-f',
+                        choices=FORMATS,
+                        dest="format",
+                        default=TEXT,
+                        help="Report format, jsonl and xml write one record per package "
+                             "as soon as it's validated.")
     PARSER.add_argument('--verbose', '-v',
                         action="store_true",
                         dest="outputVerboseFlag",
@@ -98,64 +140,204 @@ def main():
     if not args.files:
         PARSER.print_help()
 
+    if args.format == XML:
+        sys.stdout.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                         '<ipCheck version="{}">\n'.format(__version__))
     # Iterate the file arguments
-    for file_arg in args.files:
-        _loop_exit = 0
-        if args.testCase:
-            _loop_exit = _validate_test_case(file_arg)
-        else:
-            _loop_exit = _validate_ip(file_arg)
+    for _loop_exit, output in check_files(args.files, test_case=args.testCase,
+                                          jobs=args.jobs or os.cpu_count(),
+                                          completion_order=args.completionOrder,
+                                          report_format=args.format,
+                                          checksums=args.inputChecksumFlag,
+                                          fixity_cache=args.fixityCache):
+        sys.stdout.write(output)
+        sys.stdout.flush()
         _exit = _loop_exit if (_loop_exit > 0) else _exit
+    if args.format == XML:
+        sys.stdout.write('</ipCheck>\n')
     sys.exit(_exit)
 
-def _validate_ip(info_pack):
-    ret_stat, to_validate = _get_ip_root(info_pack)
-    struct_details = IP.validate_package_structure(to_validate)
-    pprint('Path {} is dir, struct result is: {}'.format(to_validate,
-                                                         struct_details.structure_status))
-    for error in struct_details.errors:
-        pprint(error.to_json())
+def check_files(files, test_case=False, jobs=1, completion_order=False, report_format=TEXT,
+                checksums=False, fixity_cache=False):
+    """Validate the packages, or test cases, in files on a pool of jobs processes.
+    Yields an (exit status, report output) tuple per file, in the order of files
+    or in completion_order. Output is in report_format, one record per package
+    for jsonl and xml. File checksums are verified if checksums is True, with
+    digests of unchanged files reused from the workspace cache if fixity_cache
+    is True."""
+    check = partial(_check_file, test_case=test_case, report_format=report_format,
+                    checksums=checksums, fixity_cache=fixity_cache)
+    if jobs < 2:
+        for file_arg in files:
+            yield check(file_arg)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        if completion_order:
+            for future in as_completed([executor.submit(check, file_arg) for file_arg in files]):
+                yield future.result()
+        else:
+            yield from executor.map(check, files)
+
+def _check_file(file_arg, test_case=False, report_format=TEXT, checksums=False,
+                fixity_cache=False):
+    # Capture the report so output from parallel jobs isn't interleaved
+    output = io.StringIO()
+    validator = _validator(checksums, fixity_cache)
+    with redirect_stdout(output):
+        if test_case:
+            ret_stat = _validate_test_case(file_arg, validator, report_format)
+        else:
+            ret_stat, _ = _validate_ip(file_arg, validator, report_format)
+    return ret_stat, output.getvalue()
+
+@lru_cache(maxsize=None)
+def _validator(checksums=False, fixity_cache=False):
+    # One validator per process, so the profile is reused for every package
+    cache = FixityCache(os.path.join(WORKSPACE.root, FIXITY_DB)) \
+        if checksums and fixity_cache else None
+    return PackageValidator(checksums=checksums, fixity_cache=cache)
+
+def _validate_ip(info_pack, validator, report_format=TEXT):
+    ret_stat, to_validate, message = _get_ip_root(info_pack)
+    if ret_stat > 0:
+        _write_record(info_pack, ret_stat, None, message, report_format)
+        return ret_stat, None
+    report = validator.validate(to_validate)
+    _write_record(info_pack, ret_stat, report, None, report_format)
+    return ret_stat, report
+
+def _write_record(info_pack, ret_stat, report, message, report_format):
+    if report_format == JSONL:
+        print(json.dumps(_to_record(info_pack, ret_stat, report, message)))
+    elif report_format == XML:
+        print(etree.tostring(_to_xml(info_pack, ret_stat, report, message),
+                             encoding='unicode'))
+    elif report is None:
+        pprint(message)
+    else:
+        pprint('Path {} is dir, struct result is: {}'.format(
+            info_pack, report['package']['structure_status']))
+        for error in report['package']['errors']:
+            pprint(error)
+        if report['package']['manifest_status'] != IP.ManifestStatus.Unknown.name:
+            pprint('Manifest status: {}'.format(report['package']['manifest_status']))
+            for error in report['manifest_errors']:
+                pprint(error)
+            if 'fixity_cache' in report:
+                pprint('Fixity cache: {hits} hits, {misses} misses'.format(
+                    **report['fixity_cache']))
+        if report['schema_valid'] is not None:
+            pprint('METS schema valid: {}'.format(report['schema_valid']))
+            for error in report['schema_errors']:
+                pprint(error)
+        if report['metadata_valid'] is not None:
+            pprint('Metadata profile valid: {}'.format(report['metadata_valid']))
+            for result in report['profile_results'].values():
+                for issue in result['failures'] + result['warnings']:
+                    pprint(issue)
+        for rep in report['representations']:
+            if rep['metadata_valid'] is not None:
+                pprint('{} metadata profile valid: {}'.format(rep['mets'],
+                                                              rep['metadata_valid']))
+                for result in rep['profile_results'].values():
+                    for issue in result['failures'] + result['warnings']:
+                        pprint(issue)
+
+def _to_record(info_pack, ret_stat, report, message):
+    record = {'file': info_pack, 'exit_status': ret_stat, 'message': message, 'package': None}
+    if report:
+        record.update(report)
+    return record
+
+def _to_xml(info_pack, ret_stat, report, message):
+    package = etree.Element('package', file=info_pack, exitStatus=str(ret_stat))
+    if message:
+        etree.SubElement(package, 'message').text = message
+    if report is None:
+        return package
+    details = report['package']
+    package.set('name', details['name'])
+    package.set('structureStatus', details['structure_status'])
+    package.set('manifestStatus', details['manifest_status'])
+    for error in details['errors']:
+        error_ele = etree.SubElement(package, 'error', ruleId=error['rule_id'],
+                                     severity=error['severity'])
+        etree.SubElement(error_ele, 'message').text = error['message']
+        etree.SubElement(error_ele, 'subMessage').text = error['sub_message']
+    for error in report['manifest_errors']:
+        etree.SubElement(package, 'manifestError').text = error
+    if 'fixity_cache' in report:
+        etree.SubElement(package, 'fixityCache', hits=str(report['fixity_cache']['hits']),
+                         misses=str(report['fixity_cache']['misses']))
+    if report['schema_valid'] is not None:
+        schema = etree.SubElement(package, 'schema', valid=_xml_bool(report['schema_valid']))
+        for error in report['schema_errors']:
+            etree.SubElement(schema, 'error').text = error
+    if report['metadata_valid'] is not None:
+        _add_profile(package, report)
+    for rep in report['representations']:
+        rep_ele = etree.SubElement(package, 'representation', name=rep['representation'],
+                                   mets=rep['mets'], schemaValid=_xml_bool(rep['schema_valid']))
+        if rep['metadata_valid'] is not None:
+            _add_profile(rep_ele, rep)
+    return package
+
+def _add_profile(parent, report):
+    profile = etree.SubElement(parent, 'profile', valid=_xml_bool(report['metadata_valid']))
+    for name, result in report['profile_results'].items():
+        section = etree.SubElement(profile, 'section', name=name,
+                                   valid=_xml_bool(result['is_valid']))
+        for issue in result['failures'] + result['warnings']:
+            etree.SubElement(section, 'issue', ruleId=issue['rule_id'],
+                             severity=issue['severity'], location=issue['location'],
+                             test=issue['test']).text = issue['message']
+
+def _xml_bool(value):
+    return 'true' if value else 'false'
 
-    return ret_stat, struct_details
+def _write_message(message, report_format):
+    # Notes aren't package records so go to stderr for machine readable formats
+    if report_format == TEXT:
+        pprint(message)
+    else:
+        sys.stderr.write(message + '\n')
 
-def _validate_test_case(test_case):
+def _validate_test_case(test_case, validator, report_format=TEXT):
     case = TC.TestCase.from_xml_file(test_case)
     ret_val = 0
     if not case.testable:
         if not case.unknown:
             # don't ouput UNKNOWN testablitiy test cases, do output FALSE cases
-            pprint('{}:{} not testable.'.format(case.case_id.specification,
-                                                  case.case_id.requirement_id))
+            _write_message('{}:{} not testable.'.format(case.case_id.specification,
+                                                        case.case_id.requirement_id),
+                           report_format)
         return 0
     for rule in case.rules:
         for package in rule.packages:
             if package.implemented:
                 package_path = os.path.join(os.path.dirname(test_case), package.name)
-                ret_val, struct_details = _validate_ip(package_path)
+                ret_val, _ = _validate_ip(package_path, validator, report_format)
             else:
-                pprint('{}:{}, package:{} is not implemented.'.format(case.case_id.specification,
-                                                      case.case_id.requirement_id, package.name))
+                _write_message('{}:{}, package:{} is not implemented.'.format(
+                    case.case_id.specification, case.case_id.requirement_id, package.name),
+                               report_format)
 
     return ret_val
 
 def _get_ip_root(info_pack):
-    arch_processor = IP.ArchivePackageHandler()
     # This is a var for the final source to validate
     to_validate = info_pack
 
     if not os.path.exists(info_pack):
         # Skip files that don't exist
-        pprint('Path {} does not exist'.format(info_pack))
-        return 1, None
+        return 1, None, 'Path {} does not exist'.format(info_pack)
     if os.path.isfile(info_pack):
         # Check if file is a archive format
         if not IP.ArchivePackageHandler.is_archive(info_pack):
             # If not we can't process so report and iterate
-            pprint('Path {} is not a file we can process.'.format(info_pack))
-            return 2, None
-        # Unpack the archive and set the source
-        to_validate = arch_processor.unpack_package(info_pack)
-    return 0, to_validate
+            return 2, None, 'Path {} is not a file we can process.'.format(info_pack)
+        # Archives are validated from their member listing, no need to unpack
+    return 0, to_validate, None
 
 # def _test_case_schema_checks():
 if __name__ == "__main__":
@@ -27,13 +27,25 @@ E-ARK : Information package validation
         E-ARK Test Corpus processing
 """
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+import hashlib
+import json
+import logging
 import os.path
 import sys
+import time
 
 from jinja2 import Environment, PackageLoader
-from ip_validation.cli.testcases import TestCase, DEFAULT_NAME
+from ip_validation.cli.testcases import TestCase, DEFAULT_NAME, Outcome
+from ip_validation.infopacks.information_package import StructureStatus
+from ip_validation.validator import PackageValidator
+import ip_validation.utils as UTILS
 
 __version__ = "0.1.0"
+MANIFEST_VERSION = 1
+# Directories scanned between progress reports
+PROGRESS_INTERVAL = 1000
 
 defaults = {
     'description': """E-ARK Test Case validation (tc-check).
@@ -49,11 +61,20 @@ Maintainer: Carl Wilson (OPF), 2020"""
 class Corpus():
     """
     Encapsulates a test corpus of E-ARK information packages.
+
+    Test cases are parsed and schema validated once, on first access, and
+    held in memory indexed by requirement id. The rule and package counts
+    are totalled as the cases are loaded.
     """
     def __init__(self, name, root, test_cases=None):
         self._name = name
         self._root = root
-        self._test_cases = [] if test_cases is None else test_cases
+        self._case_dirs = [] if test_cases is None else test_cases
+        self._test_cases = None
+        self._index = {}
+        self._rule_count = 0
+        self._package_count = 0
+        self._missing_package_count = 0
 
     @property
     def name(self):
@@ -65,89 +86,272 @@ class Corpus():
         """Return the corpus' root directory path."""
         return self._root
 
+    @property
+    def case_dirs(self):
+        """Return the directories holding the corpus' test case files."""
+        return self._case_dirs
+
     @property
     def test_cases(self):
-        """Generator to return test cases in a iterable form."""
-        for case in self._test_cases:
-            yield TestCase.from_xml_file(os.path.join(case, DEFAULT_NAME))
+        """Return the list of the corpus' test cases."""
+        self._load()
+        return self._test_cases
+
+    def get_test_case(self, requirement_id):
+        """Return the test case for requirement_id, or None if there isn't one."""
+        self._load()
+        return self._index.get(requirement_id)
 
     @property
     def case_count(self):
         """Return the number of test cases in the corpus."""
-        return len(self._test_cases)
+        return len(self._case_dirs)
 
     @property
     def rule_count(self):
         """Return the total number of validation rules in the corpus."""
-        count = 0
-        for case in self.test_cases:
-            count+=len(case.rules)
-        return count
+        self._load()
+        return self._rule_count
 
     @property
     def package_count(self):
         """Return the total number of test packages in the corpus."""
-        count = 0
-        for case in self.test_cases:
-            count+=case.package_count
-        return count
+        self._load()
+        return self._package_count
 
     @property
     def missing_package_count(self):
-        """Return the total number of test packages in the corpus."""
-        count = 0
-        for case in self.test_cases:
-            count+=case.missing_package_count
-        return count
+        """Return the total number of test packages missing from the corpus."""
+        self._load()
+        return self._missing_package_count
+
+    def outcome_count(self, outcome):
+        """Return the number of corpus packages with the given Outcome."""
+        return sum(case.outcome_count(outcome) for case in self.test_cases)
+
+    def _load(self):
+        if self._test_cases is not None:
+            return
+        test_cases = []
+        for case_dir in self._case_dirs:
+            case = TestCase.from_xml_file(os.path.join(case_dir, DEFAULT_NAME))
+            test_cases.append(case)
+            if case.case_id is not None:
+                self._index[case.case_id.requirement_id] = case
+            self._rule_count += len(case.rules)
+            self._package_count += case.package_count
+            self._missing_package_count += case.missing_package_count
+        self._test_cases = test_cases
 
     @classmethod
-    def from_root(cls, root, name):
-        """Create a new corpus instance from a root directory."""
+    def from_root(cls, root, name, manifest=None, rescan=False, progress=None):
+        """Create a new corpus instance from a root directory.
+
+        If a manifest path is supplied the test cases it lists for root are
+        used, if there are none, or rescan is True, the discovered test cases
+        are saved to it. progress is passed to the discovery walk."""
         if not os.path.exists(root) or not os.path.isdir(root):
             print('submitted path not a dir')
             return None
-        cases = _get_test_cases(root)
+        cases = _load_manifest(manifest, root) if manifest and not rescan else None
+        if cases is None:
+            cases = _get_test_cases(root, progress)
+            if manifest:
+                _save_manifest(manifest, root, cases)
         return cls(name, root, cases)
 
+def run_corpus(corpus, jobs=1):
+    """Validate the existing, implemented packages of the corpus' testable cases
+    on a pool of jobs processes. Each package is validated once, however many
+    rules use it. The report is stored on every rule package for the path,
+    along with the Outcome of comparing it to the rule's expected result.
+    Returns a dictionary of the number of packages with each Outcome."""
+    to_run = []
+    for case in corpus.test_cases:
+        if not case.testable:
+            continue
+        for rule in case.rules:
+            for package in rule.packages:
+                if package.implemented == 'TRUE' and package.exists:
+                    to_run.append((case, rule, package))
+    paths = sorted({package.path for _, _, package in to_run})
+    if jobs > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            reports = dict(zip(paths, executor.map(_validate_package, paths)))
+    else:
+        reports = {path: _validate_package(path) for path in paths}
+    counts = {outcome.name: 0 for outcome in Outcome}
+    for case, rule, package in to_run:
+        package.validation_report = reports[package.path]
+        package.outcome = package_outcome(case, rule, package)
+        counts[package.outcome.name] += 1
+    return counts
+
+def package_outcome(case, rule, package):
+    """Compare a package's validation report with the result its test case rule
+    expects. Rules with an ERROR level expect invalid packages to fail
+    validation. For WARNING and INFO rules the package stays valid, so invalid
+    packages are expected to raise an issue with the requirement's id."""
+    report = package.validation_report
+    if report is None:
+        return None
+    if 'error' in report:
+        return Outcome.Error
+    expected_valid = package.is_valid == 'TRUE'
+    level = rule.error.level if rule.error is not None else 'ERROR'
+    if level == 'ERROR':
+        actual_valid = _is_valid(report)
+    else:
+        actual_valid = not any(issue['rule_id'] == case.case_id.requirement_id
+                               for issue in _issues(report))
+    return Outcome.Pass if actual_valid == expected_valid else Outcome.Fail
+
+def _is_valid(report):
+    return report['package']['structure_status'] == StructureStatus.WellFormed.name and \
+        report['schema_valid'] is True and report['metadata_valid'] is True
+
+def _issues(report):
+    issues = list(report['package']['errors'])
+    for profile in [report['profile_results']] + [rep['profile_results'] for rep
+                                                  in report['representations']]:
+        for result in profile.values():
+            issues.extend(result['failures'] + result['warnings'])
+    return issues
+
+def _validate_package(path):
+    # Runs in worker processes, failures are reported rather than ending the run
+    try:
+        return _package_validator().validate(path)
+    except Exception as err: # pylint: disable-msg=W0703
+        return {'error': '{}: {}'.format(type(err).__name__, err)}
+
+@lru_cache(maxsize=None)
+def _package_validator():
+    # One validator per process, compiled validators are shared by its packages
+    return PackageValidator()
+
 ROOT = os.path.dirname(os.path.abspath(__file__))
 templates_dir = os.path.join(ROOT, 'templates')
-env = Environment( loader = PackageLoader('ip_validation.cli') )
+# Hashes of the inputs of rendered pages, stored in the results folder
+HASHES_NAME = '.tc-check-hashes.json'
+
+def render_corpus(root, corpus, jobs=1):
+    """Write the HTML pages for a corpus and its test cases to root, rendering
+    the test case pages on a pool of jobs processes. The pages of test cases
+    whose inputs, the test case file, package paths and templates, are
+    unchanged since the last run aren't rendered again. Returns a tuple of the
+    number of test cases (rendered, skipped)."""
+    _mkdirs(root)
+    hashes_path = os.path.join(root, HASHES_NAME)
+    old_hashes = _read_hashes(hashes_path)
+    hashes = {}
+    to_render = []
+    case_keys = []
+    for case_dir, case in zip(corpus.case_dirs, corpus.test_cases):
+        key = _case_key(case_dir, case)
+        case_keys.append(key)
+        if case.case_id is None or case.case_id.requirement_id is None:
+            continue
+        page = os.path.join(case.case_id.requirement_id, 'index.html')
+        hashes[page] = key
+        if old_hashes.get(page) != key or not os.path.isfile(os.path.join(root, page)):
+            to_render.append(case)
+    if jobs > 1 and len(to_render) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for _ in executor.map(partial(case_html, root), to_render, chunksize=16):
+                pass
+    else:
+        for case in to_render:
+            case_html(root, case)
+    index_key = _digest([_templates_digest(), corpus.name.encode()] +
+                        [key.encode() for key in case_keys])
+    hashes['index.html'] = index_key
+    if old_hashes.get('index.html') != index_key or \
+        not os.path.isfile(os.path.join(root, 'index.html')):
+        corpus_html(root, corpus)
+    # Keep the hashes of cases from other corpora rendered to the same folder
+    old_hashes.update(hashes)
+    _write_atomic(hashes_path, json.dumps(old_hashes, indent=2, sort_keys=True))
+    return len(to_render), len(hashes) - 1 - len(to_render)
 
 def corpus_html(root, corpus):
     """Write an HTML file summarising a corpus."""
-    template = env.get_template('corpus.html')
     _mkdirs(root)
-    with open(os.path.join(root, 'index.html'), 'w') as filehand:
-        filehand.write(template.render(
-            corpus = corpus,
-        ))
+    _write_atomic(os.path.join(root, 'index.html'), _template('corpus.html').render(
+        corpus = corpus,
+        outcomes = Outcome,
+    ))
 
 def case_html(root, case):
     """Write an HTML file summarising a test case."""
     if case is None or case.case_id is None or case.case_id.requirement_id is None:
         return
-    template = env.get_template('case.html')
     out_dir = os.path.join(root, case.case_id.requirement_id)
     _mkdirs(out_dir)
-    with open(os.path.join(out_dir, 'index.html'), 'w') as filehand:
-        filehand.write(template.render(
-            case = case,
-        ))
+    _write_atomic(os.path.join(out_dir, 'index.html'), _template('case.html').render(
+        case = case,
+    ))
     for rule in case.rules:
         for package in rule.packages:
             package_html(out_dir, case, rule, package)
 
 def package_html(root, case, rule, package):
     """Write an HTML file summarising a package."""
-    template = env.get_template('package.html')
     out_dir = os.path.join(root, package.name)
     _mkdirs(out_dir)
-    with open(os.path.join(out_dir, 'index.html'), 'w') as filehand:
-        filehand.write(template.render(
-            case = case,
-            rule = rule,
-            package = package,
-        ))
+    _write_atomic(os.path.join(out_dir, 'index.html'), _template('package.html').render(
+        case = case,
+        rule = rule,
+        package = package,
+    ))
+
+@lru_cache(maxsize=None)
+def _environment():
+    # Created on first render, templates are compiled once per process and
+    # auto_reload would stat them on every fetch
+    return Environment(loader=PackageLoader('ip_validation.cli'), auto_reload=False)
+
+@lru_cache(maxsize=None)
+def _template(name):
+    return _environment().get_template(name)
+
+@lru_cache(maxsize=None)
+def _templates_digest():
+    # Any template change, including the shared base pages, changes every page
+    env = _environment()
+    return _digest([__version__.encode()] +
+                   [env.loader.get_source(env, name)[0].encode()
+                    for name in sorted(env.loader.list_templates())])
+
+def _case_key(case_dir, case):
+    """Return a hash of everything that feeds a test case's pages."""
+    with open(os.path.join(case_dir, DEFAULT_NAME), 'rb') as case_file:
+        parts = [_templates_digest(), os.path.abspath(case_dir).encode(), case_file.read()]
+    # Package pages show whether the package exists and its validation results
+    packages = [package for rule in case.rules for package in rule.packages]
+    parts.append(bytes(package.exists for package in packages))
+    parts.append(json.dumps([[package.outcome.name if package.outcome else None,
+                              package.validation_report] for package in packages],
+                            sort_keys=True))
+    return _digest(parts)
+
+def _digest(parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else part.encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def _read_hashes(hashes_path):
+    try:
+        with open(hashes_path) as hashes_file:
+            hashes = json.load(hashes_file)
+    except (OSError, ValueError):
+        return {}
+    return hashes if isinstance(hashes, dict) else {}
+
+def _write_atomic(path, text):
+    UTILS.write_atomic(path, lambda out_file: out_file.write(text), mode='w')
 
 def _mkdirs(_dir):
     try:
@@ -157,16 +361,76 @@ def _mkdirs(_dir):
         pass
 
 
-def _get_test_cases(root):
+def _get_test_cases(root, progress=None):
+    """Return the directories below root holding a test case file, found in a
+    single scandir walk that doesn't descend into package payloads. If supplied
+    progress is called with the number of directories scanned and the number
+    of test cases found after each directory."""
     cases = []
-    for rootdir, subdirs, files in os.walk(root):
-        for file in files:
-            if file == DEFAULT_NAME:
-                cases.append(rootdir)
-        for subdir in subdirs:
-            cases+=(_get_test_cases(subdir))
+    to_scan = [root]
+    scanned = 0
+    while to_scan:
+        current = to_scan.pop()
+        subdirs = []
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not _is_payload(current, entry.name):
+                            subdirs.append(entry.path)
+                    elif entry.name == DEFAULT_NAME:
+                        cases.append(current)
+        except OSError as os_err:
+            logging.warning("Couldn't scan corpus directory %s: %s", current, os_err)
+        scanned += 1
+        if progress:
+            progress(scanned, len(cases))
+        # Reverse sorted so the walk pops directories in name order
+        to_scan.extend(sorted(subdirs, reverse=True))
     return cases
 
+def _is_payload(parent, name):
+    # representations/<rep>/data folders hold package content, not test cases
+    return name == 'data' and \
+        os.path.basename(os.path.dirname(parent)) == 'representations'
+
+def _read_manifest(manifest):
+    # A manifest maps absolute corpus roots to their test case directories
+    try:
+        with open(manifest) as manifest_file:
+            contents = json.load(manifest_file)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(contents, dict) or contents.get('version') != MANIFEST_VERSION or \
+        not isinstance(contents.get('corpora'), dict):
+        return {}
+    return contents['corpora']
+
+def _load_manifest(manifest, root):
+    """Return the test case directories listed in the manifest for root, or None
+    if there's no readable entry for it. Cases whose test case file has gone are
+    dropped."""
+    cases = _read_manifest(manifest).get(os.path.abspath(root))
+    if not isinstance(cases, list):
+        return None
+    cases = [os.path.join(root, case) for case in cases]
+    return [case for case in cases if os.path.isfile(os.path.join(case, DEFAULT_NAME))]
+
+def _save_manifest(manifest, root, cases):
+    """Write the test case directories, relative to root, to the manifest entry
+    for root, keeping the entries of other corpora."""
+    corpora = _read_manifest(manifest)
+    corpora[os.path.abspath(root)] = [os.path.relpath(case, root) for case in cases]
+    manifest_dir = os.path.dirname(os.path.abspath(manifest))
+    _mkdirs(manifest_dir)
+    _write_atomic(manifest, json.dumps({'version': MANIFEST_VERSION, 'corpora': corpora},
+                                       indent=2))
+
+def _print_progress(scanned, found):
+    if scanned % PROGRESS_INTERVAL == 0:
+        sys.stderr.write('\rScanned {} directories, found {} test cases'.format(scanned, found))
+        sys.stderr.flush()
+
 # Create PARSER
 PARSER = argparse.ArgumentParser(description=defaults['description'], epilog=defaults['epilog'])
 
@@ -178,6 +442,27 @@ def parse_command_line():
                         dest="outputVerboseFlag",
                         default=False,
                         help="report results in verbose format")
+    PARSER.add_argument('--jobs', '-j',
+                        type=int,
+                        dest="jobs",
+                        default=0,
+                        metavar='N',
+                        help="Render test case pages in N separate processes, "
+                             "0 for one per CPU.")
+    PARSER.add_argument('--no-validate',
+                        action="store_false",
+                        dest="validate",
+                        default=True,
+                        help="only render the corpus test cases, don't validate packages")
+    PARSER.add_argument('--manifest',
+                        dest="manifest",
+                        metavar='MANIFEST',
+                        help="read discovered test cases from, or save them to, a JSON manifest")
+    PARSER.add_argument('--rescan',
+                        action="store_true",
+                        dest="rescan",
+                        default=False,
+                        help="discover test cases again, updating any manifest")
     PARSER.add_argument('--version',
                         action='version',
                         version=__version__)
@@ -204,10 +489,26 @@ def main():
 
     # Iterate the file arguments
     for file_arg in args.files:
-        corpus = Corpus.from_root(file_arg, 'CSIP')
-        corpus_html('results', corpus)
-        for case in corpus.test_cases:
-            case_html('results', case)
+        progress = _print_progress if args.outputVerboseFlag else None
+        corpus = Corpus.from_root(file_arg, 'CSIP', manifest=args.manifest, rescan=args.rescan,
+                                  progress=progress)
+        if corpus is None:
+            _exit = 1
+            continue
+        if args.outputVerboseFlag:
+            sys.stderr.write('\n{}: {} test cases\n'.format(file_arg, corpus.case_count))
+        jobs = args.jobs or os.cpu_count()
+        if args.validate:
+            start = time.perf_counter()
+            counts = run_corpus(corpus, jobs=jobs)
+            print('{}: {} passed, {} failed, {} errors in {:.1f}s'.format(
+                file_arg, counts[Outcome.Pass.name], counts[Outcome.Fail.name],
+                counts[Outcome.Error.name], time.perf_counter() - start))
+            if counts[Outcome.Fail.name] or counts[Outcome.Error.name]:
+                _exit = 1
+        rendered, skipped = render_corpus('results', corpus, jobs=jobs)
+        if args.outputVerboseFlag:
+            sys.stderr.write('{} test cases rendered, {} unchanged\n'.format(rendered, skipped))
     sys.exit(_exit)
 
 if __name__ == "__main__":
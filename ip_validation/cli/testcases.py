@@ -26,6 +26,8 @@
 E-ARK : Information package validation
         E-ARK Test Case processing
 """
+from enum import Enum, unique
+from functools import lru_cache
 import os.path
 
 import lxml.etree as ET
@@ -34,7 +36,21 @@ from importlib_resources import files
 
 import ip_validation.cli.resources as RES
 DEFAULT_NAME='testCase.xml'
-TC_SCHEMA = ET.XMLSchema(file=str(files(RES).joinpath('testCase.xsd')))
+
+@lru_cache(maxsize=None)
+def get_tc_schema():
+    """Return the test case XML schema, compiled on the first call."""
+    return ET.XMLSchema(file=str(files(RES).joinpath('testCase.xsd')))
+
+@unique
+class Outcome(Enum):
+    """Result of validating a corpus package against its test case expectations."""
+    # Validation agreed with the expected result
+    Pass = 1
+    # Validation disagreed with the expected result
+    Fail = 2
+    # The package couldn't be validated
+    Error = 3
 
 class TestCase():
     """
@@ -117,6 +133,15 @@ class TestCase():
             count+=len(rule.missing_packages)
         return count
 
+    def outcome_count(self, outcome):
+        """Return the number of the test case's packages with the given Outcome."""
+        count = 0
+        for rule in self.rules:
+            for package in rule.packages:
+                if package.outcome == outcome:
+                    count+=1
+        return count
+
     def __str__(self):
         return "case_id:" + str(self.case_id) + ", testable:" + \
             str(self.testable) + ", requirement:" + self.requirement
@@ -333,6 +358,7 @@ class TestCase():
                 self._description = description
                 self._validation_report = validation_report
                 self._is_implemented = is_implemented
+                self._outcome = None
 
             @property
             def name(self):
@@ -347,9 +373,10 @@ class TestCase():
             def resolve_path(self, case_root):
                 """Resolve the path to the corpus package given the test case root."""
                 if self.path:
+                    corpus_path = self.path
                     self._path = os.path.join(case_root, self.name)
                     if not self.exists:
-                        self._path = os.path.join(case_root, self.path)
+                        self._path = os.path.join(case_root, corpus_path)
                 return self.path
 
             @property
@@ -379,6 +406,21 @@ class TestCase():
                 """Return the validation report for the package."""
                 return self._validation_report
 
+            @validation_report.setter
+            def validation_report(self, value):
+                self._validation_report = value
+
+            @property
+            def outcome(self):
+                """Return the Outcome of validating the package, None if it wasn't run."""
+                return self._outcome
+
+            @outcome.setter
+            def outcome(self, value):
+                if value is not None and not value in list(Outcome):
+                    raise ValueError("Illegal outcome value")
+                self._outcome = value
+
             @classmethod
             def from_element(cls, package_ele):
                 """Return a Package instance from an XML element."""
@@ -395,16 +437,18 @@ class TestCase():
                 return cls(name, path, is_valid, is_implemented, description)
 
     @classmethod
-    def from_xml_string(cls, xml, schema=TC_SCHEMA):
-        """Create a test case from an XML string."""
+    def from_xml_string(cls, xml, schema=None):
+        """Create a test case from an XML string, validated against the test case
+        schema unless another is supplied."""
         tree = ET.fromstring(xml)
-        return cls._from_xml(tree, schema)
+        return cls._from_xml(tree, schema if schema else get_tc_schema())
 
     @classmethod
-    def from_xml_file(cls, xml_file, schema=TC_SCHEMA):
-        """Create a test case from an XML file."""
+    def from_xml_file(cls, xml_file, schema=None):
+        """Create a test case from an XML file, validated against the test case
+        schema unless another is supplied."""
         tree = ET.parse(xml_file)
-        return  cls._from_xml(tree, schema, xml_file=xml_file)
+        return  cls._from_xml(tree, schema if schema else get_tc_schema(), xml_file=xml_file)
 
     @classmethod
     def _from_xml(cls, tree, schema, xml_file=None):
@@ -26,8 +26,6 @@
 import os.path
 import tempfile
 
-from flask_debugtoolbar import DebugToolbarExtension
-
 from .const import ENV_CONF_PROFILE, ENV_CONF_FILE
 
 HOST = 'localhost'
@@ -36,6 +34,7 @@ TEMP = tempfile.gettempdir()
 HOME = os.path.expanduser('~')
 LOG_ROOT = TEMP
 UPLOADS_TEMP = os.path.join(TEMP, 'ip-uploads')
+RESULTS_TEMP = os.path.join(TEMP, 'ip-results')
 class BaseConfig():# pylint: disable-msg=R0903
     """Base / default config, no debug logging and short log format."""
     NAME = 'Default'
@@ -49,6 +48,16 @@ class BaseConfig():# pylint: disable-msg=R0903
     MAX_CONTENT_LENGTH = 64 * 1024 * 1024
     UPLOAD_FOLDER = UPLOADS_TEMP
     ALLOWED_EXTENSIONS = {'zip', 'tar', 'gz', 'gzip'}
+    RESULTS_FOLDER = RESULTS_TEMP
+    RESULTS_MAX_ENTRIES = 1000
+    RESULTS_MAX_BYTES = 256 * 1024 * 1024
+    JOBS_DB = os.path.join(TEMP, 'ip-jobs.db')
+    JOB_WORKERS = 2
+    # Limits on what an uploaded archive may expand to
+    ARCHIVE_MAX_BYTES = 8 * 1024 * 1024 * 1024
+    ARCHIVE_MAX_MEMBERS = 1000000
+    ARCHIVE_MAX_RATIO = 200
+    ARCHIVE_MAX_DEPTH = 64
 
 class DevConfig(BaseConfig):# pylint: disable-msg=R0903
     """Developer level config, with debug logging and long log format."""
@@ -75,4 +84,8 @@ def configure_app(app, profile_name='dev'):
         app.config.from_envvar(ENV_CONF_FILE)
     if not os.path.exists(UPLOADS_TEMP):
         os.makedirs(UPLOADS_TEMP)
+    if not os.path.exists(app.config['RESULTS_FOLDER']):
+        os.makedirs(app.config['RESULTS_FOLDER'])
+    # To enable the debug toolbar, imported here so the app doesn't load it otherwise:
+    # from flask_debugtoolbar import DebugToolbarExtension
     # DebugToolbarExtension(app)
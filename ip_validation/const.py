@@ -26,6 +26,9 @@
 
 ENV_CONF_PROFILE = 'EARK_IPV_CONF_PROFILE'
 ENV_CONF_FILE = 'EARK_IPV_CONF_FILE'
+ENV_CACHE_DIR = 'EARK_IPV_CACHE_DIR'
+ENV_UNPACK_DIR = 'EARK_IPV_UNPACK_DIR'
+ENV_UNPACK_QUOTA = 'EARK_IPV_UNPACK_QUOTA'
 EPILOG = """
 E-ARK (https://e-ark4all.eu/)
 Open Preservation Foundation (http://www.openpreservation.org)
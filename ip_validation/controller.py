@@ -30,10 +30,14 @@ from flask import jsonify, render_template, request, redirect, url_for
 from flask_negotiate import produces
 from werkzeug.exceptions import BadRequest, Forbidden, NotFound, Unauthorized, InternalServerError
 
-from ip_validation.infopacks.mets import MetsValidator
+from ip_validation.infopacks.registry import REGISTRY
+from ip_validation.infopacks.workspace import WORKSPACE
 
 from ip_validation.webapp import APP, __version__
 from ip_validation.infopacks.rules import ValidationProfile
+from ip_validation.jobs import JobQueue
+from ip_validation.results import ResultCache
+from ip_validation.validator import PackageValidator
 import ip_validation.infopacks.information_package as IP
 import ip_validation.utils as UTILS
 
@@ -42,6 +46,15 @@ ROUTES = True
 JSON_MIME = 'application/json'
 PDF_MIME = 'application/pdf'
 XML_MIME = 'text/xml'
+
+RESULTS = ResultCache(APP.config['RESULTS_FOLDER'], __version__,
+                      max_entries=APP.config['RESULTS_MAX_ENTRIES'],
+                      max_bytes=APP.config['RESULTS_MAX_BYTES'])
+JOBS = JobQueue(APP.config['JOBS_DB'], workers=APP.config['JOB_WORKERS'])
+LIMITS = IP.ArchiveLimits(max_bytes=APP.config['ARCHIVE_MAX_BYTES'],
+                          max_members=APP.config['ARCHIVE_MAX_MEMBERS'],
+                          max_ratio=APP.config['ARCHIVE_MAX_RATIO'],
+                          max_depth=APP.config['ARCHIVE_MAX_DEPTH'])
 @APP.route("/")
 def home():
     """Application home page."""
@@ -68,32 +81,17 @@ def get_specification(spec_name):
 @APP.route("/validate/<string:digest>/", endpoint="validate")
 def validate(digest):
     """Display validation results."""
-    # Get the validation path ready
-    to_validate = os.path.join(APP.config['UPLOAD_FOLDER'], digest)
-    # Validate package structure
-    struct_details = IP.validate_package_structure(to_validate)
-    # Schema and schematron validation to be factored out.
-    # initialise schema and schematron validation structures
-    schema_result = None
-    prof_results = {}
-    schema_errors = []
-    # Schematron validation profile
-    profile = ValidationProfile()
-    # IF package is well formed then we can validate it.
-    if struct_details.structure_status == IP.StructureStatus.WellFormed:
-        # Schema based METS validation first
-        validator = MetsValidator(struct_details.path)
-        mets_path = os.path.join(struct_details.path, 'METS.xml')
-        schema_result = validator.validate_mets(mets_path)
-        # Now grab any errors
-        schema_errors = validator.validation_errors
-        if schema_result is True:
-            profile.validate(mets_path)
-            prof_results = profile.get_results()
-
-    return render_template('validate.html', details=struct_details, schema_result=schema_result,
-                           schema_errors=schema_errors, prof_names=ValidationProfile.NAMES,
-                           schematron_result=profile.is_valid, profile_results=prof_results)
+    if not UTILS.is_sha1(digest):
+        raise BadRequest('Invalid digest {}'.format(digest))
+    report = _get_report(digest)
+    return render_template('validate.html', details=report['package'],
+                           schema_result=report['schema_valid'],
+                           schema_errors=report['schema_errors'],
+                           prof_names=ValidationProfile.NAMES,
+                           schematron_result=report['metadata_valid'],
+                           profile_results=report['profile_results'],
+                           # Stored reports from earlier versions have no representations
+                           representations=report.get('representations', []))
 
 @APP.route("/api/validate/", methods=['POST'])
 def upload_redirect():
@@ -104,6 +102,8 @@ def upload_redirect():
         raise BadRequest('No file part, or digest')
     uploaded = request.files['package']
     digest = request.form["digest"]
+    if not UTILS.is_sha1(digest):
+        raise BadRequest('Invalid digest {}'.format(digest))
     if uploaded.filename == '':
         logging.debug('No selected file')
         raise BadRequest('No selected file')
@@ -112,7 +112,10 @@ def upload_redirect():
         filename = request.form["digest"]
         dest_path = os.path.join(APP.config['UPLOAD_FOLDER'], filename)
         if not os.path.exists(dest_path):
-            uploaded.save(dest_path)
+            sha1_hash = UTILS.save_sha1(uploaded.stream, dest_path, digest)
+            if not sha1_hash == digest:
+                raise BadRequest('Digest mismatch, calculated {}, POSTED {}'.format(sha1_hash,
+                                                                                   digest))
         logging.debug("File upload successful: %s", filename)
         return redirect(url_for('validate', digest=digest))
     raise BadRequest("File type upload not allowed")
@@ -126,6 +129,8 @@ def upload():
         return {'message' : 'No file part, or digest'}, 403
     uploaded = request.files['package']
     digest = request.form["digest"]
+    if not UTILS.is_sha1(digest):
+        return {'message' : 'Invalid digest {}'.format(digest)}, 400
     if uploaded.filename == '':
         logging.debug('No selected file')
         return {'message' : 'No selected file'}, 403
@@ -133,12 +138,13 @@ def upload():
         logging.debug("Digest: %s", digest)
         filename = request.form["digest"]
         dest_path = os.path.join(APP.config['UPLOAD_FOLDER'], filename)
+        # Uploads are hashed as they're written and only stored under their
+        # digest if it matches, so existing files don't need checking.
         if not os.path.exists(dest_path):
-            uploaded.save(dest_path)
-        sha1_hash = UTILS.sha1(dest_path)
-        if not sha1_hash == digest:
-            return {'message' : 'Digest mismatch, calculated {}, POSTED {}'.format(sha1_hash,
-                                                                                   digest)}, 403
+            sha1_hash = UTILS.save_sha1(uploaded.stream, dest_path, digest)
+            if not sha1_hash == digest:
+                return {'message' : 'Digest mismatch, calculated {}, POSTED {}'.format(sha1_hash,
+                                                                                       digest)}, 403
         logging.debug("File upload successful: %s", uploaded.filename)
         return jsonify(sha1=digest,
                        validation_url="https://{}/api/ip/validation/{}/".format(request.host,
@@ -148,47 +154,56 @@ def upload():
 @APP.route("/api/ip/validation/<string:digest>/")
 def api_validate(digest):
     """Display validation results."""
-    # Get the validation path ready
-    to_validate = os.path.join(APP.config['UPLOAD_FOLDER'], digest)
-    # Validate package structure
-    struct_details = IP.validate_package_structure(to_validate)
-    # Schema and schematron validation to be factored out.
-    # initialise schema and schematron validation structures
-    schema_valid = None
-    schema_messages = []
-    profile_valid = None
+    if not UTILS.is_sha1(digest):
+        return {'message' : 'Invalid digest {}'.format(digest)}, 400
+    report = _get_report(digest)
     profile_warnings = []
     profile_errors = []
-    # Schematron validation profile
-    profile = ValidationProfile()
-    # IF package is well formed then we can validate it.
-    if struct_details.structure_status == IP.StructureStatus.WellFormed:
-        # Schema based METS validation first
-        validator = MetsValidator(struct_details.path)
-        mets_path = os.path.join(struct_details.path, 'METS.xml')
-        schema_valid = validator.validate_mets(mets_path)
-        # Now grab any errors
-        schema_errors = validator.validation_errors
-        if schema_valid is True:
-            profile.validate(mets_path)
-            profile_valid = profile.is_valid
-            for name in ValidationProfile.SECTIONS:
-                report = profile.get_result(name)
-                for failure in report.failures:
-                    profile_errors.append(failure.to_json())
-                for warning in report.warnings:
-                    profile_warnings.append(warning.to_json())
-        else:
-            for _err in schema_errors:
-                schema_messages.append(_err.msg)
-    return jsonify(schema_valid=schema_valid, schema_errors=schema_messages,
-                   metadata_valid=profile_valid, profile_warnings=profile_warnings,
+    # Stored reports from earlier versions have no representations
+    profiles = [report['profile_results']]
+    profiles.extend(rep['profile_results'] for rep in report.get('representations', []))
+    for profile in profiles:
+        for result in profile.values():
+            profile_errors.extend(result['failures'])
+            profile_warnings.extend(result['warnings'])
+    return jsonify(schema_valid=report['schema_valid'], schema_errors=report['schema_errors'],
+                   metadata_valid=report['metadata_valid'], profile_warnings=profile_warnings,
                    profile_errors=profile_errors)
 
+@APP.route("/api/ip/validation/<string:digest>/", methods=['DELETE'])
+def invalidate(digest):
+    """Discard any stored validation results for a package."""
+    if not UTILS.is_sha1(digest):
+        return {'message' : 'Invalid digest {}'.format(digest)}, 400
+    return jsonify(sha1=digest, invalidated=RESULTS.invalidate(digest))
+
+@APP.route("/api/jobs/", methods=['POST'])
+def submit_job():
+    """POST method to queue validation of an uploaded package."""
+    digest = request.form.get('digest') or (request.get_json(silent=True) or {}).get('digest')
+    if not digest:
+        return {'message' : 'No digest'}, 403
+    if not UTILS.is_sha1(digest):
+        return {'message' : 'Invalid digest {}'.format(digest)}, 400
+    if not os.path.isfile(os.path.join(APP.config['UPLOAD_FOLDER'], digest)):
+        return {'message' : 'No package uploaded with digest {}'.format(digest)}, 404
+    job_id = JOBS.submit(digest, lambda progress: _get_report(digest, progress))
+    return jsonify(job_id=job_id,
+                   status_url=url_for('get_job', job_id=job_id, _external=True)), 202
+
+@APP.route("/api/jobs/<string:job_id>/")
+def get_job(job_id):
+    """Return the state, progress and, once finished, the report of a job."""
+    job = JOBS.get(job_id)
+    if job is None:
+        return {'message' : 'No job with id {}'.format(job_id)}, 404
+    return jsonify(job)
+
 @APP.route("/about/")
 def about():
     """Show the application about and config page"""
-    return render_template('about.html', config=APP.config, version=__version__)
+    return render_template('about.html', config=APP.config, version=__version__,
+                           registry=REGISTRY.stats(), workspace=WORKSPACE.stats())
 
 @APP.errorhandler(BadRequest)
 def bad_request_handler(bad_request):
@@ -244,6 +259,20 @@ def shutdown_session(exception=None):
     if exception:
         logging.warning("Shutting down database session with exception.")
 
+def _get_report(digest, progress=None):
+    """Return the validation report for an uploaded package, from the result
+    store if it's been validated by this version of the validator."""
+    report = RESULTS.get(digest)
+    if report is not None:
+        return report
+    to_validate = os.path.join(APP.config['UPLOAD_FOLDER'], digest)
+    # Validators store results so each request or job needs its own
+    report = PackageValidator(limits=LIMITS).validate(to_validate, progress)
+    # Don't store the result for packages that haven't been uploaded yet
+    if os.path.isfile(to_validate):
+        RESULTS.put(digest, report)
+    return report
+
 def _request_wants_json():
     best = request.accept_mimetypes \
         .best_match([JSON_MIME, PDF_MIME])
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# coding=UTF-8
+#
+# E-ARK Validation
+# Copyright (C) 2019
+# All rights reserved.
+#
+# Licensed to the E-ARK project under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The E-ARK project licenses
+# this file to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""Fixity checks of package files against the sizes and checksums recorded in
+their METS files."""
+from concurrent.futures import ThreadPoolExecutor
+import os
+import posixpath
+import threading
+import time
+from urllib.parse import unquote
+
+from lxml import etree
+
+from ip_validation.infopacks.information_package import ManifestStatus, METS_NAME, REPS_DIR
+from ip_validation.infopacks.mets import METS_NS, XLINK_NS
+import ip_validation.utils as UTILS
+
+# METS CHECKSUMTYPE values that hashlib supports
+CHECKSUM_ALGORITHMS = {
+    'MD5': 'md5',
+    'SHA-1': 'sha1',
+    'SHA-256': 'sha256',
+    'SHA-384': 'sha384',
+    'SHA-512': 'sha512'
+}
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+# Files modified this recently may change again without their mtime changing
+RACY_SECS = 2
+
+CACHE_SCHEMA = """CREATE TABLE IF NOT EXISTS digests (
+    path TEXT NOT NULL,
+    algorithm TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (path, algorithm)
+)"""
+
+class FixityCache():
+    """Persistent SQLite store of file digests, keyed by absolute path and
+    algorithm and only used while the file's size, mtime and inode are
+    unchanged, so re-validating an unchanged tree doesn't hash it again.
+
+    Files modified in the RACY_SECS before they're hashed aren't stored, a write
+    within the file system's timestamp granularity wouldn't change the mtime."""
+    def __init__(self, db_path):
+        self._db_path = db_path
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            # WAL lets parallel ip-check processes read while one writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(CACHE_SCHEMA)
+
+    @property
+    def hits(self):
+        """Return the number of digests served from the cache."""
+        return self._hits
+
+    @property
+    def misses(self):
+        """Return the number of digests that had to be calculated."""
+        return self._misses
+
+    def digest(self, path, algorithm, compute):
+        """Return the hex digest of the file at path for the hashlib algorithm
+        name. If there's no valid cache entry compute() is called to calculate
+        it and the result stored."""
+        return self.digests(path, [algorithm], lambda _: {algorithm: compute()})[algorithm]
+
+    def digests(self, path, algorithms, compute):
+        """Return a dictionary of hex digests of the file at path, keyed by the
+        hashlib algorithm names in algorithms. Digests without a valid cache
+        entry are calculated together, in one read, by compute(missing), which
+        is passed the missing algorithms and returns a dictionary of digests."""
+        path = os.path.abspath(path)
+        stats = os.stat(path)
+        key = (stats.st_size, stats.st_mtime_ns, stats.st_ino)
+        found = {}
+        with self._connect() as conn:
+            for row in conn.execute("SELECT algorithm, size, mtime_ns, inode, digest "
+                                    "FROM digests WHERE path = ?", (path,)):
+                if row[0] in algorithms and tuple(row[1:4]) == key:
+                    found[row[0]] = row[4]
+            self._hits += len(found)
+            self._misses += len(algorithms) - len(found)
+        missing = [algorithm for algorithm in algorithms if algorithm not in found]
+        if not missing:
+            return found
+        computed = compute(missing)
+        found.update(computed)
+        if time.time() - stats.st_mtime > RACY_SECS:
+            with self._connect() as conn:
+                conn.executemany("INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?)",
+                                 [(path, algorithm) + key + (computed[algorithm],)
+                                  for algorithm in missing])
+        return found
+
+    def stats(self):
+        """Return a dictionary of cache hit and miss counts and the hit rate."""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {'hits': self._hits, 'misses': self._misses,
+                    'hit_rate': self._hits / lookups if lookups else 0.0}
+
+    def _connect(self):
+        return UTILS.LockedConnection(self._db_path, self._lock)
+
+class FileReference():
+    """A file referenced from a METS document, with its recorded fixity values."""
+    def __init__(self, path, size=None, checksum=None, checksum_type=None):
+        self._path = path
+        self._size = size
+        self._checksum = checksum
+        self._checksum_type = checksum_type
+
+    @property
+    def path(self):
+        """Get the listing path of the referenced file."""
+        return self._path
+
+    @property
+    def size(self):
+        """Get the recorded size in bytes, or None if not recorded."""
+        return self._size
+
+    @property
+    def checksum(self):
+        """Get the recorded checksum, or None if not recorded."""
+        return self._checksum
+
+    @property
+    def checksum_type(self):
+        """Get the METS CHECKSUMTYPE of the checksum."""
+        return self._checksum_type
+
+def read_references(mets_file, base=''):
+    """Yield a FileReference for each mets:file, metadata section mets:mdRef and
+    mets:mptr in a METS document, href paths are resolved against base. The
+    document is parsed incrementally and elements are discarded once read."""
+    tags = ('{%s}file' % METS_NS, '{%s}mdRef' % METS_NS, '{%s}mptr' % METS_NS)
+    for _, element in etree.iterparse(mets_file, events=('end',), tag=tags):
+        if element.tag == tags[0]:
+            for flocat in element.iterchildren('{%s}FLocat' % METS_NS):
+                yield _reference(base, flocat, element)
+        elif element.tag == tags[1]:
+            # dmdSec and amdSec references carry their own fixity attributes
+            yield _reference(base, element, element)
+        else:
+            yield FileReference(_resolve(base, element.get('{%s}href' % XLINK_NS)))
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+def _reference(base, locator, fixity):
+    size = fixity.get('SIZE')
+    return FileReference(_resolve(base, locator.get('{%s}href' % XLINK_NS)),
+                         int(size) if size and size.isdigit() else None,
+                         fixity.get('CHECKSUM'), fixity.get('CHECKSUMTYPE'))
+
+def _resolve(base, href):
+    href = unquote(href or '')
+    for prefix in ('file://', 'file:'):
+        if href.startswith(prefix):
+            href = href[len(prefix):]
+            break
+    return posixpath.normpath(posixpath.join(base, href.lstrip('/')))
+
+def check_fixity(details, workers=DEFAULT_WORKERS, cache=None):
+    """Check the files of a well formed package against the package and
+    representation METS files. Sets details.manifest_status and returns a list
+    of issue messages, sorted by file path.
+
+    Files are hashed on a pool of workers threads, each reading with its own
+    handle on the package. Every algorithm declared for a file, by any METS
+    file, is calculated in a single read. Packages in compressed tars are read
+    front to back on a single thread. Digests of files in package directories
+    are looked up in, and added to, the FixityCache if one is supplied."""
+    listing = details.listing
+    root = details.listing_path()
+    # Maps each referenced path to the list of its references
+    references = {}
+    mets_files = [(root, posixpath.join(root, METS_NAME))]
+    reps_dir = posixpath.join(root, REPS_DIR)
+    if listing.isdir(reps_dir):
+        for rep in listing.listdir(reps_dir):
+            rep_mets = posixpath.join(reps_dir, rep, METS_NAME)
+            if listing.isfile(rep_mets):
+                mets_files.append((posixpath.join(reps_dir, rep), rep_mets))
+    for base, mets_path in mets_files:
+        try:
+            with listing.open(mets_path) as mets_file:
+                for reference in read_references(mets_file, base):
+                    references.setdefault(reference.path, []).append(reference)
+        except etree.XMLSyntaxError as synt_err:
+            details.manifest_status = ManifestStatus.Unknown
+            return ['{} could not be parsed: {}'.format(mets_path, synt_err.msg)]
+
+    issues = []
+    to_check = []
+    for path, path_refs in references.items():
+        if not listing.isfile(path):
+            issues.append((path, '{} is referenced but not present.'.format(path)))
+        elif any(ref.size is not None or ref.checksum for ref in path_refs):
+            to_check.append((path, path_refs))
+    incomplete = bool(issues)
+    # METS files describe the package, they're not listed in their own manifests
+    for path in listing.files(root):
+        if path not in references and posixpath.basename(path) != METS_NAME:
+            issues.append((path, '{} is not referenced by any METS file.'.format(path)))
+            incomplete = True
+    fixity_issues = _verify_all(listing, to_check, workers, cache)
+    issues.extend(fixity_issues)
+    if incomplete:
+        details.manifest_status = ManifestStatus.Incomplete
+    elif fixity_issues:
+        details.manifest_status = ManifestStatus.Inconsistent
+    else:
+        details.manifest_status = ManifestStatus.Consistent
+    return [message for _, message in sorted(issues)]
+
+def _verify_all(listing, to_check, workers, cache):
+    if not listing.parallel_reads:
+        # Read in archive order so the stream is never rewound
+        order = {path: index for index, path in enumerate(listing.files())}
+        to_check = sorted(to_check, key=lambda item: order[item[0]])
+        workers = 1
+    pending = iter(to_check)
+    lock = threading.Lock()
+    issues = []
+    def _worker():
+        with listing.reader() as open_file:
+            buffer = bytearray(UTILS.DIGEST_BLOCKSIZE)
+            while True:
+                with lock:
+                    item = next(pending, None)
+                if item is None:
+                    return
+                path, path_refs = item
+                issues.extend((path, issue) for issue in
+                              _verify(open_file, path, path_refs, buffer,
+                                      listing.local_path(path), cache))
+    workers = max(1, min(workers, len(to_check)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in [executor.submit(_worker) for _ in range(workers)]:
+            future.result()
+    return issues
+
+def _verify(open_file, path, path_refs, buffer, local_path, cache):
+    issues = []
+    checked = []
+    for reference in path_refs:
+        if reference.checksum and \
+                (reference.checksum_type or '').upper() not in CHECKSUM_ALGORITHMS:
+            issues.append('{} has unsupported CHECKSUMTYPE {}.'.format(
+                path, reference.checksum_type))
+        elif reference.size is not None or reference.checksum:
+            checked.append(reference)
+    if not checked:
+        return issues
+    algorithms = sorted({CHECKSUM_ALGORITHMS[reference.checksum_type.upper()]
+                         for reference in checked if reference.checksum})
+    if cache is not None and local_path is not None:
+        size = os.stat(local_path).st_size
+        digests = cache.digests(local_path, algorithms,
+                                lambda missing: _digests(open_file, path, missing, buffer)[1])
+    else:
+        size, digests = _digests(open_file, path, algorithms, buffer)
+    for reference in checked:
+        if reference.size is not None and size != reference.size:
+            issues.append('{} is {} bytes, METS SIZE is {}.'.format(path, size, reference.size))
+        if reference.checksum:
+            digest = digests[CHECKSUM_ALGORITHMS[reference.checksum_type.upper()]]
+            if digest != reference.checksum.lower():
+                issues.append('{} {} checksum is {}, METS CHECKSUM is {}.'.format(
+                    path, reference.checksum_type, digest, reference.checksum))
+    return issues
+
+def _digests(open_file, path, algorithms, buffer):
+    with open_file(path) as stream:
+        return UTILS.digests(stream, algorithms, buffer=buffer)
@@ -23,14 +23,17 @@
 # under the License.
 #
 """Module covering information package structure validation and navigation."""
+from contextlib import contextmanager
 from enum import Enum, unique
 import os
+import posixpath
+import re
 import tarfile
-import tempfile
 import zipfile
 
 from ip_validation.infopacks.struct_errors import StructError
 from ip_validation.infopacks.rules import Severity
+from ip_validation.infopacks.workspace import UnpackWorkspace, WORKSPACE
 
 import ip_validation.utils as UTILS
 
@@ -70,8 +73,9 @@ class PackageDetails:
     manifest_values = list(ManifestStatus)
     def __init__(self, path, size=0, version='unknown',
                  structure_status=StructureStatus.Unknown,
-                 manifest_status=ManifestStatus.Unknown):
+                 manifest_status=ManifestStatus.Unknown, listing=None):
         self._path = path
+        self._listing = listing
         self._size = size
         self._version = version
         self.structure_status = structure_status
@@ -88,6 +92,23 @@ class PackageDetails:
         """Get the name of the package."""
         return os.path.basename(os.path.normpath(self.path))
 
+    @property
+    def listing(self):
+        """Get the PackageListing the package was read from, if any."""
+        return self._listing
+
+    def open(self, name):
+        """Open a file below the package root for binary reading, archived
+        packages stream the file straight out of the archive."""
+        if self._listing is None:
+            return open(os.path.join(self.path, name), 'rb')
+        return self._listing.open(self.listing_path(name))
+
+    def listing_path(self, name=''):
+        """Return the listing path of name, a path below the package root."""
+        rel_path = os.path.relpath(os.path.join(self.path, name), self._listing.path)
+        return '' if rel_path == os.curdir else rel_path.replace(os.sep, '/')
+
     @property
     def size(self):
         """Return the package size in bytes."""
@@ -136,15 +157,97 @@ class PackageDetails:
         """Return the full list of errors."""
         return self._errors
 
+    def to_json(self):
+        """Output the package details in JSON format."""
+        return {"path" : self.path, "name" : self.name, "size" : self.size,
+                "version" : self.version,
+                "structure_status" : str(self.structure_status.name),
+                "manifest_status" : str(self.manifest_status.name),
+                "errors" : [error.to_json() for error in self.errors]}
+
+RATIO_MIN_BYTES = 1024 * 1024
+# Windows drive letter prefixes of archive member names
+DRIVE_PATTERN = re.compile(r'[A-Za-z]:')
+
+class ArchiveLimits():
+    """Resource limits checked against an archive's member headers before
+    anything is extracted, so a malicious archive can't exhaust disk space or
+    inodes. Compression ratios are only checked once the uncompressed size
+    passes RATIO_MIN_BYTES, small files of repeated content compress well."""
+    def __init__(self, max_bytes=8 * 1024 * 1024 * 1024, max_members=1000000,
+                 max_ratio=200, max_depth=64):
+        self._max_bytes = max_bytes
+        self._max_members = max_members
+        self._max_ratio = max_ratio
+        self._max_depth = max_depth
+
+    @property
+    def max_bytes(self):
+        """Get the maximum total uncompressed size in bytes."""
+        return self._max_bytes
+
+    @property
+    def max_members(self):
+        """Get the maximum number of archive members."""
+        return self._max_members
+
+    @property
+    def max_ratio(self):
+        """Get the maximum uncompressed to compressed size ratio."""
+        return self._max_ratio
+
+    @property
+    def max_depth(self):
+        """Get the maximum folder depth of a member path."""
+        return self._max_depth
+
+    def check_member(self, path, count, total_bytes):
+        """Check a member's path and the running member count and byte total,
+        raises an ArchiveLimitError if any limit is exceeded."""
+        if count > self._max_members:
+            raise ArchiveLimitError('Archive has more than {} members.'.format(
+                self._max_members))
+        if total_bytes > self._max_bytes:
+            raise ArchiveLimitError('Archive expands to more than {} bytes.'.format(
+                self._max_bytes))
+        if path.count('/') + 1 > self._max_depth:
+            raise ArchiveLimitError('Archive member {} is more than {} folders deep.'.format(
+                path, self._max_depth))
+
+    def check_ratio(self, name, size, compressed_size):
+        """Raise an ArchiveLimitError if size is more than max_ratio times the
+        compressed_size."""
+        if size > RATIO_MIN_BYTES and size > compressed_size * self._max_ratio:
+            raise ArchiveLimitError('{} has a compression ratio above {}.'.format(
+                name, self._max_ratio))
+
+DEFAULT_LIMITS = ArchiveLimits()
+
 class ArchivePackageHandler():
-    """Class to handle archive / compressed information packages."""
-    def __init__(self, unpack_root=tempfile.gettempdir()):
-        self._unpack_root = unpack_root
+    """Class to handle archive / compressed information packages. Validation
+    reads archives in place, the handler is for callers that need the files on
+    disk. Archives are unpacked to a managed UnpackWorkspace, which reuses
+    recently unpacked trees and removes old ones once it's over quota."""
+    def __init__(self, unpack_root=None, workspace=None, limits=DEFAULT_LIMITS):
+        if workspace is None:
+            workspace = UnpackWorkspace(unpack_root) if unpack_root else WORKSPACE
+        self._workspace = workspace
+        self._limits = limits
 
     @property
     def unpack_root(self):
         """Returns the root directory for archive unpacking."""
-        return self._unpack_root
+        return self._workspace.root
+
+    @property
+    def workspace(self):
+        """Returns the workspace archives are unpacked to."""
+        return self._workspace
+
+    @property
+    def limits(self):
+        """Returns the ArchiveLimits checked before unpacking."""
+        return self._limits
 
     @staticmethod
     def is_archive(to_test):
@@ -154,33 +257,80 @@ class ArchivePackageHandler():
         return tarfile.is_tarfile(to_test)
 
     def unpack_package(self, to_unpack, dest=None):
-        """Unpack an archived package to a destination (defaults to tempdir)."""
+        """Unpack an archived package to the workspace, or a destination directory
+        if supplied, returning the path of the unpacked tree. Trees in the workspace
+        may be evicted by later unpacks, use unpacked() to hold one while in use.
+        Raises an ArchiveLimitError, before extracting anything, if the archive
+        breaks the handler's limits."""
+        sha1 = self._check_archive(to_unpack)
+        if dest:
+            destination = os.path.join(dest, sha1)
+            self._extractor(to_unpack)(destination)
+            return destination
+        return self._workspace.unpack(sha1, self._extractor(to_unpack))
+
+    @contextmanager
+    def unpacked(self, to_unpack):
+        """Context manager yielding the path of the package unpacked to the
+        workspace, the tree isn't evicted before the context exits."""
+        sha1 = self._check_archive(to_unpack)
+        with self._workspace.checkout(sha1, self._extractor(to_unpack)) \
+                as destination:
+            yield destination
+
+    def _extractor(self, to_unpack):
+        return lambda destination: _extract(to_unpack, destination, self._limits)
+
+    def _check_archive(self, to_unpack):
         if not os.path.isfile(to_unpack) or not self.is_archive(to_unpack):
             raise PackageStructError("File is not an archive file.")
-        sha1 = UTILS.sha1(to_unpack)
-        dest_root = dest if dest else self.unpack_root
-        destination = os.path.join(dest_root, sha1)
-        if zipfile.is_zipfile(to_unpack):
-            zip_ip = zipfile.ZipFile(to_unpack)
-            zip_ip.extractall(path=destination)
-        elif tarfile.is_tarfile(to_unpack):
-            tar_ip = tarfile.open(to_unpack)
-            tar_ip.extractall(path=destination)
-        return destination
+        return UTILS.sha1(to_unpack)
+
+def _extract(to_unpack, destination, limits):
+    # Listing checks the limits against the headers and drops members with
+    # paths outside of the package, only what's listed is extracted. Readers
+    # don't return more bytes than a member's header declares.
+    accepted = ArchiveListing(to_unpack, limits).member_names
+    if zipfile.is_zipfile(to_unpack):
+        with zipfile.ZipFile(to_unpack) as zip_ip:
+            zip_ip.extractall(path=destination,
+                              members=[name for name in zip_ip.namelist() if name in accepted])
+    elif tarfile.is_tarfile(to_unpack):
+        with tarfile.open(to_unpack) as tar_ip:
+            members = [member for member in tar_ip if member.name in accepted
+                       and (member.isfile() or member.isdir())]
+            if hasattr(tarfile, 'data_filter'):
+                # The data filter also refuses anything that would land outside
+                tar_ip.extractall(path=destination, members=members, filter='data')
+            else:
+                tar_ip.extractall(path=destination, members=members)
+
+def _is_package_path(path):
+    # Absolute, drive letter and parent relative paths would extract outside
+    # of the package root
+    return path not in ('.', '', '..') and not path.startswith(('/', '../')) and \
+        not DRIVE_PATTERN.match(path)
 
 METS_NAME = 'METS.xml'
 REPS_DIR = "representations"
-def validate_package_structure(package_path):
-    """Carry out all structural package tests."""
-    # It's a file so we need to unpack it
-    details = PackageDetails(package_path) \
-        if os.path.isdir(package_path) \
-        else unpack_package(package_path)
-    # Check it's not a broken package as unpack errors are terminal
-    if details.structure_status == StructureStatus.NotWellFormed:
+def validate_package_structure(package_path, limits=DEFAULT_LIMITS):
+    """Carry out all structural package tests. Archived packages are checked
+    from their member listing without being unpacked, an archive that breaks
+    the ArchiveLimits fails with a CSIPSTR3 error."""
+    try:
+        listing = PackageListing.from_path(package_path, limits)
+    except ArchiveLimitError as limit_err:
+        details = PackageDetails(package_path, structure_status=StructureStatus.NotWellFormed)
+        details.add_error(limit_err.struct_error)
+        return details
+    except PackageStructError:
+        # If it's a file and it can't be listed that's about all we can do.
+        details = PackageDetails(package_path, structure_status=StructureStatus.NotWellFormed)
+        details.add_error(StructError.from_values(1, sub_message="""Package file
+                          is not a recognised archive format."""))
         return details
     # Now carry out the root checks on the package
-    details = check_package_root(details.path)
+    details = _check_root(listing)
     # If it has basic structure errors then bale.
     if details.structure_status == StructureStatus.NotWellFormed:
         return details
@@ -189,9 +339,10 @@ def validate_package_structure(package_path):
     #   - Defferred to corresponding metadata check?
 
     # Now get the manifests directory
-    root_manifest = PackageManifest.from_directory(details.path)
+    root_dir = details.name
+    root_manifest = PackageManifest.from_listing(listing, root_dir)
     # if we have manifests then we need the details from them also
-    rep_manifests = representation_manifests(os.path.join(details.path, REPS_DIR))
+    rep_manifests = _representation_manifests(listing, posixpath.join(root_dir, REPS_DIR))
     root_errors = validate_manifest(root_manifest)
     rep_errors = []
     for manifest in rep_manifests.values():
@@ -232,49 +383,208 @@ def validate_manifest(manifest, is_root=True):
 
 def representation_manifests(reps_dir):
     """Loop through reps and get the details."""
+    return _representation_manifests(PackageListing(reps_dir), '')
+
+def _representation_manifests(listing, reps_dir):
     rep_manifests = {}
-    if not os.path.isdir(reps_dir):
+    if not listing.isdir(reps_dir):
         return rep_manifests
-    for entry in os.listdir(reps_dir):
-        rep_dir = os.path.join(reps_dir, entry)
-        if os.path.isdir(rep_dir):
-            rep_manifest = PackageManifest.from_directory(rep_dir)
+    for entry in listing.listdir(reps_dir):
+        rep_dir = posixpath.join(reps_dir, entry)
+        if listing.isdir(rep_dir):
+            rep_manifest = PackageManifest.from_listing(listing, rep_dir)
             rep_manifests[rep_manifest.name] = rep_manifest
     return rep_manifests
 
-def unpack_package(package_path):
-    """Unpack what's presumed to be an archive format package. Report any issues
-    with the archive."""
-    # It's a file so we need to unpack it
-    archive_handler = ArchivePackageHandler()
-    unpacked_dir = package_path
-    try:
-        unpacked_dir = archive_handler.unpack_package(package_path)
-    except PackageStructError:
-        # If it's a file and it can't be unpacked that's about all we can do.
-        details = PackageDetails(package_path, structure_status=StructureStatus.NotWellFormed)
-        details.add_error(StructError.from_values(1, sub_message="""Package file
-                          is not a recognised archive format."""))
-        return details
-    return PackageDetails(os.path.normpath(unpacked_dir))
-
 def check_package_root(package_root):
     """Ensure that the root package directory is of the correct form."""
+    return _check_root(PackageListing(package_root))
+
+def _check_root(listing):
     # [CSIPSTR1] Is reference a single physical folder?
     # get root entries (files and folders)
-    root_entries = os.listdir(package_root)
+    package_root = listing.path
+    root_entries = listing.listdir('')
     if len(root_entries) != 1:
         details = PackageDetails(package_root, structure_status=StructureStatus.NotWellFormed)
         details.add_error(StructError.from_values(1, sub_message="""Multiple root
                           elements found when unpacking {}""".format(package_root)))
         return details
-    if os.path.isfile(os.path.join(package_root, root_entries[0])):
+    if listing.isfile(root_entries[0]):
         details = PackageDetails(package_root, structure_status=StructureStatus.NotWellFormed)
         details.add_error(StructError.from_values(1, sub_message="""Package {}
                           unpacked to a single file.""".format(package_root)))
         return details
-    return PackageDetails(os.path.normpath(os.path.join(package_root,
-                                                        root_entries[0])))
+    return PackageDetails(os.path.normpath(os.path.join(package_root, root_entries[0])),
+                          listing=listing)
+
+class PackageListing():
+    """Read only view of the files and folders below a package directory. Paths
+    are relative to the directory and use '/' separators, '' is the directory
+    itself. ArchiveListing offers the same view of an archive's members so that
+    structure checks don't depend on how the package is stored."""
+    def __init__(self, path):
+        self._path = path
+
+    @property
+    def path(self):
+        """Get the path of the listed directory or archive."""
+        return self._path
+
+    def listdir(self, path):
+        """Return the names of the entries in the folder at path."""
+        return os.listdir(self._full_path(path))
+
+    def isdir(self, path):
+        """Return True if path is a folder."""
+        return os.path.isdir(self._full_path(path))
+
+    def isfile(self, path):
+        """Return True if path is a file."""
+        return os.path.isfile(self._full_path(path))
+
+    def open(self, path):
+        """Open the file at path for binary reading."""
+        return open(self._full_path(path), 'rb')
+
+    def files(self, path=''):
+        """Yield the paths of all files below the folder at path."""
+        for dirpath, _, filenames in os.walk(self._full_path(path)):
+            rel_dir = os.path.relpath(dirpath, self._path).replace(os.sep, '/')
+            for filename in filenames:
+                yield filename if rel_dir == os.curdir else rel_dir + '/' + filename
+
+    @property
+    def parallel_reads(self):
+        """Return True if files can be read efficiently from several threads."""
+        return True
+
+    def local_path(self, path):
+        """Return the file system path of path, or None for archive members."""
+        return self._full_path(path)
+
+    @contextmanager
+    def reader(self):
+        """Context manager yielding a function that opens files for reading,
+        for archives every file is read through the same archive handle."""
+        yield self.open
+
+    def _full_path(self, path):
+        return os.path.join(self._path, *path.split('/')) if path else self._path
+
+    @staticmethod
+    def from_path(path, limits=DEFAULT_LIMITS):
+        """Return a listing for a package directory or archive file, raises a
+        PackageStructError if path is neither."""
+        if os.path.isdir(path):
+            return PackageListing(path)
+        return ArchiveListing(path, limits)
+
+class ArchiveListing(PackageListing):
+    """Listing of a zip or tar package read from the zip central directory or
+    tar member headers. Nothing is extracted, files are streamed out of the
+    archive by open(). Listing stops with an ArchiveLimitError as soon as the
+    headers break the limits."""
+    def __init__(self, path, limits=DEFAULT_LIMITS):
+        super().__init__(path)
+        if not os.path.isfile(path) or not ArchivePackageHandler.is_archive(path):
+            raise PackageStructError("File is not an archive file.")
+        self._is_zip = zipfile.is_zipfile(path)
+        self._limits = limits
+        # Maps folder paths to a dict of {entry name: is folder}
+        self._dirs = {'': {}}
+        # Maps file paths to their ZipInfo or TarInfo, so members are opened
+        # without looking up their names again
+        self._members = {}
+        self._member_names = set()
+        self._member_count = 0
+        self._total_bytes = 0
+        self._archive_bytes = os.path.getsize(path)
+        try:
+            if self._is_zip:
+                with zipfile.ZipFile(path) as zip_ip:
+                    for info in zip_ip.infolist():
+                        limits.check_ratio(info.filename, info.file_size, info.compress_size)
+                        self._add(info, info.filename, info.is_dir(), info.file_size)
+            else:
+                with tarfile.open(path) as tar_ip:
+                    for member in tar_ip:
+                        self._add(member, member.name, member.isdir(), member.size)
+        except (zipfile.BadZipFile, tarfile.TarError, EOFError) as err:
+            raise PackageStructError("Archive file can't be read: {}".format(err))
+
+    @property
+    def member_names(self):
+        """Return the set of archive member names included in the listing."""
+        return self._member_names
+
+    def _add(self, member, member_name, is_dir, size):
+        self._member_count += 1
+        self._total_bytes += size
+        path = posixpath.normpath(member_name.replace('\\', '/'))
+        self._limits.check_member(path, self._member_count, self._total_bytes)
+        self._limits.check_ratio(os.path.basename(self.path), self._total_bytes,
+                                 self._archive_bytes)
+        if not _is_package_path(path):
+            return
+        self._member_names.add(member_name)
+        parent, name = posixpath.split(path)
+        self._add_dir(parent)
+        if is_dir:
+            self._add_dir(path)
+        else:
+            self._members[path] = member
+            self._dirs[parent].setdefault(name, False)
+
+    def _add_dir(self, path):
+        # Zips don't always hold entries for folders, so add the missing parents
+        while path not in self._dirs:
+            self._dirs[path] = {}
+            parent, name = posixpath.split(path)
+            self._dirs.setdefault(parent, {})[name] = True
+            path = parent
+
+    def listdir(self, path):
+        return list(self._dirs[path])
+
+    def isdir(self, path):
+        return path in self._dirs
+
+    def isfile(self, path):
+        return path in self._members and path not in self._dirs
+
+    def files(self, path=''):
+        prefix = path + '/' if path else ''
+        for member_path in self._members:
+            if member_path.startswith(prefix) and self.isfile(member_path):
+                yield member_path
+
+    @property
+    def parallel_reads(self):
+        # Compressed tars can only be read efficiently front to back
+        return self._is_zip
+
+    def local_path(self, path):
+        return None
+
+    @contextmanager
+    def reader(self):
+        if self._is_zip:
+            with zipfile.ZipFile(self.path) as zip_ip:
+                yield lambda path: zip_ip.open(self._members[path])
+        else:
+            with tarfile.open(self.path) as tar_ip:
+                yield lambda path: tar_ip.extractfile(self._members[path])
+
+    @contextmanager
+    def open(self, path):
+        member = self._members[path]
+        if self._is_zip:
+            with zipfile.ZipFile(self.path) as zip_ip, zip_ip.open(member) as stream:
+                yield stream
+        else:
+            with tarfile.open(self.path) as tar_ip:
+                yield tar_ip.extractfile(member)
 
 class PackageManifest():
     """Encapsulate the mess that is the manifest details."""
@@ -290,19 +600,26 @@ class PackageManifest():
     @classmethod
     def from_directory(cls, dir_to_scan):
         """Create a manifest instance from a directory."""
+        dir_to_scan = os.path.normpath(dir_to_scan)
+        return cls.from_listing(PackageListing(os.path.dirname(dir_to_scan)),
+                                os.path.basename(dir_to_scan))
+
+    @classmethod
+    def from_listing(cls, listing, dir_to_scan):
+        """Create a manifest instance from a folder of a package listing."""
         has_mets = False
         has_ghost_mets = False
         has_md = False
         has_schema = False
         has_data = False
         has_reps = False
-        name = os.path.basename(dir_to_scan)
-        for entry in os.listdir(dir_to_scan):
-            entry_path = os.path.join(dir_to_scan, entry)
+        name = posixpath.basename(dir_to_scan)
+        for entry in listing.listdir(dir_to_scan):
+            entry_path = posixpath.join(dir_to_scan, entry)
             # [CSIPSTR4] Is there a file called METS.xml (perform case checks)
             # [CSIPSTR12] Does each representation folder have a METS.xml file? (W)
             if entry == METS_NAME:
-                if os.path.isfile(entry_path):
+                if listing.isfile(entry_path):
                     has_mets = True
                 else:
                     has_ghost_mets = True
@@ -310,7 +627,7 @@ class PackageManifest():
                 has_ghost_mets = True
             # [CSIPSTR5] Is there a first level folder called metadata?
             # [CSIPSTR13] Does each representation folder have a metadata folder (W)
-            if os.path.isdir(entry_path):
+            if listing.isdir(entry_path):
                 if entry == "metadata":
                     has_md = True
                 # [CSIPSTR15] Is there a schemas folder at the root level/representations? (W)
@@ -328,4 +645,11 @@ class PackageStructError(RuntimeError):
     """Exception to signal fatal pacakge structure errors."""
     def __init__(self, arg):
         super(PackageStructError, self).__init__()
-        self.args = arg
+        self.args = (arg,)
+
+class ArchiveLimitError(PackageStructError):
+    """Exception raised when an archive breaks an ArchiveLimits limit, carries
+    the CSIPSTR3 StructError to report."""
+    def __init__(self, arg):
+        super(ArchiveLimitError, self).__init__(arg)
+        self.struct_error = StructError.from_values(3, sub_message=arg)
@@ -30,6 +30,7 @@ from lxml import etree
 
 from importlib_resources import files
 
+from ip_validation.infopacks.registry import REGISTRY
 import ip_validation.infopacks.resources.schemas as SCHEMA
 
 XLINK_NS = 'http://www.w3.org/1999/xlink'
@@ -38,10 +39,10 @@ DILCIS_EXT_NS = 'https://DILCIS.eu/XML/METS/CSIPExtensionMETS'
 
 class MetsValidator():
     """Encapsulates METS schema validation."""
-    def __init__(self, root):
+    def __init__(self, root, registry=REGISTRY):
         self.validation_errors = []
         self.total_files = 0
-        self.schema_mets = etree.XMLSchema(file=str(files(SCHEMA).joinpath('mets.xsd')))
+        self.schema_mets = registry.get_schema(str(files(SCHEMA).joinpath('mets.xsd')))
         self.rootpath = root
         self.subsequent_mets = []
 
@@ -52,40 +53,27 @@ class MetsValidator():
         actions are taken, like file validation or adding Mets files found inside
         representations to a list so that they will be evaluated later on.
 
-        @param mets:    Path leading to a Mets file that will be evaluated.
+        Validation runs in constant memory. The schema is applied to the parser
+        event stream, not the tree, so every element is released as soon as
+        it's processed, along with its preceding siblings. Only the open
+        ancestors of the current element are held, however many files,
+        metadata sections or divs the Mets file has.
+
+        @param mets:    Path leading to a Mets file, or a binary file object
+                        streaming one, that will be evaluated.
         @return:        Boolean validation result.
         '''
         # Handle relative package paths for representation METS files.
-        self.rootpath, mets = _handle_rel_paths(self.rootpath, mets)
+        if isinstance(mets, str):
+            self.rootpath, mets = _handle_rel_paths(self.rootpath, mets)
         try:
-            parsed_mets = etree.iterparse(mets, events=('start', 'end'), schema=self.schema_mets)
-            for event, element in parsed_mets:
-                # Define what to do with specific tags.
-                if event == 'end' and element.tag == _q(METS_NS, 'file'):
-                    # files
-                    # self.total_files += 1
-                    element.clear()
-                    while element.getprevious() is not None:
-                        del element.getparent()[0]
-                elif event == 'end' and \
-                    element.tag == _q(METS_NS, 'div') and \
-                    element.attrib['LABEL'].startswith('representations/'):
-                    if fnmatch.fnmatch(element.attrib['LABEL'].rsplit('/', 1)[1], '*_mig-*'):
-                        # representation mets files
-                        rep = element.attrib['LABEL'].rsplit('/', 1)[1]
-                        for child in element.getchildren():
-                            if child.tag == _q(METS_NS, 'mptr'):
-                                metspath = child.attrib[_q(XLINK_NS, 'href')]
-                                sub_mets = rep, metspath
-                                self.subsequent_mets.append(sub_mets)
-                        element.clear()
-                        while element.getprevious() is not None:
-                            del element.getparent()[0]
-                elif event == 'end' and element.tag == _q(METS_NS, 'dmdSec'):
-                    # dmdSec
-                    pass
-                elif event == 'end' and element.tag == _q(METS_NS, 'amdSec'):
-                    pass
+            parsed_mets = etree.iterparse(mets, events=('end',), schema=self.schema_mets)
+            for _, element in parsed_mets:
+                if element.tag == _q(METS_NS, 'mptr'):
+                    # representation mets files, the parent div is still open
+                    self._add_subsequent_mets(element)
+                if element.getparent() is not None:
+                    _release(element)
         except etree.XMLSyntaxError as synt_err:
             self.validation_errors.append(synt_err)
         except BaseException as base_err:
@@ -96,6 +84,29 @@ class MetsValidator():
 
         return len(self.validation_errors) == 0
 
+    def _add_subsequent_mets(self, mptr):
+        div = mptr.getparent()
+        label = div.get('LABEL', '') if div.tag == _q(METS_NS, 'div') else ''
+        metspath = mptr.get(_q(XLINK_NS, 'href'))
+        if label.startswith('representations/') and metspath and \
+            fnmatch.fnmatch(label.rsplit('/', 1)[1], '*_mig-*'):
+            self.subsequent_mets.append((label.rsplit('/', 1)[1], metspath))
+
+    def representation_mets(self):
+        '''
+        Returns the representation METS files found by validate_mets.
+
+        @return:        List of (representation, path) tuples, relative hrefs are
+                        resolved against the package root.
+        '''
+        resolved = []
+        for rep, metspath in self.subsequent_mets:
+            # Join the root once, _handle_rel_paths would prefix it already
+            if metspath.startswith('file://./'):
+                metspath = metspath[9:]
+            resolved.append((rep, os.path.join(self.rootpath, metspath)))
+        return resolved
+
 def _handle_rel_paths(rootpath, metspath):
     if metspath.startswith('file://./'):
         relpath = os.path.join(rootpath, metspath[9:])
@@ -105,5 +116,11 @@ def _handle_rel_paths(rootpath, metspath):
     return metspath.rsplit('/', 1)[0], metspath
 
 
+def _release(element):
+    # Free a processed element and the siblings before it, they're complete
+    element.clear()
+    while element.getprevious() is not None:
+        del element.getparent()[0]
+
 def _q(_ns, _v):
     return '{{{}}}{}'.format(_ns, _v)
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+# coding=UTF-8
+#
+# E-ARK Validation
+# Copyright (C) 2019
+# All rights reserved.
+#
+# Licensed to the E-ARK project under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The E-ARK project licenses
+# this file to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""Process wide registry of compiled Schematron and XML Schema validators."""
+import hashlib
+import logging
+import os
+import stat
+import threading
+
+from importlib_resources import files
+import lxml.etree
+from lxml.isoschematron import Schematron
+
+from ip_validation.const import ENV_CACHE_DIR
+import ip_validation.infopacks.resources.schemas as SCHEMA
+import ip_validation.utils as UTILS
+
+# Bump to invalidate all existing on disk caches
+CACHE_VERSION = 1
+SCH_NS = 'http://purl.oclc.org/dsdl/schematron'
+# Local copies of schemas imported by the bundled schemas, by import location
+SCHEMA_CATALOG = {
+    'http://www.loc.gov/standards/xlink/xlink.xsd': 'mets-xlink.xsd'
+}
+
+class CatalogResolver(lxml.etree.Resolver):
+    """Resolves imports of the schemas in SCHEMA_CATALOG to the bundled copies,
+    so the METS schema compiles offline."""
+    def resolve(self, system_url, public_id, context):
+        if system_url in SCHEMA_CATALOG:
+            return self.resolve_filename(str(files(SCHEMA).joinpath(SCHEMA_CATALOG[system_url])),
+                                         context)
+        return None
+
+class CompiledRules():
+    """A compiled Schematron ruleset, the expanded Schematron document and the
+    XSLT validator generated from it. Instances are immutable and the XSLT can be
+    applied from several threads at once, each call returns its own SVRL report."""
+    def __init__(self, schematron, validator):
+        self._schematron = schematron
+        self._validator = validator
+
+    @property
+    def schematron(self):
+        """Get the expanded Schematron document."""
+        return self._schematron
+
+    @property
+    def validator(self):
+        """Get the compiled XSLT validator."""
+        return self._validator
+
+    def __call__(self, to_validate):
+        """Apply the validator to a parsed document returning the SVRL report tree."""
+        return self._validator(to_validate)
+
+    @classmethod
+    def from_file(cls, rules_path, cache=None):
+        """Compile a Schematron rules file, or load it from cache if supplied."""
+        with open(rules_path, 'rb') as rules_file:
+            source = _with_includes(rules_file.read(), os.path.abspath(rules_path))
+        return cls._compile(source, lambda: Schematron(file=rules_path, store_schematron=True,
+                                                       store_xslt=True), cache)
+
+    @classmethod
+    def from_document(cls, rules_doc, cache=None):
+        """Compile a parsed Schematron document, or load it from cache if supplied."""
+        # Includes are resolved against the document's URL, if it was parsed
+        tree = rules_doc if hasattr(rules_doc, 'docinfo') else rules_doc.getroottree()
+        return cls._compile(_with_includes(lxml.etree.tostring(rules_doc), tree.docinfo.URL),
+                            lambda: Schematron(etree=rules_doc, store_schematron=True,
+                                               store_xslt=True), cache)
+
+    @classmethod
+    def _compile(cls, source, create_schematron, cache):
+        if cache:
+            cached = cache.load(source)
+            if cached:
+                return cls(cached[0], lxml.etree.XSLT(cached[1]))
+        # Runs the ISO skeleton pipeline, include, abstract expansion and compile
+        schematron = create_schematron()
+        if cache:
+            cache.store(source, schematron.schematron, schematron.validator_xslt)
+        return cls(schematron.schematron, lxml.etree.XSLT(schematron.validator_xslt))
+
+class XsltCache():
+    """On disk cache of the expanded Schematron and generated validator XSLT.
+
+    Entries are keyed by the SHA-1 of the Schematron source and any files it
+    includes, and held in a directory named for the cache format, lxml and
+    libxslt versions, so an edited rules file or an upgraded lxml never loads a
+    stale validator. The directory is created private to the user, entries are
+    only read or written while it's owned by the user and not writable by
+    anyone else."""
+    def __init__(self, root):
+        self._dir = os.path.join(root, 'schematron-v{}-lxml-{}-libxslt-{}'.format(
+            CACHE_VERSION, lxml.__version__,
+            '.'.join(str(part) for part in lxml.etree.LIBXSLT_VERSION)))
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def cache_dir(self):
+        """Return the versioned cache directory."""
+        return self._dir
+
+    @property
+    def hits(self):
+        """Return the number of validators loaded from the cache."""
+        return self._hits
+
+    @property
+    def misses(self):
+        """Return the number of validators that weren't cached."""
+        return self._misses
+
+    def load(self, source):
+        """Return a tuple of the (expanded Schematron, validator XSLT) documents
+        cached for the Schematron source bytes, or None if there's no entry."""
+        sch_path, xsl_path = self._paths(source)
+        if not _private_dir(self._dir):
+            self._misses += 1
+            return None
+        try:
+            cached = lxml.etree.parse(sch_path), lxml.etree.parse(xsl_path)
+        except (OSError, lxml.etree.XMLSyntaxError):
+            self._misses += 1
+            return None
+        self._hits += 1
+        return cached
+
+    def store(self, source, schematron, validator_xslt):
+        """Cache the expanded Schematron and validator XSLT for the source bytes.
+        Failures are logged and otherwise ignored, the cache is an optimisation."""
+        try:
+            os.makedirs(os.path.dirname(self._dir), mode=0o700, exist_ok=True)
+            os.makedirs(self._dir, mode=0o700, exist_ok=True)
+            if not _private_dir(self._dir):
+                logging.warning("Not writing Schematron cache %s, it's not private to the "
+                                "user", self._dir)
+                return
+            for path, doc in zip(self._paths(source), (schematron, validator_xslt)):
+                data = lxml.etree.tostring(doc)
+                UTILS.write_atomic(path, lambda temp_file: temp_file.write(data), private=True)
+        except OSError as os_err:
+            logging.warning("Couldn't write Schematron cache %s: %s", self._dir, os_err)
+
+    def _paths(self, source):
+        key = hashlib.sha1(source).hexdigest()
+        return os.path.join(self._dir, key + '.sch'), os.path.join(self._dir, key + '.xsl')
+
+    @classmethod
+    def from_env(cls):
+        """Create a cache rooted at the directory named by the environment, or in
+        the user's cache directory, XDG_CACHE_HOME or ~/.cache, by default."""
+        cache_home = os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'),
+                                                                 '.cache')
+        return cls(os.getenv(ENV_CACHE_DIR) or os.path.join(cache_home, 'eark-ipv'))
+
+def _with_includes(source, base):
+    # Append the content of included and extended Schematron files, recursively,
+    # so a cache key changes when any of them is edited
+    parts = [source]
+    pending = [(source, base)]
+    seen = set()
+    while pending:
+        data, data_base = pending.pop()
+        try:
+            doc = lxml.etree.fromstring(data)
+        except lxml.etree.XMLSyntaxError:
+            continue
+        for element in doc.iter('{%s}include' % SCH_NS, '{%s}extends' % SCH_NS):
+            href = (element.get('href') or '').split('#', 1)[0]
+            if not href:
+                continue
+            path = os.path.normpath(os.path.join(os.path.dirname(data_base or ''), href))
+            if path in seen:
+                continue
+            seen.add(path)
+            try:
+                with open(path, 'rb') as included:
+                    included_data = included.read()
+            except OSError:
+                included_data = b''
+            parts.append(path.encode() + b'\0' + included_data)
+            pending.append((included_data, path))
+    return b'\0'.join(parts)
+
+def _compile_schema(schema_path):
+    parser = lxml.etree.XMLParser()
+    parser.resolvers.add(CatalogResolver())
+    return lxml.etree.XMLSchema(lxml.etree.parse(schema_path, parser))
+
+def _private_dir(path):
+    # Only trust a real directory owned by this user that no one else can write to
+    try:
+        stats = os.lstat(path)
+    except OSError:
+        return False
+    if not stat.S_ISDIR(stats.st_mode) or stats.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        return False
+    return not hasattr(os, 'getuid') or stats.st_uid == os.getuid()
+
+class ValidatorRegistry():
+    """Thread safe store of compiled validators, keyed by the absolute path of
+    their source file, or a caller supplied key for documents built in memory.
+    Validators are compiled once, on first request, and then shared by every
+    caller in the process. Compiled Schematron XSLT is also persisted to the
+    XsltCache, if one is supplied, to cut the cost of cold starts."""
+    def __init__(self, cache=None):
+        self._cache = cache
+        self._lock = threading.Lock()
+        self._schematrons = {}
+        self._schemas = {}
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def hits(self):
+        """Return the number of requests served from the registry."""
+        return self._hits
+
+    @property
+    def misses(self):
+        """Return the number of requests that required compilation."""
+        return self._misses
+
+    def get_schematron(self, rules_path):
+        """Return the CompiledRules for the Schematron file at rules_path."""
+        return self._get(self._schematrons, os.path.abspath(rules_path),
+                         lambda path: CompiledRules.from_file(path, self._cache))
+
+    def get_built_schematron(self, key, build):
+        """Return the CompiledRules for a Schematron document assembled in memory.
+        The document is only built, by calling build(), if key isn't registered."""
+        return self._get(self._schematrons, key,
+                         lambda _: CompiledRules.from_document(build(), self._cache))
+
+    def get_schema(self, schema_path):
+        """Return a compiled lxml XMLSchema for the XSD file at schema_path,
+        imports listed in SCHEMA_CATALOG are loaded from the bundled copies."""
+        return self._get(self._schemas, os.path.abspath(schema_path), _compile_schema)
+
+    def stats(self):
+        """Return a dictionary of registry counts."""
+        with self._lock:
+            stats = {'hits': self._hits, 'misses': self._misses,
+                     'schematrons': len(self._schematrons), 'schemas': len(self._schemas)}
+            if self._cache:
+                stats.update({'cache_dir': self._cache.cache_dir,
+                              'cache_hits': self._cache.hits,
+                              'cache_misses': self._cache.misses})
+            return stats
+
+    def clear(self):
+        """Discard all compiled validators and reset the counts."""
+        with self._lock:
+            self._schematrons.clear()
+            self._schemas.clear()
+            self._hits = 0
+            self._misses = 0
+
+    def _get(self, store, key, compile_func):
+        # Compilation happens under the lock so concurrent first requests
+        # don't all compile the same file.
+        with self._lock:
+            if key in store:
+                self._hits += 1
+                return store[key]
+            self._misses += 1
+            logging.debug("Compiling validator: %s", key)
+            store[key] = compile_func(key)
+            return store[key]
+
+REGISTRY = ValidatorRegistry(cache=XsltCache.from_env())
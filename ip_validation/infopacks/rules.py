@@ -23,59 +23,48 @@
 # under the License.
 #
 """Module to capture everything schematron validation related."""
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum, unique
 import logging
+import time
 
 import lxml.etree
-from lxml.isoschematron import Schematron
 
 from importlib_resources import files
 
+from ip_validation.infopacks.registry import REGISTRY
 import ip_validation.infopacks.resources.schematron as SCHEMATRON
 
 SCHEMATRON_NS = "{http://purl.oclc.org/dsdl/schematron}"
 SVRL_NS = "{http://purl.oclc.org/dsdl/svrl}"
 
 class ValidationRules():
-    """Encapsulates a set of Schematron rules loaded from a file."""
-    def __init__(self, name, rules_path=None):
+    """Encapsulates a set of Schematron rules loaded from a file.
+
+    The compiled ruleset is borrowed from the process wide validator registry,
+    only the report of the last validation belongs to the instance."""
+    def __init__(self, name, rules_path=None, registry=REGISTRY):
         self.name = name
         if not rules_path:
             rules_path = str(files(SCHEMATRON).joinpath('mets_{}_rules.xml'.format(name)))
         self.rules_path = rules_path
         logging.debug("path: %s", self.rules_path)
-        self.ruleset = Schematron(file=self.rules_path, store_schematron=True, store_report=True)
+        self.ruleset = registry.get_schematron(self.rules_path)
+        self.validation_report = None
 
     def get_assertions(self):
         """Generator that returns the rules one at a time."""
-        xml_rules = lxml.etree.XML(bytes(self.ruleset.schematron))
-
-        for ele in xml_rules.iter():
-            if ele.tag == SCHEMATRON_NS + 'assert':
-                yield ele
+        for ele in self.ruleset.schematron.iter(SCHEMATRON_NS + 'assert'):
+            yield ele
 
     def validate(self, to_validate):
-        """Validate a file against the loaded Schematron ruleset."""
-        xml_file = lxml.etree.parse(to_validate)
-        self.ruleset.validate(xml_file)
+        """Validate a file, or an already parsed document, against the loaded
+        Schematron ruleset."""
+        self.validation_report = self.ruleset(parse_document(to_validate))
 
     def get_report(self):
         """Get the report from the last validation."""
-        xml_report = lxml.etree.XML(bytes(self.ruleset.validation_report))
-        failures = []
-        warnings = []
-        is_valid = True
-        rule = None
-        for ele in xml_report.iter():
-            if ele.tag == SVRL_NS + 'fired-rule':
-                rule = ele
-            elif ele.tag == SVRL_NS + 'failed-assert':
-                if ele.get('role') == 'WARN':
-                    warnings.append(TestResult.from_element(rule, ele))
-                else:
-                    is_valid = False
-                    failures.append(TestResult.from_element(rule, ele))
-        return TestReport(is_valid, failures, warnings)
+        return _to_report(_read_svrl(self.validation_report))
 
 class ValidationProfile():
     """ A complete set of Schematron rule sets that comprise a complete validation profile."""
@@ -89,33 +78,113 @@ class ValidationProfile():
     }
     SECTIONS = NAMES.keys()
 
-    def __init__(self):
+    def __init__(self, fused=False, registry=REGISTRY):
         self.rulesets = {}
+        self.fused = None
         self.is_valid = False
         self.is_wellformed = False
         self.results = {}
         self.messages = []
+        self.timings = {}
+        self.elapsed = 0.0
+        if fused:
+            # One Schematron made up of every section's rules, applied in a
+            # single transform and split back into section reports.
+            self.fused = registry.get_built_schematron('fused:' + ','.join(self.SECTIONS),
+                                                       self._fuse_sections)
+            return
         for section in self.SECTIONS:
-            self.rulesets[section] = ValidationRules(section)
-
-    def validate(self, to_validate):
-        """Validates a file against each loaded ruleset."""
+            self.rulesets[section] = ValidationRules(section, registry=registry)
+
+    def validate(self, to_validate, workers=1):
+        """Validates a file against each loaded ruleset. The file is parsed once
+        and the same document is passed to every ruleset.
+
+        When workers is greater than one the sections are validated concurrently
+        on a pool of that many threads, lxml releases the GIL while applying the
+        XSLT validators. Results are always stored in SECTIONS order, the wall
+        clock time is recorded in elapsed and per section times in timings.
+        Fused profiles apply a single validator so workers is ignored and the
+        time is recorded against the 'fused' key."""
+        start = time.perf_counter()
         is_valid = True
         self.is_wellformed = True
         self.results = {}
         self.messages = []
+        self.timings = {}
+        try:
+            xml_file = parse_document(to_validate)
+        except lxml.etree.XMLSyntaxError as parse_err:
+            self.is_wellformed = False
+            self.is_valid = False
+            self.messages.append(parse_err.msg)
+            self.elapsed = time.perf_counter() - start
+            return
+        if self.fused:
+            reports, self.timings['fused'] = self._validate_fused(xml_file)
+        else:
+            reports = self._validate_sections(xml_file, workers)
         for section in self.SECTIONS:
-            try:
-                self.rulesets[section].validate(to_validate)
-            except lxml.etree.XMLSyntaxError as parse_err:
-                self.is_wellformed = False
-                self.is_valid = False
-                self.messages.append(parse_err.msg)
-                return
-            self.results[section] = self.rulesets[section].get_report()
+            self.results[section] = reports[section]
             if not self.results[section].is_valid:
                 is_valid = False
         self.is_valid = is_valid
+        self.elapsed = time.perf_counter() - start
+        logging.debug("Profile validation took %.3fs, timings: %s", self.elapsed, self.timings)
+
+    def _validate_sections(self, xml_file, workers):
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {section: executor.submit(self._validate_section, section, xml_file)
+                           for section in self.SECTIONS}
+                outcomes = {section: future.result() for section, future in futures.items()}
+        else:
+            outcomes = {section: self._validate_section(section, xml_file)
+                        for section in self.SECTIONS}
+        reports = {}
+        for section in self.SECTIONS:
+            reports[section], self.timings[section] = outcomes[section]
+        return reports
+
+    def _validate_section(self, section, xml_file):
+        start = time.perf_counter()
+        self.rulesets[section].validate(xml_file)
+        return self.rulesets[section].get_report(), time.perf_counter() - start
+
+    def _validate_fused(self, xml_file):
+        start = time.perf_counter()
+        section_asserts = {section: [] for section in self.SECTIONS}
+        for rule, failed in _read_svrl(self.fused(xml_file)):
+            section_asserts[failed.get('flag')].append((rule, failed))
+        reports = {section: _to_report(section_asserts[section]) for section in self.SECTIONS}
+        return reports, time.perf_counter() - start
+
+    @classmethod
+    def _fuse_sections(cls):
+        """Merge the rules of every section into a single Schematron pattern, so
+        the document is traversed once. Each assertion is flagged with its
+        section name, the flag is copied to the SVRL report so that failures can
+        be split back into section reports.
+
+        A node only fires the first matching rule in a pattern, this relies on
+        the sections' rules addressing different elements, which they do."""
+        fused = lxml.etree.Element(SCHEMATRON_NS + 'schema', nsmap={None: SCHEMATRON_NS[1:-1]})
+        prefixes = set()
+        pattern = lxml.etree.Element(SCHEMATRON_NS + 'pattern', id='fused_profile')
+        for section in cls.SECTIONS:
+            rules_path = str(files(SCHEMATRON).joinpath('mets_{}_rules.xml'.format(section)))
+            rules_doc = lxml.etree.parse(rules_path).getroot()
+            for ns_ele in rules_doc.iterfind(SCHEMATRON_NS + 'ns'):
+                if ns_ele.get('prefix') not in prefixes:
+                    prefixes.add(ns_ele.get('prefix'))
+                    fused.append(ns_ele)
+            for rule in rules_doc.iterfind('{0}pattern/{0}rule'.format(SCHEMATRON_NS)):
+                for test in rule.iter(SCHEMATRON_NS + 'assert', SCHEMATRON_NS + 'report'):
+                    test.set('flag', section)
+                pattern.append(rule)
+        # Schematron requires the namespace declarations ahead of the patterns
+        fused.append(pattern)
+        return lxml.etree.ElementTree(fused)
 
     def get_results(self):
         """Return the full set of results."""
@@ -125,6 +194,39 @@ class ValidationProfile():
         """Return only the results for element name."""
         return self.results.get(name)
 
+def _read_svrl(svrl):
+    """Generator over the failed assertions in an SVRL report tree, walked in place.
+    Yields (fired rule, failed assert) tuples, fired rules precede the assertions
+    that failed within them."""
+    rule = None
+    # A single pass over the report's children, an XPath union of the two would
+    # be sorted into document order which is quadratic for large reports.
+    for ele in svrl.getroot().iterchildren(SVRL_NS + 'fired-rule', SVRL_NS + 'failed-assert'):
+        if ele.tag == SVRL_NS + 'fired-rule':
+            rule = ele
+        else:
+            yield rule, ele
+
+def _to_report(failed_asserts):
+    """Create a TestReport from (fired rule, failed assert) pairs."""
+    failures = []
+    warnings = []
+    is_valid = True
+    for rule, failed in failed_asserts:
+        if failed.get('role') == 'WARN':
+            warnings.append(TestResult.from_element(rule, failed))
+        else:
+            is_valid = False
+            failures.append(TestResult.from_element(rule, failed))
+    return TestReport(is_valid, failures, warnings)
+
+def parse_document(to_validate):
+    """Parse a file path or file object, documents that have already been parsed
+    are returned unchanged."""
+    if hasattr(to_validate, 'getroot'):
+        return to_validate
+    return lxml.etree.parse(to_validate)
+
 @unique
 class Severity(Enum):
     """Enum covering information package validation statuses."""
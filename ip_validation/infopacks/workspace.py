@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# coding=UTF-8
+#
+# E-ARK Validation
+# Copyright (C) 2019
+# All rights reserved.
+#
+# Licensed to the E-ARK project under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The E-ARK project licenses
+# this file to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""Managed, size bounded workspace for unpacked information packages."""
+from contextlib import contextmanager
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, trees are only protected from eviction within a process
+    fcntl = None
+
+from ip_validation.const import ENV_UNPACK_DIR, ENV_UNPACK_QUOTA
+import ip_validation.utils as UTILS
+
+PART_PREFIX = '.part-'
+LOCK_EXT = '.lock'
+DEFAULT_QUOTA = 1024 * 1024 * 1024
+# Interrupted unpacks of processes that may still be running are kept this long
+STALE_PART_SECS = 24 * 60 * 60
+
+class UnpackWorkspace():
+    """Directory of unpacked package trees, each named for the SHA-1 digest of
+    its archive. Only directories named for a digest, and unpacks interrupted
+    by exited processes, are ever deleted, so the root can be shared.
+
+    Validation reads archives in place, so the workspace only serves callers
+    that need a package's files on disk, through ArchivePackageHandler, and
+    bounds the disk space they use. It also holds the fixity cache database.
+
+    Trees are reused while they're on disk, each use refreshes its modification
+    time. Once the trees take up more than max_bytes the least recently used
+    are deleted. Trees checked out with checkout() are never evicted while in
+    use. Each tree has a lock file, held shared while it's checked out and
+    exclusively to evict it, so processes sharing the root can't evict each
+    other's trees. Where fcntl isn't available only the checkouts of this
+    process are protected. The quota is applied to the trees this process
+    knows of. Trees left by earlier processes are picked up on first use, not
+    on creation, so creating a workspace is cheap."""
+    def __init__(self, root, max_bytes=DEFAULT_QUOTA):
+        self._root = root
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._refs = {}
+        self._sizes = {}
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._scanned = False
+
+    @property
+    def root(self):
+        """Return the workspace directory."""
+        return self._root
+
+    @property
+    def max_bytes(self):
+        """Return the workspace quota in bytes."""
+        return self._max_bytes
+
+    def unpack(self, digest, extract):
+        """Return the path of the unpacked tree for digest. If it's not in the
+        workspace extract(dest) is called to unpack the archive to dest. The
+        tree isn't checked out, so may be evicted by later unpacks."""
+        lock = self._acquire(digest, extract)
+        self._release(digest, lock, keep=digest)
+        return self._path(digest)
+
+    @contextmanager
+    def checkout(self, digest, extract):
+        """Context manager yielding the path of the unpacked tree for digest,
+        as unpack(), the tree can't be evicted until the context exits."""
+        lock = self._acquire(digest, extract)
+        try:
+            yield self._path(digest)
+        finally:
+            self._release(digest, lock)
+
+    def stats(self):
+        """Return a dictionary of workspace disk usage and counts."""
+        with self._lock:
+            self._scan()
+            return {'root': self._root, 'trees': len(self._sizes),
+                    'in_use': len(self._refs), 'bytes': sum(self._sizes.values()),
+                    'max_bytes': self._max_bytes, 'hits': self._hits,
+                    'misses': self._misses, 'evictions': self._evictions}
+
+    def _acquire(self, digest, extract):
+        # Returns the tree's lock, held shared until _release
+        path = self._path(digest)
+        os.makedirs(self._root, exist_ok=True)
+        lock = self._lock_tree(digest, shared=True)
+        with self._lock:
+            self._scan()
+            self._refs[digest] = self._refs.get(digest, 0) + 1
+            if os.path.isdir(path):
+                # Possibly unpacked by another process sharing the root
+                self._hits += 1
+                os.utime(path)
+                if digest not in self._sizes:
+                    self._sizes[digest] = _tree_size(path)
+                return lock
+            self._misses += 1
+        # Unpack outside the lock to a temp dir, then rename into place
+        try:
+            # Named for this process, so a scan can tell if it's been abandoned
+            temp_path = tempfile.mkdtemp(prefix='{}{}-'.format(PART_PREFIX, os.getpid()),
+                                         dir=self._root)
+            try:
+                extract(temp_path)
+                size = _tree_size(temp_path)
+                with self._lock:
+                    try:
+                        os.replace(temp_path, path)
+                    except OSError:
+                        # Another thread or process unpacked the same archive first
+                        if not os.path.isdir(path):
+                            raise
+                        os.utime(path)
+                    self._sizes.setdefault(digest, size)
+                    self._evict(keep=digest)
+            finally:
+                shutil.rmtree(temp_path, ignore_errors=True)
+        except BaseException:
+            self._release(digest, lock)
+            raise
+        return lock
+
+    def _release(self, digest, lock, keep=None):
+        # Drop a reference then evict any trees over quota
+        with self._lock:
+            _unlock(lock)
+            self._refs[digest] -= 1
+            if self._refs[digest] < 1:
+                del self._refs[digest]
+                if not os.path.isdir(self._path(digest)):
+                    # A failed unpack, only the lock file is left
+                    self._remove_tree(digest)
+            self._evict(keep)
+
+    def _evict(self, keep):
+        # Called with the lock held
+        total = sum(self._sizes.values())
+        if total <= self._max_bytes:
+            return
+        candidates = [digest for digest in self._sizes
+                      if digest != keep and digest not in self._refs]
+        for digest in sorted(candidates, key=self._mtime):
+            if total <= self._max_bytes:
+                break
+            if not self._remove_tree(digest):
+                # Checked out by another process
+                continue
+            total -= self._sizes.pop(digest)
+            self._evictions += 1
+            logging.debug("Evicted unpacked package: %s", digest)
+
+    def _remove_tree(self, digest):
+        # Delete a tree and its lock file, unless another process holds the lock
+        lock = self._lock_tree(digest, shared=False)
+        if lock is False:
+            return False
+        try:
+            shutil.rmtree(self._path(digest), ignore_errors=True)
+            if lock is not None:
+                os.remove(self._path(digest) + LOCK_EXT)
+        finally:
+            _unlock(lock)
+        return True
+
+    def _lock_tree(self, digest, shared):
+        # Take a shared, blocking, or exclusive, non-blocking, flock on the
+        # tree's lock file. Returns False if an exclusive lock isn't available
+        # and None where flock isn't supported.
+        if fcntl is None:
+            return None
+        lock_path = self._path(digest) + LOCK_EXT
+        operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX | fcntl.LOCK_NB
+        while True:
+            handle = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(handle, operation)
+            except BlockingIOError:
+                os.close(handle)
+                return False
+            # Retry if the lock file was removed while we waited for it
+            try:
+                if os.fstat(handle).st_ino == os.stat(lock_path).st_ino:
+                    return handle
+            except FileNotFoundError:
+                pass
+            os.close(handle)
+
+    def _scan(self):
+        # Called with the lock held, on first use picks up trees left by
+        # previous processes and clears interrupted unpacks
+        if self._scanned:
+            return
+        self._scanned = True
+        if not os.path.isdir(self._root):
+            return
+        with os.scandir(self._root) as entries:
+            for entry in entries:
+                if not entry.is_dir(follow_symlinks=False):
+                    continue
+                if entry.name.startswith(PART_PREFIX):
+                    if _stale_part(entry):
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                elif UTILS.is_sha1(entry.name):
+                    self._sizes[entry.name] = _tree_size(entry.path)
+
+    def _mtime(self, digest):
+        try:
+            return os.stat(self._path(digest)).st_mtime
+        except OSError:
+            return 0
+
+    def _path(self, digest):
+        if not UTILS.is_sha1(digest):
+            raise ValueError("Invalid package digest: {!r}".format(digest))
+        return os.path.join(self._root, digest)
+
+    @classmethod
+    def from_env(cls):
+        """Create a workspace rooted at the directory named by the environment, or
+        in the temp directory by default, with the quota from the environment."""
+        return cls(os.getenv(ENV_UNPACK_DIR, os.path.join(tempfile.gettempdir(),
+                                                          'eark-ipv-unpack')),
+                   max_bytes=int(os.getenv(ENV_UNPACK_QUOTA, DEFAULT_QUOTA)))
+
+def _unlock(lock):
+    if lock is not None and lock is not False:
+        os.close(lock)
+
+def _stale_part(entry):
+    # An unpack is abandoned if its process has exited, or it's old enough
+    # that the process id may have been reused
+    pid = entry.name[len(PART_PREFIX):].split('-', 1)[0]
+    try:
+        if time.time() - entry.stat(follow_symlinks=False).st_mtime > STALE_PART_SECS:
+            return True
+    except OSError:
+        return False
+    return pid.isdigit() and not UTILS.pid_alive(int(pid))
+
+def _tree_size(root):
+    size = 0
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            try:
+                size += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return size
+
+WORKSPACE = UnpackWorkspace.from_env()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# coding=UTF-8
+#
+# E-ARK Validation
+# Copyright (C) 2019
+# All rights reserved.
+#
+# Licensed to the E-ARK project under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The E-ARK project licenses
+# this file to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""Asynchronous validation jobs, persisted in SQLite and run on a local pool."""
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum, unique
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+import ip_validation.utils as UTILS
+
+@unique
+class JobState(Enum):
+    """Enum covering the life cycle of a validation job."""
+    # Waiting for a worker
+    Queued = 1
+    # Being validated
+    Running = 2
+    # Validated, the report is available
+    Finished = 3
+    # Validation raised an exception
+    Failed = 4
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    state TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    report TEXT,
+    error TEXT,
+    owner TEXT
+)"""
+
+class JobQueue():
+    """Queue of package validation jobs.
+
+    Jobs are recorded in an SQLite database, so their state and reports
+    survive the request that submitted them, and are validated by a pool of
+    worker threads in this process. Each job records the host and process id
+    of the queue that owns it, jobs left queued or running by a process on
+    this host that's no longer alive are marked as failed on start up."""
+    def __init__(self, db_path, workers=2):
+        self._db_path = db_path
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._owner = '{}:{}'.format(socket.gethostname(), os.getpid())
+        with self._connect() as conn:
+            conn.execute(SCHEMA)
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+            if 'owner' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            unfinished = conn.execute("SELECT id, owner FROM jobs WHERE state IN (?, ?)",
+                                      (JobState.Queued.name, JobState.Running.name)).fetchall()
+            now = time.time()
+            conn.executemany("UPDATE jobs SET state = ?, error = ?, updated = ? WHERE id = ?",
+                             [(JobState.Failed.name, 'Interrupted by shutdown', now, job_id)
+                              for job_id, owner in unfinished if not _owner_alive(owner)])
+
+    def submit(self, digest, validate):
+        """Queue a job to validate the package with the given digest. validate is
+        called on a worker thread with a progress callback, that takes a fraction
+        between 0 and 1, and must return a JSON serialisable report. Returns the
+        new job's id."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT INTO jobs (id, digest, state, created, updated, owner) "
+                         "VALUES (?, ?, ?, ?, ?, ?)",
+                         (job_id, digest, JobState.Queued.name, now, now, self._owner))
+        self._executor.submit(self._run, job_id, validate)
+        return job_id
+
+    def get(self, job_id):
+        """Return a dictionary describing the job, or None if there's no such job."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT id, digest, state, progress, created, updated, "
+                               "report, error FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {'id': row[0], 'digest': row[1], 'state': row[2], 'progress': row[3],
+                'created': row[4], 'updated': row[5],
+                'report': json.loads(row[6]) if row[6] else None, 'error': row[7]}
+
+    def shutdown(self, wait=True):
+        """Stop the worker pool."""
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, job_id, validate):
+        self._update(job_id, state=JobState.Running.name)
+        try:
+            report = validate(lambda progress: self._update(job_id, progress=progress))
+        except Exception as excep: # pylint: disable-msg=W0703
+            logging.exception("Validation job %s failed", job_id)
+            self._update(job_id, state=JobState.Failed.name, error=str(excep))
+            return
+        self._update(job_id, state=JobState.Finished.name, progress=1.0,
+                     report=json.dumps(report))
+
+    def _update(self, job_id, **values):
+        values['updated'] = time.time()
+        columns = ', '.join('{} = ?'.format(column) for column in values)
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET {} WHERE id = ?".format(columns),
+                         list(values.values()) + [job_id])
+
+    def _connect(self):
+        # A connection per operation, SQLite connections can't be shared
+        # between threads and the lock serialises writers in this process.
+        return UTILS.LockedConnection(self._db_path, self._lock)
+
+def _owner_alive(owner):
+    """Return True if the process that owns a job may still be running. Jobs
+    without an owner predate owners being recorded, and processes on other
+    hosts can't be checked so they're assumed to be alive."""
+    if not owner:
+        return False
+    host, _, pid = owner.rpartition(':')
+    if host != socket.gethostname():
+        return True
+    return not pid.isdigit() or UTILS.pid_alive(int(pid))
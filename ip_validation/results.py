@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# coding=UTF-8
+#
+# E-ARK Validation
+# Copyright (C) 2019
+# All rights reserved.
+#
+# Licensed to the E-ARK project under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The E-ARK project licenses
+# this file to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""Content addressed store of package validation results."""
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from importlib_resources import files
+
+import ip_validation.infopacks.resources.schemas as SCHEMA
+import ip_validation.infopacks.resources.schematron as SCHEMATRON
+import ip_validation.utils as UTILS
+
+RESULT_EXT = '.json'
+
+def profile_version():
+    """Return a digest of the schema and Schematron resources, so results are
+    never served after the validation rules change."""
+    hasher = hashlib.sha1()
+    for package in (SCHEMA, SCHEMATRON):
+        for resource in sorted(files(package).iterdir(), key=lambda res: res.name):
+            if resource.name.endswith(('.xsd', '.xml')):
+                hasher.update(resource.read_bytes())
+    return hasher.hexdigest()
+
+class ResultCache():
+    """Stores validation results as JSON files named for the package SHA-1
+    digest, the validator version and the profile version.
+
+    Digests that aren't SHA-1 hex strings raise a ValueError. Reads refresh an
+    entry's modification time, when the store grows past
+    max_entries files or max_bytes in total the least recently used results
+    are evicted."""
+    def __init__(self, root, validator_version, max_entries=1000, max_bytes=256 * 1024 * 1024):
+        self._root = root
+        self._version = '{}-{}'.format(validator_version, profile_version()[:12])
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @property
+    def root(self):
+        """Return the cache directory."""
+        return self._root
+
+    @property
+    def version(self):
+        """Return the combined validator and profile version string."""
+        return self._version
+
+    def get(self, digest):
+        """Return the cached result for digest or None if not present."""
+        path = self._path(digest)
+        try:
+            with open(path, 'r') as result_file:
+                result = json.load(result_file)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return result
+
+    def put(self, digest, result):
+        """Store the result for digest, evicting older results if necessary."""
+        path = self._path(digest)
+        os.makedirs(self._root, exist_ok=True)
+        UTILS.write_atomic(path, lambda temp_file: json.dump(result, temp_file), mode='w')
+        self._evict()
+
+    def invalidate(self, digest):
+        """Remove all results for digest, whatever their version. Returns the
+        number of results removed."""
+        self._path(digest)
+        removed = 0
+        with self._lock:
+            for entry in self._entries():
+                if entry.name.startswith(digest + '-'):
+                    _remove(entry.path)
+                    removed += 1
+        return removed
+
+    def _path(self, digest):
+        if not UTILS.is_sha1(digest):
+            raise ValueError("Invalid package digest: {!r}".format(digest))
+        return os.path.join(self._root, '{}-{}{}'.format(digest, self._version, RESULT_EXT))
+
+    def _entries(self):
+        if not os.path.isdir(self._root):
+            return []
+        return [entry for entry in os.scandir(self._root)
+                if entry.is_file() and entry.name.endswith(RESULT_EXT)]
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for entry in self._entries():
+                try:
+                    stats = entry.stat()
+                except FileNotFoundError:
+                    # Already removed by another worker
+                    continue
+                entries.append((stats.st_mtime, stats.st_size, entry))
+            entries.sort(key=lambda item: item[0])
+            total_bytes = sum(size for _, size, _ in entries)
+            while entries and (len(entries) > self._max_entries or
+                               total_bytes > self._max_bytes):
+                _, size, oldest = entries.pop(0)
+                logging.debug("Evicting validation result %s", oldest.name)
+                total_bytes -= size
+                _remove(oldest.path)
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        # Already removed by another worker
+        pass
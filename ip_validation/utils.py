@@ -27,20 +27,142 @@ E-ARK : Information package validation
         Utilities
 """
 import hashlib
-import os.path
+import mmap
+import os
+import re
+import sqlite3
+import tempfile
 
 BLOCKSIZE = 1024 * 64
+DIGEST_BLOCKSIZE = 1024 * 1024
+# Files at least this size are memory mapped rather than read
+MMAP_THRESHOLD = 64 * 1024 * 1024
+SHA1_PATTERN = re.compile(r'[0-9a-f]{40}')
+# Read once on import, setting the umask to read it isn't thread safe
+UMASK = os.umask(0)
+os.umask(UMASK)
 
-def sha1(path, blocksize=BLOCKSIZE):
+def is_sha1(value):
+    """Return True if value is a lower case hex SHA-1 digest. Digests name files,
+    so anything else could be a path outside of the intended folder."""
+    return isinstance(value, str) and SHA1_PATTERN.fullmatch(value) is not None
+
+def pid_alive(pid):
+    """Return True if a process with the id pid is running on this host, or
+    may be, it exists but belongs to another user."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def sha1(path, blocksize=BLOCKSIZE, cache=None):
     """Fault tolerant sha_1(path) routine. Calaculates the SHA-1 digest of any
     file found at path arg. Returns None when the passed arg isn't a file path or
-    arg can not be hashed."""
+    arg can not be hashed. If a FixityCache is supplied unchanged files aren't
+    hashed again."""
     if not os.path.isfile(path):
         return None
+    if cache is not None:
+        return cache.digest(path, 'sha1', lambda: sha1(path, blocksize))
+    return digests(path, ['sha1'], blocksize)[1]['sha1']
+
+def digests(source, algorithms, blocksize=DIGEST_BLOCKSIZE, buffer=None):
+    """Calculate digests for any number of hashlib algorithms, named by
+    algorithms, reading the data once. source is a file path or a binary stream.
+    Returns a tuple of the number of bytes read and a dictionary of hex digests
+    keyed by algorithm.
+
+    Streams and files smaller than MMAP_THRESHOLD are read with readinto to a
+    buffer of blocksize bytes, pass a bytearray as buffer to reuse one between
+    calls. Larger files are memory mapped and hashed a block at a time."""
+    hashers = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+    if not isinstance(source, (str, bytes, os.PathLike)):
+        size = _digest_stream(source, hashers.values(), buffer or bytearray(blocksize))
+    else:
+        with open(source, 'rb') as stream:
+            size = os.fstat(stream.fileno()).st_size
+            # Empty files can't be mapped
+            if size and size >= MMAP_THRESHOLD:
+                _digest_mmap(stream, size, hashers.values(), blocksize)
+            else:
+                size = _digest_stream(stream, hashers.values(),
+                                      buffer or bytearray(blocksize))
+    return size, {algorithm: hasher.hexdigest() for algorithm, hasher in hashers.items()}
+
+def _digest_stream(stream, hashers, buffer):
+    size = 0
+    with memoryview(buffer) as view:
+        while True:
+            count = stream.readinto(buffer)
+            if not count:
+                return size
+            size += count
+            for hasher in hashers:
+                hasher.update(view[:count])
+
+def _digest_mmap(stream, size, hashers, blocksize):
+    # Each block is passed to every hasher while it's in the CPU cache
+    with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as mapped, \
+            memoryview(mapped) as view:
+        for offset in range(0, size, blocksize):
+            for hasher in hashers:
+                hasher.update(view[offset:offset + blocksize])
+
+def write_atomic(path, write, mode='wb', suffix='.tmp', private=False):
+    """Call write(file) with a temp file, opened with mode in the directory of
+    path, then rename the temp file to path so readers never see a partial
+    file. If write returns False the file is discarded instead. The temp file
+    is removed whatever write raises. Files get the usual 0o666 less umask
+    permissions, or if private can only be read by their owner."""
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=suffix)
+    try:
+        with os.fdopen(handle, mode) as temp_file:
+            store = write(temp_file) is not False
+        if store:
+            if not private:
+                os.chmod(temp_path, 0o666 & ~UMASK)
+            os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def save_sha1(stream, dest_path, digest, blocksize=BLOCKSIZE):
+    """Copy the contents of a readable stream to dest_path, calculating the SHA-1
+    digest as the data is written. The data is written to a temporary file in
+    the destination directory and only renamed to dest_path if the calculated
+    digest matches digest. Returns the calculated digest."""
     hasher = hashlib.sha1()
-    with open(path, 'rb') as afile:
-        buf = afile.read(blocksize)
+    def copy(dest):
+        buf = stream.read(blocksize)
         while len(buf) > 0:
             hasher.update(buf)
-            buf = afile.read(blocksize)
+            dest.write(buf)
+            buf = stream.read(blocksize)
+        return hasher.hexdigest() == digest
+    write_atomic(dest_path, copy, suffix='.part')
     return hasher.hexdigest()
+
+class LockedConnection():
+    """Context manager that holds a lock for the life of an SQLite connection and
+    commits on success. SQLite connections can't be shared between threads, so
+    callers open one per operation and the lock serialises writers in a process."""
+    def __init__(self, db_path, lock):
+        self._db_path = db_path
+        self._lock = lock
+        self._conn = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._conn = sqlite3.connect(self._db_path, timeout=30)
+        return self._conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self._conn.commit()
+            self._conn.close()
+        finally:
+            self._lock.release()
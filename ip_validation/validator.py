@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# coding=UTF-8
+#
+# E-ARK Validation
+# Copyright (C) 2019
+# All rights reserved.
+#
+# Licensed to the E-ARK project under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The E-ARK project licenses
+# this file to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""Full package validation pipeline, shared by the web app and ip-check."""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
+import os
+import shutil
+import tempfile
+
+import lxml.etree
+
+from ip_validation.infopacks.fixity import check_fixity, DEFAULT_WORKERS
+from ip_validation.infopacks.mets import MetsValidator
+from ip_validation.infopacks.registry import REGISTRY
+from ip_validation.infopacks.rules import ValidationProfile
+import ip_validation.infopacks.information_package as IP
+
+# Archived METS files up to this size are held in memory between passes
+METS_SPOOL_BYTES = 16 * 1024 * 1024
+
+class PackageValidator():
+    """Carries out structure, METS schema and Schematron profile validation of
+    packages, returning report dictionaries that can be serialised as JSON.
+
+    The compiled validators come from the shared registry and the same
+    ValidationProfile is used for every package. Validating stores results on
+    the profile, so threads that validate concurrently need their own instance.
+    If checksums is True file sizes and checksums are verified against the METS
+    files on a pool of fixity_workers threads, using the fixity_cache if one is
+    supplied.
+
+    Representation METS files referenced from the package METS are validated
+    concurrently on up to mets_workers threads, each with its own profile, and
+    rolled up into the package result."""
+    def __init__(self, limits=IP.DEFAULT_LIMITS, profile=None, checksums=False,
+                 fixity_workers=DEFAULT_WORKERS, fixity_cache=None,
+                 mets_workers=DEFAULT_WORKERS, registry=REGISTRY):
+        self._limits = limits
+        self._registry = registry
+        self._profile = profile if profile else ValidationProfile(registry=registry)
+        self._mets_workers = mets_workers
+        self._checksums = checksums
+        self._fixity_workers = fixity_workers
+        self._fixity_cache = fixity_cache
+
+    @property
+    def limits(self):
+        """Get the ArchiveLimits applied to archived packages."""
+        return self._limits
+
+    @property
+    def profile(self):
+        """Get the ValidationProfile used for Schematron validation."""
+        return self._profile
+
+    def validate(self, to_validate, progress=None):
+        """Validate the package directory or archive at to_validate. If supplied
+        progress is called with the fraction of validation stages completed."""
+        progress = progress if progress else lambda _: None
+        # Validate package structure
+        struct_details = IP.validate_package_structure(to_validate, limits=self._limits)
+        progress(1 / 3)
+        report = {
+            'package': struct_details.to_json(),
+            'manifest_errors': [],
+            'schema_valid': None,
+            'schema_errors': [],
+            'metadata_valid': None,
+            'profile_results': {},
+            'representations': []
+        }
+        # IF package is well formed then we can validate it.
+        if struct_details.structure_status != IP.StructureStatus.WellFormed:
+            return report
+        if self._checksums:
+            # Only files in package directories have digests in the cache
+            cache = self._fixity_cache \
+                if struct_details.listing.local_path('') is not None else None
+            before = cache.stats() if cache else None
+            report['manifest_errors'] = check_fixity(struct_details, self._fixity_workers,
+                                                     cache)
+            report['package'] = struct_details.to_json()
+            if cache:
+                after = cache.stats()
+                hits = after['hits'] - before['hits']
+                misses = after['misses'] - before['misses']
+                if hits or misses:
+                    report['fixity_cache'] = {'hits': hits, 'misses': misses}
+        # Schema based METS validation first
+        try:
+            validator = MetsValidator(struct_details.path, self._registry)
+        except lxml.etree.XMLSchemaParseError as schema_err:
+            # Report, rather than fail a batch, if the METS schema can't be loaded
+            report['schema_valid'] = False
+            report['schema_errors'] = ['METS schema could not be loaded: {}'.format(schema_err)]
+            return report
+        report.update(self._validate_mets(struct_details, IP.METS_NAME, validator,
+                                          self._profile))
+        progress(2 / 3)
+        report['representations'] = self._validate_representations(
+            struct_details, validator.representation_mets())
+        # Roll the representation results up into the package result
+        for rep in report['representations']:
+            if rep['schema_valid'] is False:
+                report['schema_valid'] = False
+            report['schema_errors'].extend('{}: {}'.format(rep['mets'], error)
+                                           for error in rep['schema_errors'])
+            if rep['metadata_valid'] is False and report['metadata_valid'] is not None:
+                report['metadata_valid'] = False
+        return report
+
+    def _validate_representations(self, struct_details, rep_mets):
+        """Validate the representation METS files concurrently, returning a list
+        of their reports in the order they appear in the package METS."""
+        if not rep_mets:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self._mets_workers, len(rep_mets))) as executor:
+            futures = [executor.submit(self._validate_representation, struct_details, rep,
+                                       mets_path)
+                       for rep, mets_path in rep_mets]
+            return [future.result() for future in futures]
+
+    def _validate_representation(self, struct_details, rep, mets_path):
+        name = os.path.relpath(mets_path, struct_details.path).replace(os.sep, '/')
+        rep_report = {'representation': rep, 'mets': name, 'schema_valid': False,
+                      'schema_errors': [], 'metadata_valid': None, 'profile_results': {}}
+        if name.startswith('../'):
+            rep_report['schema_errors'].append('METS file is outside the package.')
+            return rep_report
+        # Each representation needs its own validator and profile to hold results
+        profile = ValidationProfile(fused=self._profile.fused is not None,
+                                    registry=self._registry)
+        rep_report.update(self._validate_mets(struct_details, name,
+                                              MetsValidator(struct_details.path, self._registry),
+                                              profile))
+        return rep_report
+
+    @staticmethod
+    def _validate_mets(struct_details, name, validator, profile):
+        """Schema validate the METS file name, and if valid apply the Schematron
+        profile, returning the results as a report dictionary."""
+        report = {'schema_valid': None, 'schema_errors': [], 'metadata_valid': None,
+                  'profile_results': {}}
+        with ExitStack() as stack:
+            try:
+                mets_file = stack.enter_context(_open_mets(struct_details, name))
+                report['schema_valid'] = validator.validate_mets(mets_file)
+            except (OSError, KeyError):
+                report['schema_valid'] = False
+                report['schema_errors'] = ['METS file {} not found in package.'.format(name)]
+                return report
+            # Now grab any errors
+            report['schema_errors'] = [getattr(_err, 'msg', str(_err))
+                                       for _err in validator.validation_errors]
+            if report['schema_valid'] is True:
+                # Schematron validation profile, from the same copy of the METS
+                mets_file.seek(0)
+                profile.validate(mets_file)
+                report['metadata_valid'] = profile.is_valid
+                for section, result in profile.get_results().items():
+                    report['profile_results'][section] = {
+                        'is_valid': result.is_valid,
+                        'failures': [failure.to_json() for failure in result.failures],
+                        'warnings': [warning.to_json() for warning in result.warnings]
+                    }
+        return report
+
+@contextmanager
+def _open_mets(struct_details, name):
+    # Yields a seekable METS stream for the schema and Schematron passes. Files
+    # in directories are read in place, archive members are read out of the
+    # archive once, into a spooled temp file, rather than once per pass.
+    with struct_details.open(name) as mets_file:
+        listing = struct_details.listing
+        if listing is None or listing.local_path(struct_details.listing_path(name)):
+            yield mets_file
+            return
+        with tempfile.SpooledTemporaryFile(max_size=METS_SPOOL_BYTES) as spool:
+            shutil.copyfileobj(mets_file, spool)
+            spool.seek(0)
+            yield spool
@@ -24,11 +24,20 @@
 #
 
 from enum import Enum
+import hashlib
+import io
 import os
+import stat
+import tarfile
+import tempfile
 import unittest
+import zipfile
 
 from ip_validation.infopacks import information_package as IP
+from ip_validation.infopacks.rules import Severity
+from ip_validation.infopacks.workspace import UnpackWorkspace
 import ip_validation.utils as UTILS
+from tests.utils import contains_rule_id
 
 MIN_TAR_SHA1 = '47ca3a9d7f5f23bf35b852a99785878c5e543076'
 
@@ -68,6 +77,49 @@ class ArchiveHandlerTest(unittest.TestCase):
         sha1 = UTILS.sha1(self.min_tar_path)
         self.assertTrue(sha1 == MIN_TAR_SHA1)
 
+    def test_digests(self):
+        with open(self.min_tar_path, 'rb') as tar_file:
+            data = tar_file.read()
+        expected = {name: hashlib.new(name, data).hexdigest()
+                    for name in ('md5', 'sha1', 'sha256', 'sha512')}
+        self.assertTrue(UTILS.digests(self.min_tar_path, expected.keys()) ==
+                        (len(data), expected))
+        with open(self.min_tar_path, 'rb') as stream:
+            self.assertTrue(UTILS.digests(stream, expected.keys(), blocksize=1000) ==
+                            (len(data), expected))
+        self.assertTrue(UTILS.digests(self.empty_path, ['sha1'])[1]['sha1'] ==
+                        'da39a3ee5e6b4b0d3255bfef95601890afd80709')
+
+    def test_digests_mmap(self):
+        threshold = UTILS.MMAP_THRESHOLD
+        UTILS.MMAP_THRESHOLD = 1
+        try:
+            self.assertTrue(UTILS.digests(self.min_tar_path, ['sha1'], blocksize=1000)[1] ==
+                            {'sha1': MIN_TAR_SHA1})
+            self.assertTrue(UTILS.sha1(self.empty_path) ==
+                            'da39a3ee5e6b4b0d3255bfef95601890afd80709')
+        finally:
+            UTILS.MMAP_THRESHOLD = threshold
+
+    def test_save_sha1(self):
+        with tempfile.TemporaryDirectory() as dest_dir:
+            dest_path = os.path.join(dest_dir, MIN_TAR_SHA1)
+            with open(self.min_tar_path, 'rb') as stream:
+                sha1 = UTILS.save_sha1(stream, dest_path, MIN_TAR_SHA1)
+            self.assertTrue(sha1 == MIN_TAR_SHA1)
+            self.assertTrue(UTILS.sha1(dest_path) == MIN_TAR_SHA1)
+            self.assertTrue(os.listdir(dest_dir) == [MIN_TAR_SHA1])
+            # Uploads get the usual permissions, not the private temp file's
+            self.assertTrue(stat.S_IMODE(os.stat(dest_path).st_mode) == 0o666 & ~UTILS.UMASK)
+
+    def test_save_sha1_mismatch(self):
+        with tempfile.TemporaryDirectory() as dest_dir:
+            dest_path = os.path.join(dest_dir, 'mismatch')
+            with open(self.min_tar_path, 'rb') as stream:
+                sha1 = UTILS.save_sha1(stream, dest_path, 'mismatch')
+            self.assertTrue(sha1 == MIN_TAR_SHA1)
+            self.assertTrue(os.listdir(dest_dir) == [])
+
     def test_is_archive(self):
         self.assertTrue(IP.ArchivePackageHandler.is_archive(self.min_tar_path))
         self.assertTrue(IP.ArchivePackageHandler.is_archive(self.min_zip_path))
@@ -87,5 +139,80 @@ class ArchiveHandlerTest(unittest.TestCase):
         dest = handler.unpack_package(self.min_targz_path)
         self.assertTrue(os.path.basename(dest) == 'db2703ff464e613e9d1dc5c495e23a2e2d49b89d')
 
+class ArchiveLimitsTest(unittest.TestCase):
+    """Tests for the resource limits checked before archives are extracted."""
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _zip(self, members):
+        zip_path = os.path.join(self.temp_dir.name, 'package.zip')
+        with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as zip_ip:
+            for name, data in members.items():
+                zip_ip.writestr(name, data)
+        return zip_path
+
+    def _assert_limit_error(self, package_path, limits):
+        details = IP.validate_package_structure(package_path, limits=limits)
+        self.assertTrue(details.structure_status == IP.StructureStatus.NotWellFormed)
+        self.assertTrue(contains_rule_id(details.errors, "CSIPSTR3", severity=Severity.Error))
+
+    def test_compression_ratio(self):
+        zip_path = self._zip({'package/METS.xml': b'0' * (4 * 1024 * 1024)})
+        self._assert_limit_error(zip_path, IP.ArchiveLimits())
+
+    def test_max_bytes(self):
+        zip_path = self._zip({'package/METS.xml': b'<mets/>' * 100})
+        self._assert_limit_error(zip_path, IP.ArchiveLimits(max_bytes=100))
+
+    def test_max_members(self):
+        zip_path = self._zip({'package/file{}'.format(i): b'' for i in range(10)})
+        self._assert_limit_error(zip_path, IP.ArchiveLimits(max_members=5))
+
+    def test_max_depth(self):
+        zip_path = self._zip({'package/' + 'deep/' * 10 + 'file': b''})
+        self._assert_limit_error(zip_path, IP.ArchiveLimits(max_depth=5))
+        details = IP.validate_package_structure(zip_path, limits=IP.ArchiveLimits(max_depth=15))
+        self.assertFalse(contains_rule_id(details.errors, "CSIPSTR3"))
+
+    def test_unpack_fails_fast(self):
+        zip_path = self._zip({'package/file{}'.format(i): b'' for i in range(10)})
+        unpack_root = os.path.join(self.temp_dir.name, 'unpack')
+        handler = IP.ArchivePackageHandler(workspace=UnpackWorkspace(unpack_root),
+                                           limits=IP.ArchiveLimits(max_members=5))
+        self.assertRaises(IP.ArchiveLimitError, handler.unpack_package, zip_path)
+        self.assertTrue(os.listdir(unpack_root) == [])
+
+    def test_unpack_skips_outside_paths(self):
+        tar_path = os.path.join(self.temp_dir.name, 'package.tar')
+        with tarfile.open(tar_path, 'w') as tar_ip:
+            for name in ['package/METS.xml', '../escaped.xml']:
+                info = tarfile.TarInfo(name)
+                info.size = 7
+                tar_ip.addfile(info, io.BytesIO(b'<mets/>'))
+        dest = os.path.join(self.temp_dir.name, 'dest')
+        unpacked = IP.ArchivePackageHandler().unpack_package(tar_path, dest=dest)
+        self.assertTrue(os.listdir(unpacked) == ['package'])
+        self.assertFalse(os.path.exists(os.path.join(dest, 'escaped.xml')))
+
+    def test_unpack_skips_absolute_paths(self):
+        outside = os.path.join(self.temp_dir.name, 'outside')
+        tar_path = os.path.join(self.temp_dir.name, 'package.tar')
+        with tarfile.open(tar_path, 'w') as tar_ip:
+            for name in ['package/METS.xml', outside + '/OUTSIDE.txt', 'C:/OUTSIDE.txt',
+                         '\\\\server\\OUTSIDE.txt']:
+                info = tarfile.TarInfo(name)
+                info.size = 7
+                tar_ip.addfile(info, io.BytesIO(b'<mets/>'))
+        listing = IP.ArchiveListing(tar_path)
+        self.assertTrue(listing.listdir('') == ['package'])
+        self.assertTrue(listing.member_names == {'package/METS.xml'})
+        dest = os.path.join(self.temp_dir.name, 'dest')
+        unpacked = IP.ArchivePackageHandler().unpack_package(tar_path, dest=dest)
+        self.assertTrue(os.listdir(unpacked) == ['package'])
+        self.assertFalse(os.path.exists(outside))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# coding=UTF-8
+#
+# E-ARK Validation
+# Copyright (C) 2019
+# All rights reserved.
+#
+# Licensed to the E-ARK project under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The E-ARK project licenses
+# this file to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""Unit tests for the ip-check command line application."""
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+from lxml import etree
+
+from ip_validation.cli import app as APP
+
+IPS_ROOT = os.path.join(os.path.dirname(__file__), 'resources', 'ips')
+FILES = [os.path.join(IPS_ROOT, 'minimal', 'minimal_IP_with_schemas.zip'),
+         os.path.join(IPS_ROOT, 'struct', 'no_mets.tar.gz'),
+         os.path.join(IPS_ROOT, 'missing.zip')]
+
+class CheckFilesTest(unittest.TestCase):
+    """Tests for serial and parallel validation of multiple packages."""
+    def test_serial(self):
+        results = list(APP.check_files(FILES))
+        self.assertTrue([status for status, _ in results] == [0, 0, 1])
+        self.assertTrue('WellFormed' in results[0][1])
+        self.assertTrue('CSIPSTR4' in results[1][1])
+        self.assertTrue('does not exist' in results[2][1])
+
+    def test_parallel_input_order(self):
+        self.assertTrue(list(APP.check_files(FILES, jobs=2)) == list(APP.check_files(FILES)))
+
+    def test_parallel_completion_order(self):
+        results = list(APP.check_files(FILES, jobs=2, completion_order=True))
+        self.assertTrue(sorted(results) == sorted(APP.check_files(FILES)))
+
+class ReportFormatTest(unittest.TestCase):
+    """Tests for the machine readable report formats."""
+    def test_jsonl(self):
+        results = list(APP.check_files(FILES, report_format=APP.JSONL))
+        records = [json.loads(output) for _, output in results]
+        self.assertTrue(all(output.count('\n') == 1 for _, output in results))
+        self.assertTrue(records[0]['package']['structure_status'] == 'WellFormed')
+        self.assertTrue(records[0]['package']['name'] == 'minimal_IP_with_schemas')
+        self.assertTrue(records[1]['package']['errors'][0]['rule_id'] == 'CSIPSTR4')
+        self.assertTrue(records[2]['exit_status'] == 1)
+        self.assertTrue(records[2]['package'] is None)
+
+    def test_xml(self):
+        results = list(APP.check_files(FILES, report_format=APP.XML))
+        packages = [etree.fromstring(output) for _, output in results]
+        self.assertTrue(packages[0].get('structureStatus') == 'WellFormed')
+        self.assertTrue(packages[1].find('error').get('ruleId') == 'CSIPSTR4')
+        self.assertTrue(packages[2].get('exitStatus') == '1')
+        self.assertTrue('does not exist' in packages[2].findtext('message'))
+
+class StartupTest(unittest.TestCase):
+    """Tests that ip-check doesn't load resources it may not use."""
+    def test_lazy_imports(self):
+        script = ('import sys; import ip_validation.cli.app as APP; '
+                  'print(sorted(name for name in ("flask", "flask_debugtoolbar", "jinja2") '
+                  'if name in sys.modules), APP.TC.get_tc_schema.cache_info().currsize)')
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.run([sys.executable, '-c', script], check=True, cwd=root,
+                                stdout=subprocess.PIPE, universal_newlines=True).stdout
+        self.assertTrue(output.strip() == '[] 0')
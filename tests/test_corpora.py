@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# coding=UTF-8
+#
+# E-ARK Validation
+# Copyright (C) 2019
+# All rights reserved.
+#
+# Licensed to the E-ARK project under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The E-ARK project licenses
+# this file to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""Unit tests for test corpus loading."""
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from unittest import mock
+
+from importlib_resources import files
+
+from ip_validation.cli import corpora as CORPORA
+from ip_validation.cli import testcases as TC
+
+import tests.resources.test_cases as CASES
+
+STRUCT_IPS = os.path.join(os.path.dirname(__file__), 'resources', 'ips', 'struct')
+RUN_CASE = """<testCase testable="TRUE">
+  <id specification="CSIP" version="2.0" requirementId="CSIPSTR5"/>
+  <rules>
+    <rule id="1">
+      <error level="ERROR"><message>Invalid</message></error>
+      <corpusPackages>{}</corpusPackages>
+    </rule>
+    <rule id="2">
+      <error level="WARNING"><message>No metadata</message></error>
+      <corpusPackages>{}</corpusPackages>
+    </rule>
+  </rules>
+</testCase>"""
+RUN_PACKAGE = """<package name="{0}" isValid="{1}" isImplemented="{2}">
+  <path>{3}</path></package>"""
+
+class CorpusTest(unittest.TestCase):
+    """Tests for the Corpus test case model."""
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        for case_dir in ('case1', 'case2'):
+            os.makedirs(os.path.join(self.temp_dir.name, case_dir))
+            shutil.copy(str(files(CASES).joinpath('sip33.xml')),
+                        os.path.join(self.temp_dir.name, case_dir, TC.DEFAULT_NAME))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_parsed_once(self):
+        corpus = CORPORA.Corpus.from_root(self.temp_dir.name, 'CSIP')
+        with mock.patch.object(TC.TestCase, 'from_xml_file',
+                               wraps=TC.TestCase.from_xml_file) as from_xml:
+            self.assertTrue(corpus.case_count == 2)
+            self.assertTrue(from_xml.call_count == 0)
+            case = TC.TestCase.from_xml_file(os.path.join(self.temp_dir.name, 'case1',
+                                                          TC.DEFAULT_NAME))
+            for _ in range(2):
+                self.assertTrue(len(corpus.test_cases) == 2)
+                self.assertTrue(corpus.rule_count == 2 * len(case.rules))
+                self.assertTrue(corpus.package_count == 2 * case.package_count)
+                self.assertTrue(corpus.missing_package_count == 2 * case.missing_package_count)
+            # One call above, then one per case
+            self.assertTrue(from_xml.call_count == 3)
+
+    def test_index(self):
+        corpus = CORPORA.Corpus.from_root(self.temp_dir.name, 'CSIP')
+        self.assertTrue(corpus.get_test_case('SIP33').case_id.requirement_id == 'SIP33')
+        self.assertTrue(corpus.get_test_case('SIP1') is None)
+
+class DiscoveryTest(unittest.TestCase):
+    """Tests for test case discovery and manifests."""
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.temp_dir.name, 'corpus')
+        # The last case is in a package payload so shouldn't be found
+        for case_dir in ('a', os.path.join('b', 'c'), 'd',
+                         os.path.join('d', 'pkg', 'representations', 'rep1', 'data')):
+            self._add_case(case_dir)
+        self.manifest = os.path.join(self.temp_dir.name, 'manifest', 'cases.json')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _add_case(self, case_dir):
+        os.makedirs(os.path.join(self.root, case_dir))
+        shutil.copy(str(files(CASES).joinpath('sip33.xml')),
+                    os.path.join(self.root, case_dir, TC.DEFAULT_NAME))
+
+    def _cases(self, corpus):
+        return [os.path.relpath(case, self.root) for case in corpus.case_dirs]
+
+    def test_discovery(self):
+        progress = []
+        cwd = os.getcwd()
+        # Discovery used to depend on the working directory
+        os.chdir(self.root)
+        try:
+            corpus = CORPORA.Corpus.from_root(self.root, 'CSIP',
+                                              progress=lambda *args: progress.append(args))
+        finally:
+            os.chdir(cwd)
+        self.assertTrue(self._cases(corpus) == ['a', os.path.join('b', 'c'), 'd'])
+        # Payload data folder isn't scanned
+        self.assertTrue(progress[-1] == (8, 3))
+
+    def test_manifest(self):
+        corpus = CORPORA.Corpus.from_root(self.root, 'CSIP', manifest=self.manifest)
+        self.assertTrue(corpus.case_count == 3)
+        self._add_case('e')
+        shutil.rmtree(os.path.join(self.root, 'a'))
+        with mock.patch.object(CORPORA, '_get_test_cases') as discover:
+            corpus = CORPORA.Corpus.from_root(self.root, 'CSIP', manifest=self.manifest)
+            self.assertFalse(discover.called)
+        # Manifest cases that have gone are dropped, new ones need a rescan
+        self.assertTrue(self._cases(corpus) == [os.path.join('b', 'c'), 'd'])
+        corpus = CORPORA.Corpus.from_root(self.root, 'CSIP', manifest=self.manifest,
+                                          rescan=True)
+        self.assertTrue(self._cases(corpus) == [os.path.join('b', 'c'), 'd', 'e'])
+
+    def test_manifest_other_root(self):
+        CORPORA.Corpus.from_root(self.root, 'CSIP', manifest=self.manifest)
+        other = os.path.join(self.temp_dir.name, 'other')
+        os.makedirs(os.path.join(other, 'x'))
+        shutil.copy(str(files(CASES).joinpath('sip33.xml')),
+                    os.path.join(other, 'x', TC.DEFAULT_NAME))
+        self.assertTrue(CORPORA.Corpus.from_root(other, 'CSIP',
+                                                 manifest=self.manifest).case_count == 1)
+        self.assertTrue(CORPORA.Corpus.from_root(self.root, 'CSIP',
+                                                 manifest=self.manifest).case_count == 3)
+
+    def test_bad_manifest(self):
+        os.makedirs(os.path.dirname(self.manifest))
+        with open(self.manifest, 'w') as manifest_file:
+            manifest_file.write('not json')
+        corpus = CORPORA.Corpus.from_root(self.root, 'CSIP', manifest=self.manifest)
+        self.assertTrue(corpus.case_count == 3)
+
+class RenderTest(unittest.TestCase):
+    """Tests for corpus HTML rendering."""
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.temp_dir.name, 'corpus')
+        self.results = os.path.join(self.temp_dir.name, 'results')
+        with open(str(files(CASES).joinpath('sip33.xml'))) as case_file:
+            case_xml = case_file.read()
+        for index in range(3):
+            os.makedirs(os.path.join(self.root, str(index)))
+            with open(os.path.join(self.root, str(index), TC.DEFAULT_NAME), 'w') as out_file:
+                out_file.write(case_xml.replace('SIP33', 'SIP3{}'.format(index)))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _render(self, jobs=1):
+        return CORPORA.render_corpus(self.results, CORPORA.Corpus.from_root(self.root, 'CSIP'),
+                                     jobs=jobs)
+
+    def test_render(self):
+        for jobs in (1, 2):
+            shutil.rmtree(self.results, ignore_errors=True)
+            self.assertTrue(self._render(jobs) == (3, 0))
+            pages = sorted(os.listdir(self.results))
+            self.assertTrue(pages == [CORPORA.HASHES_NAME, 'SIP30', 'SIP31', 'SIP32',
+                                      'index.html'])
+            with open(os.path.join(self.results, 'SIP31', 'index.html')) as page:
+                self.assertTrue('Case SIP31' in page.read())
+
+    def test_page_permissions(self):
+        self._render()
+        umask = os.umask(0)
+        os.umask(umask)
+        for name in ('index.html', CORPORA.HASHES_NAME):
+            mode = stat.S_IMODE(os.stat(os.path.join(self.results, name)).st_mode)
+            self.assertTrue(mode == 0o666 & ~umask)
+        # Failed writes, not just OS errors, leave no temp files behind
+        self.assertRaises(UnicodeEncodeError, CORPORA._write_atomic,
+                          os.path.join(self.results, 'bad.html'), '\ud800')
+        self.assertTrue(sorted(os.listdir(self.results)) == [CORPORA.HASHES_NAME, 'SIP30',
+                                                             'SIP31', 'SIP32', 'index.html'])
+
+    def test_unchanged_skipped(self):
+        self._render()
+        with mock.patch.object(CORPORA, 'corpus_html') as corpus_html:
+            self.assertTrue(self._render() == (0, 3))
+            self.assertFalse(corpus_html.called)
+        # An edited case and a deleted page are rendered again
+        with open(os.path.join(self.root, '1', TC.DEFAULT_NAME), 'a') as out_file:
+            out_file.write('\n')
+        os.remove(os.path.join(self.results, 'SIP32', 'index.html'))
+        with mock.patch.object(CORPORA, 'corpus_html') as corpus_html:
+            self.assertTrue(self._render() == (2, 1))
+            self.assertTrue(corpus_html.called)
+        self.assertTrue(os.path.isfile(os.path.join(self.results, 'SIP32', 'index.html')))
+
+class RunTest(unittest.TestCase):
+    """Tests for validating corpus packages."""
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.temp_dir.name, 'case'))
+        no_mets = os.path.join(STRUCT_IPS, 'no_mets.tar.gz')
+        no_md = os.path.join(STRUCT_IPS, 'no_md.tar.gz')
+        error_packages = [('no_mets_invalid', 'FALSE', 'TRUE', no_mets),
+                          ('no_mets_valid', 'TRUE', 'TRUE', no_mets),
+                          ('not_implemented', 'FALSE', 'FALSE', no_mets),
+                          ('missing', 'FALSE', 'TRUE', 'missing.zip')]
+        warning_packages = [('no_md_warns', 'FALSE', 'TRUE', no_md),
+                            ('no_mets_no_warning', 'FALSE', 'TRUE', no_mets)]
+        with open(os.path.join(self.temp_dir.name, 'case', TC.DEFAULT_NAME), 'w') as out_file:
+            out_file.write(RUN_CASE.format(
+                ''.join(RUN_PACKAGE.format(*package) for package in error_packages),
+                ''.join(RUN_PACKAGE.format(*package) for package in warning_packages)))
+        self.corpus = CORPORA.Corpus.from_root(self.temp_dir.name, 'CSIP')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _outcomes(self):
+        return {package.name: package.outcome for rule in self.corpus.test_cases[0].rules
+                for package in rule.packages}
+
+    def test_run(self):
+        with mock.patch.object(CORPORA, '_validate_package',
+                               wraps=CORPORA._validate_package) as validate:
+            counts = CORPORA.run_corpus(self.corpus)
+            # Each package file is validated once
+            self.assertTrue(validate.call_count == 2)
+        self.assertTrue(counts == {'Pass': 2, 'Fail': 2, 'Error': 0})
+        self.assertTrue(self._outcomes() == {
+            'no_mets_invalid': TC.Outcome.Pass, 'no_mets_valid': TC.Outcome.Fail,
+            'not_implemented': None, 'missing': None,
+            'no_md_warns': TC.Outcome.Pass, 'no_mets_no_warning': TC.Outcome.Fail})
+        case = self.corpus.test_cases[0]
+        self.assertTrue(case.rules[0].packages[0].validation_report['package']['name'] ==
+                        'no_mets')
+        self.assertTrue(self.corpus.outcome_count(TC.Outcome.Fail) == 2)
+        results = os.path.join(self.temp_dir.name, 'results')
+        CORPORA.render_corpus(results, self.corpus)
+        with open(os.path.join(results, 'CSIPSTR5', 'no_mets_valid', 'index.html')) as page:
+            self.assertTrue('Validation: Fail' in page.read())
+
+    def test_parallel_run(self):
+        self.assertTrue(CORPORA.run_corpus(self.corpus, jobs=2) ==
+                        {'Pass': 2, 'Fail': 2, 'Error': 0})
+
+    def test_error(self):
+        with mock.patch.object(CORPORA, '_package_validator') as validator:
+            validator.return_value.validate.side_effect = OSError('unreadable')
+            counts = CORPORA.run_corpus(self.corpus)
+        self.assertTrue(counts == {'Pass': 0, 'Fail': 0, 'Error': 4})
+        self.assertTrue(self._outcomes()['no_md_warns'] == TC.Outcome.Error)
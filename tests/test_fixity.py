@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# coding=UTF-8
+#
+# E-ARK Validation
+# Copyright (C) 2019
+# All rights reserved.
+#
+# Licensed to the E-ARK project under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The E-ARK project licenses
+# this file to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""Unit tests for package fixity checking."""
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from ip_validation.infopacks import information_package as IP
+from ip_validation.infopacks.fixity import check_fixity, FixityCache
+import ip_validation.utils as UTILS
+
+METS_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<mets xmlns="http://www.loc.gov/METS/" xmlns:xlink="http://www.w3.org/1999/xlink">
+  {1}<fileSec><fileGrp USE="Data">{0}</fileGrp></fileSec>
+</mets>"""
+FILE_TEMPLATE = """<file ID="{0}" SIZE="{1}" CHECKSUM="{2}" CHECKSUMTYPE="{3}">
+  <FLocat LOCTYPE="URL" xlink:type="simple" xlink:href="{0}"/></file>"""
+DMD_TEMPLATE = """<dmdSec ID="dmd-{0}"><mdRef LOCTYPE="URL" MDTYPE="OTHER" xlink:type="simple"
+  xlink:href="{0}" SIZE="{1}" CHECKSUM="{2}" CHECKSUMTYPE="{3}"/></dmdSec>"""
+# Over a MB of incompressible data, so it takes several buffer reads to hash
+CONTENTS = {'data/a.txt': b'alpha' * 1000,
+            'data/b.bin': b''.join(hashlib.sha256(bytes([i % 256, i // 256])).digest()
+                                   for i in range(40000)),
+            'metadata/c.xml': b'<c/>'}
+
+class FixityTest(unittest.TestCase):
+    """Tests for manifest statuses derived from METS file sizes and checksums."""
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.temp_dir.name, 'package')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _package(self, entries=None, contents=None, md_entries=()):
+        contents = CONTENTS if contents is None else contents
+        if entries is None:
+            entries = [(name, len(data), hashlib.sha256(data).hexdigest(), 'SHA-256')
+                       for name, data in CONTENTS.items()]
+        for name, data in contents.items():
+            os.makedirs(os.path.join(self.root, os.path.dirname(name)), exist_ok=True)
+            with open(os.path.join(self.root, name), 'wb') as out_file:
+                out_file.write(data)
+        with open(os.path.join(self.root, IP.METS_NAME), 'w') as mets_file:
+            mets_file.write(METS_TEMPLATE.format(''.join(FILE_TEMPLATE.format(*entry)
+                                                         for entry in entries),
+                                                 ''.join(DMD_TEMPLATE.format(*entry)
+                                                         for entry in md_entries)))
+        return self.root
+
+    def _check(self, package_path, workers=4):
+        details = IP.validate_package_structure(package_path)
+        issues = check_fixity(details, workers)
+        return details.manifest_status, issues
+
+    def test_consistent(self):
+        package = self._package()
+        for workers in (1, 4):
+            self.assertTrue(self._check(os.path.dirname(package), workers) ==
+                            (IP.ManifestStatus.Consistent, []))
+
+    def test_archives_consistent(self):
+        package = self._package()
+        for archive_format in ('zip', 'gztar'):
+            archive = shutil.make_archive(os.path.join(self.temp_dir.name, 'archive'),
+                                          archive_format, os.path.dirname(package), 'package')
+            self.assertTrue(self._check(archive) == (IP.ManifestStatus.Consistent, []))
+
+    def test_inconsistent(self):
+        entries = [(name, len(data), hashlib.md5(data).hexdigest(), 'MD5')
+                   for name, data in CONTENTS.items()]
+        entries[0] = (entries[0][0], entries[0][1], hashlib.md5(b'other').hexdigest(), 'MD5')
+        entries[1] = (entries[1][0], 1, entries[1][2], 'MD5')
+        status, issues = self._check(os.path.dirname(self._package(entries)))
+        self.assertTrue(status == IP.ManifestStatus.Inconsistent)
+        self.assertTrue(len(issues) == 2)
+        self.assertTrue('checksum' in issues[0] and 'SIZE' in issues[1])
+
+    def test_several_algorithms(self):
+        entries = []
+        for name, data in CONTENTS.items():
+            entries.append((name, len(data), hashlib.md5(data).hexdigest(), 'MD5'))
+            entries.append((name, len(data), hashlib.sha512(data).hexdigest(), 'SHA-512'))
+        entries[-1] = (entries[-1][0], entries[-1][1], 'bad', 'SHA-512')
+        status, issues = self._check(os.path.dirname(self._package(entries)))
+        self.assertTrue(status == IP.ManifestStatus.Inconsistent)
+        self.assertTrue(len(issues) == 1 and 'SHA-512 checksum' in issues[0])
+
+    def test_unsupported_checksum(self):
+        entries = [(name, len(data), 'abc', 'WHIRLPOOL') for name, data in CONTENTS.items()]
+        status, issues = self._check(os.path.dirname(self._package(entries)))
+        self.assertTrue(status == IP.ManifestStatus.Inconsistent)
+        self.assertTrue(all('WHIRLPOOL' in issue for issue in issues))
+
+    def test_missing_file(self):
+        contents = dict(CONTENTS)
+        del contents['data/a.txt']
+        status, issues = self._check(os.path.dirname(self._package(contents=contents)))
+        self.assertTrue(status == IP.ManifestStatus.Incomplete)
+        self.assertTrue(issues == ['package/data/a.txt is referenced but not present.'])
+
+    def test_unreferenced_file(self):
+        contents = dict(CONTENTS)
+        contents['data/extra.txt'] = b'extra'
+        status, issues = self._check(os.path.dirname(self._package(contents=contents)))
+        self.assertTrue(status == IP.ManifestStatus.Incomplete)
+        self.assertTrue(issues == ['package/data/extra.txt is not referenced by any METS file.'])
+
+    def test_metadata_references(self):
+        # Metadata files referenced by mdRef in a dmdSec are checked like FLocat files
+        entries = [(name, len(data), hashlib.sha256(data).hexdigest(), 'SHA-256')
+                   for name, data in CONTENTS.items()]
+        md_entries = [entries.pop()]
+        package = self._package(entries, md_entries=md_entries)
+        self.assertTrue(self._check(os.path.dirname(package)) ==
+                        (IP.ManifestStatus.Consistent, []))
+        md_entries = [md_entries[0][:2] + (hashlib.sha256(b'other').hexdigest(), 'SHA-256')]
+        package = self._package(entries, md_entries=md_entries)
+        status, issues = self._check(os.path.dirname(package))
+        self.assertTrue(status == IP.ManifestStatus.Inconsistent)
+        self.assertTrue(len(issues) == 1 and 'metadata/c.xml' in issues[0])
+
+class FixityCacheTest(unittest.TestCase):
+    """Tests for reuse and invalidation of cached digests."""
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache = FixityCache(os.path.join(self.temp_dir.name, 'cache', 'fixity.db'))
+        self.path = os.path.join(self.temp_dir.name, 'file.bin')
+        self._write(b'content', 1000)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _write(self, data, mtime):
+        with open(self.path, 'wb') as out_file:
+            out_file.write(data)
+        os.utime(self.path, (mtime, mtime))
+
+    def test_unchanged_file(self):
+        self.assertTrue(UTILS.sha1(self.path, cache=self.cache) == UTILS.sha1(self.path))
+        digest = self.cache.digest(self.path, 'sha1', lambda: self.fail('Should be cached'))
+        self.assertTrue(digest == UTILS.sha1(self.path))
+        self.assertTrue(self.cache.stats() == {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_changed_file(self):
+        UTILS.sha1(self.path, cache=self.cache)
+        self._write(b'changed', 2000)
+        self.assertTrue(UTILS.sha1(self.path, cache=self.cache) == UTILS.sha1(self.path))
+        self.assertTrue(self.cache.misses == 2)
+
+    def test_algorithms_cached_separately(self):
+        UTILS.sha1(self.path, cache=self.cache)
+        digest = self.cache.digest(self.path, 'md5', lambda: 'md5 digest')
+        self.assertTrue(digest == 'md5 digest')
+        self.assertTrue(self.cache.misses == 2)
+
+    def test_recent_file_not_cached(self):
+        os.utime(self.path)
+        UTILS.sha1(self.path, cache=self.cache)
+        UTILS.sha1(self.path, cache=self.cache)
+        self.assertTrue(self.cache.hits == 0)
+
+    def test_check_fixity_cached(self):
+        root = os.path.join(self.temp_dir.name, 'ip')
+        os.makedirs(os.path.join(root, 'package', 'data'))
+        with open(os.path.join(root, 'package', 'data', 'a.txt'), 'wb') as out_file:
+            out_file.write(b'alpha')
+        with open(os.path.join(root, 'package', IP.METS_NAME), 'w') as mets_file:
+            mets_file.write(METS_TEMPLATE.format(FILE_TEMPLATE.format(
+                'data/a.txt', 5, hashlib.md5(b'alpha').hexdigest(), 'MD5'), ''))
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                os.utime(os.path.join(dirpath, filename), (1000, 1000))
+        for _ in range(2):
+            details = IP.validate_package_structure(root)
+            self.assertTrue(check_fixity(details, cache=self.cache) == [])
+            self.assertTrue(details.manifest_status == IP.ManifestStatus.Consistent)
+        self.assertTrue(self.cache.stats()['hits'] == 1)
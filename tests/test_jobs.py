@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# coding=UTF-8
+#
+# E-ARK Validation
+# Copyright (C) 2019
+# All rights reserved.
+#
+# Licensed to the E-ARK project under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The E-ARK project licenses
+# this file to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""Unit tests for asynchronous validation jobs."""
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from ip_validation.jobs import JobQueue, JobState
+
+DIGEST = '54bbe654fe332b51569baf21338bc811cad2af66'
+
+def _exited_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+class JobQueueTest(unittest.TestCase):
+    """Tests for queuing, running and reporting validation jobs."""
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, 'jobs.db')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_job_finished(self):
+        queue = JobQueue(self.db_path)
+        def validate(progress):
+            progress(0.5)
+            return {'schema_valid': True}
+        job_id = queue.submit(DIGEST, validate)
+        queue.shutdown()
+        job = queue.get(job_id)
+        self.assertTrue(job['state'] == JobState.Finished.name)
+        self.assertTrue(job['digest'] == DIGEST)
+        self.assertTrue(job['progress'] == 1.0)
+        self.assertTrue(job['report'] == {'schema_valid': True})
+
+    def test_job_failed(self):
+        queue = JobQueue(self.db_path)
+        def validate(_):
+            raise ValueError('broken package')
+        job_id = queue.submit(DIGEST, validate)
+        queue.shutdown()
+        job = queue.get(job_id)
+        self.assertTrue(job['state'] == JobState.Failed.name)
+        self.assertTrue(job['error'] == 'broken package')
+        self.assertTrue(job['report'] is None)
+
+    def test_job_progress(self):
+        queue = JobQueue(self.db_path)
+        reported = threading.Event()
+        release = threading.Event()
+        def validate(progress):
+            progress(0.25)
+            reported.set()
+            release.wait(5)
+            return {}
+        job_id = queue.submit(DIGEST, validate)
+        reported.wait(5)
+        job = queue.get(job_id)
+        self.assertTrue(job['state'] == JobState.Running.name)
+        self.assertTrue(job['progress'] == 0.25)
+        release.set()
+        queue.shutdown()
+
+    def test_interrupted_jobs(self):
+        queue = JobQueue(self.db_path)
+        job_id = queue.submit(DIGEST, lambda _: {})
+        queue.shutdown()
+        # Leave the job running under the id of a process that has exited
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("UPDATE jobs SET state = ?, owner = ? WHERE id = ?",
+                         (JobState.Running.name, '{}:{}'.format(socket.gethostname(),
+                                                                _exited_pid()), job_id))
+        conn.close()
+        # A new queue on the same database, as after a restart
+        restarted = JobQueue(self.db_path)
+        self.assertTrue(restarted.get(job_id)['state'] == JobState.Failed.name)
+        restarted.shutdown()
+
+    def test_live_jobs_kept(self):
+        queue = JobQueue(self.db_path)
+        running = threading.Event()
+        release = threading.Event()
+        def validate(_):
+            running.set()
+            release.wait(5)
+            return {}
+        job_id = queue.submit(DIGEST, validate)
+        running.wait(5)
+        # Another queue sharing the database mustn't fail a live process's jobs
+        other = JobQueue(self.db_path)
+        self.assertTrue(other.get(job_id)['state'] == JobState.Running.name)
+        release.set()
+        queue.shutdown()
+        other.shutdown()
+        self.assertTrue(other.get(job_id)['state'] == JobState.Finished.name)
+
+    def test_unknown_job(self):
+        queue = JobQueue(self.db_path)
+        self.assertTrue(queue.get('unknown') is None)
+        queue.shutdown()
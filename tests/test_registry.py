@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# coding=UTF-8
+#
+# E-ARK Validation
+# Copyright (C) 2019
+# All rights reserved.
+#
+# Licensed to the E-ARK project under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The E-ARK project licenses
+# this file to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""Unit tests for the compiled validator registry."""
+import os
+import stat
+import tempfile
+import unittest
+from unittest import mock
+
+from importlib_resources import files
+
+from ip_validation.const import ENV_CACHE_DIR
+from ip_validation.infopacks import rules as SC
+from ip_validation.infopacks.registry import CompiledRules, ValidatorRegistry, XsltCache
+
+import ip_validation.infopacks.resources.schemas as SCHEMA
+import tests.resources.schematron as SCHEMATRON
+import tests.resources.xml as XML
+
+INCLUDING_RULES = """<schema xmlns="http://purl.oclc.org/dsdl/schematron">
+  <include href="pattern.sch"/>
+</schema>"""
+INCLUDED_PATTERN = """<pattern xmlns="http://purl.oclc.org/dsdl/schematron">
+  <rule context="person"><assert test="{}">Missing</assert></rule>
+</pattern>"""
+
+class ValidatorRegistryTest(unittest.TestCase):
+    """Tests for sharing compiled validators across instances."""
+    def test_schematron_shared(self):
+        registry = ValidatorRegistry()
+        rules_path = str(files(SCHEMATRON).joinpath('person.xml'))
+        first = SC.ValidationRules('test', rules_path, registry=registry)
+        second = SC.ValidationRules('test', rules_path, registry=registry)
+        self.assertTrue(first.ruleset is second.ruleset)
+        self.assertTrue(registry.misses == 1)
+        self.assertTrue(registry.hits == 1)
+
+    def test_reports_not_shared(self):
+        registry = ValidatorRegistry()
+        rules_path = str(files(SCHEMATRON).joinpath('person.xml'))
+        valid = SC.ValidationRules('test', rules_path, registry=registry)
+        invalid = SC.ValidationRules('test', rules_path, registry=registry)
+        valid.validate(str(files(XML).joinpath('person.xml')))
+        invalid.validate(str(files(XML).joinpath('invalid-person.xml')))
+        self.assertTrue(valid.get_report().is_valid)
+        self.assertFalse(invalid.get_report().is_valid)
+
+    def test_schema_shared(self):
+        registry = ValidatorRegistry()
+        schema_path = str(files(SCHEMA).joinpath('DILCISExtensionMETS.xsd'))
+        self.assertTrue(registry.get_schema(schema_path) is registry.get_schema(schema_path))
+        stats = registry.stats()
+        self.assertTrue(stats['schemas'] == 1)
+        self.assertTrue(stats['hits'] == 1)
+        registry.clear()
+        self.assertTrue(registry.stats()['schemas'] == 0)
+
+class XsltCacheTest(unittest.TestCase):
+    """Tests for the on disk cache of compiled Schematron."""
+    def test_cache_reload(self):
+        rules_path = str(files(SCHEMATRON).joinpath('person.xml'))
+        with tempfile.TemporaryDirectory() as cache_root:
+            cold = XsltCache(cache_root)
+            SC.ValidationRules('test', rules_path, registry=ValidatorRegistry(cache=cold))
+            self.assertTrue(cold.misses == 1)
+            self.assertTrue(len(os.listdir(cold.cache_dir)) == 2)
+            warm = XsltCache(cache_root)
+            rules = SC.ValidationRules('test', rules_path, registry=ValidatorRegistry(cache=warm))
+            self.assertTrue(warm.hits == 1)
+            self.assertTrue(len(list(rules.get_assertions())) > 0)
+            rules.validate(str(files(XML).joinpath('invalid-person.xml')))
+            self.assertFalse(rules.get_report().is_valid)
+
+    def test_cache_keyed_by_content(self):
+        with tempfile.TemporaryDirectory() as cache_root:
+            cache = XsltCache(cache_root)
+            self.assertTrue(cache.load(b'<schema/>') is None)
+            self.assertTrue(cache.misses == 1)
+
+    def test_cache_not_private(self):
+        rules_path = str(files(SCHEMATRON).joinpath('person.xml'))
+        with tempfile.TemporaryDirectory() as cache_root:
+            cache = XsltCache(cache_root)
+            SC.ValidationRules('test', rules_path, registry=ValidatorRegistry(cache=cache))
+            self.assertTrue(stat.S_IMODE(os.stat(cache.cache_dir).st_mode) & 0o077 == 0)
+            # Entries in a directory others can write to aren't loaded
+            os.chmod(cache.cache_dir, 0o777)
+            shared = XsltCache(cache_root)
+            SC.ValidationRules('test', rules_path, registry=ValidatorRegistry(cache=shared))
+            self.assertTrue(shared.hits == 0 and shared.misses == 1)
+
+    def test_cache_keyed_by_includes(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            rules_path = os.path.join(temp_dir, 'rules.sch')
+            with open(rules_path, 'w') as rules_file:
+                rules_file.write(INCLUDING_RULES)
+            keys = []
+            for test in ('name', 'age'):
+                with open(os.path.join(temp_dir, 'pattern.sch'), 'w') as pattern_file:
+                    pattern_file.write(INCLUDED_PATTERN.format(test))
+                cache = XsltCache(os.path.join(temp_dir, 'cache'))
+                CompiledRules.from_file(rules_path, cache)
+                keys.append(sorted(os.listdir(cache.cache_dir)))
+            self.assertTrue(len(keys[1]) == 4 and keys[0] != keys[1])
+
+    def test_from_env(self):
+        with tempfile.TemporaryDirectory() as cache_home, \
+             mock.patch.dict(os.environ, {'XDG_CACHE_HOME': cache_home}):
+            os.environ.pop(ENV_CACHE_DIR, None)
+            cache = XsltCache.from_env()
+            self.assertTrue(cache.cache_dir.startswith(os.path.join(cache_home, 'eark-ipv')))
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# coding=UTF-8
+#
+# E-ARK Validation
+# Copyright (C) 2019
+# All rights reserved.
+#
+# Licensed to the E-ARK project under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The E-ARK project licenses
+# this file to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""Unit tests for the validation result store."""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from ip_validation.results import ResultCache
+
+DIGEST = '54bbe654fe332b51569baf21338bc811cad2af66'
+DIGESTS = {name: name * 40 for name in 'abc'}
+
+class ResultCacheTest(unittest.TestCase):
+    """Tests for storing, evicting and invalidating validation results."""
+    def test_put_get(self):
+        with tempfile.TemporaryDirectory() as root:
+            cache = ResultCache(root, '1.0')
+            self.assertTrue(cache.get(DIGEST) is None)
+            cache.put(DIGEST, {'schema_valid': True})
+            self.assertTrue(cache.get(DIGEST) == {'schema_valid': True})
+            # A new validator version doesn't see old results
+            self.assertTrue(ResultCache(root, '1.1').get(DIGEST) is None)
+
+    def test_invalidate(self):
+        with tempfile.TemporaryDirectory() as root:
+            ResultCache(root, '1.0').put(DIGEST, {})
+            cache = ResultCache(root, '1.1')
+            cache.put(DIGEST, {})
+            self.assertTrue(cache.invalidate(DIGEST) == 2)
+            self.assertTrue(cache.get(DIGEST) is None)
+            self.assertTrue(cache.invalidate(DIGEST) == 0)
+
+    def test_evict_lru(self):
+        with tempfile.TemporaryDirectory() as root:
+            cache = ResultCache(root, '1.0', max_entries=2)
+            cache.put(DIGESTS['a'], {})
+            cache.put(DIGESTS['b'], {})
+            # Age both results then make 'a' the most recently used
+            for name in os.listdir(root):
+                os.utime(os.path.join(root, name), (100, 100))
+            cache.get(DIGESTS['a'])
+            cache.put(DIGESTS['c'], {})
+            self.assertTrue(len(os.listdir(root)) == 2)
+            self.assertTrue(cache.get(DIGESTS['a']) == {})
+            self.assertTrue(cache.get(DIGESTS['b']) is None)
+
+    def test_evict_bytes(self):
+        with tempfile.TemporaryDirectory() as root:
+            cache = ResultCache(root, '1.0', max_bytes=10)
+            cache.put(DIGEST, {'message': 'more than ten bytes of JSON'})
+            self.assertTrue(cache.get(DIGEST) is None)
+
+    def test_invalid_digest(self):
+        with tempfile.TemporaryDirectory() as root:
+            cache = ResultCache(os.path.join(root, 'results'), '1.0')
+            for digest in ('../' + DIGEST, '/etc/hosts', DIGEST.upper(), DIGEST + '0'):
+                self.assertRaises(ValueError, cache.put, digest, {})
+                self.assertRaises(ValueError, cache.get, digest)
+            self.assertTrue(os.listdir(root) == [])
+
+    def test_evict_vanished(self):
+        with tempfile.TemporaryDirectory() as root:
+            cache = ResultCache(root, '1.0', max_entries=1)
+            cache.put(DIGESTS['a'], {})
+            entries = cache._entries
+            def vanishing():
+                # Another worker removes a result after it's been listed
+                found = entries()
+                for entry in found:
+                    os.remove(entry.path)
+                return found
+            with mock.patch.object(cache, '_entries', side_effect=vanishing):
+                cache.put(DIGESTS['b'], {})
+            self.assertTrue(os.listdir(root) == [])
+
+    def test_failed_put(self):
+        with tempfile.TemporaryDirectory() as root:
+            cache = ResultCache(root, '1.0')
+            self.assertRaises(TypeError, cache.put, DIGEST, {'unserialisable': object()})
+            self.assertTrue(os.listdir(root) == [])
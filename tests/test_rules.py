@@ -22,6 +22,7 @@
 # specific language governing permissions and limitations
 # under the License.
 #
+import io
 import unittest
 
 from importlib_resources import files
@@ -151,6 +152,62 @@ class ValidationRulesTest(unittest.TestCase):
         self.assertTrue(warnings == 1)
         self.assertTrue(result)
 
+class ValidationProfileTest(unittest.TestCase):
+    """Tests for the complete Schematron validation profile."""
+    def test_profile_valid(self):
+        profile = SC.ValidationProfile()
+        profile.validate(str(files(XML).joinpath('METS-valid.xml')))
+        self.assertTrue(profile.is_wellformed)
+        self.assertTrue(profile.is_valid)
+        self.assertTrue(list(profile.get_results().keys()) == list(SC.ValidationProfile.SECTIONS))
+
+    def test_profile_invalid(self):
+        profile = SC.ValidationProfile()
+        profile.validate(str(files(XML).joinpath('METS-no-objid.xml')))
+        self.assertTrue(profile.is_wellformed)
+        self.assertFalse(profile.is_valid)
+        self.assertFalse(profile.get_result('root').is_valid)
+
+    def test_profile_not_wellformed(self):
+        profile = SC.ValidationProfile()
+        profile.validate(io.BytesIO(b'<mets xmlns="http://www.loc.gov/METS/">'))
+        self.assertFalse(profile.is_wellformed)
+        self.assertFalse(profile.is_valid)
+        self.assertTrue(len(profile.messages) == 1)
+        self.assertTrue(profile.get_results() == {})
+
+    def test_profile_threaded(self):
+        serial = SC.ValidationProfile()
+        serial.validate(str(files(XML).joinpath('METS-no-objid.xml')))
+        threaded = SC.ValidationProfile()
+        threaded.validate(str(files(XML).joinpath('METS-no-objid.xml')), workers=3)
+        self.assertTrue(list(threaded.get_results().keys()) == list(serial.get_results().keys()))
+        self.assertTrue(list(threaded.timings.keys()) == list(SC.ValidationProfile.SECTIONS))
+        self.assertTrue(threaded.elapsed > 0)
+        for section in SC.ValidationProfile.SECTIONS:
+            self.assertTrue([str(res) for res in threaded.get_result(section).failures] ==
+                            [str(res) for res in serial.get_result(section).failures])
+        self.assertFalse(threaded.is_valid)
+
+    def test_profile_fused(self):
+        for name in ['METS-valid.xml', 'METS-no-objid.xml', 'METS-no-hdr.xml']:
+            separate = SC.ValidationProfile()
+            separate.validate(str(files(XML).joinpath(name)))
+            fused = SC.ValidationProfile(fused=True)
+            fused.validate(str(files(XML).joinpath(name)))
+            self.assertTrue(fused.is_valid == separate.is_valid)
+            self.assertTrue(list(fused.get_results().keys()) == list(SC.ValidationProfile.SECTIONS))
+            for section in SC.ValidationProfile.SECTIONS:
+                self.assertTrue([str(res) for res in fused.get_result(section).failures] ==
+                                [str(res) for res in separate.get_result(section).failures])
+                self.assertTrue([str(res) for res in fused.get_result(section).warnings] ==
+                                [str(res) for res in separate.get_result(section).warnings])
+
+    def test_profile_parsed_document(self):
+        profile = SC.ValidationProfile()
+        profile.validate(SC.parse_document(str(files(XML).joinpath('METS-no-objid.xml'))))
+        self.assertFalse(profile.get_result('root').is_valid)
+
 def _test_validation(name, to_validate):
     rules = SC.ValidationRules(name)
     rules.validate(str(files(XML).joinpath(to_validate)))
@@ -24,7 +24,9 @@
 #
 """Module covering tests for package structure errors."""
 import os
+import tarfile
 import unittest
+from unittest import mock
 
 from ip_validation.infopacks import information_package as IP
 from ip_validation.infopacks.rules import Severity
@@ -198,3 +200,45 @@ class StructValidationTests(unittest.TestCase):
                         'Expecting 1 errors but found {}'.format(len(val_errors)))
         self.assertTrue(contains_rule_id(val_errors, "CSIPSTR9",
                                          severity=Severity.Warn))
+
+    def test_archive_listing(self):
+        """Archive listings match the unpacked package without extracting it."""
+        ips_root = os.path.join(os.path.dirname(__file__), 'resources', 'ips', 'minimal')
+        for name in ['minimal_IP_with_schemas.zip', 'minimal_IP_with_schemas.tar.gz']:
+            listing = IP.PackageListing.from_path(os.path.join(ips_root, name))
+            self.assertTrue(isinstance(listing, IP.ArchiveListing))
+            self.assertTrue(listing.listdir('') == ['minimal_IP_with_schemas'])
+            self.assertTrue(listing.isdir('minimal_IP_with_schemas/representations/rep1'))
+            self.assertTrue(listing.isfile('minimal_IP_with_schemas/METS.xml'))
+            self.assertFalse(listing.isdir('minimal_IP_with_schemas/METS.xml'))
+            self.assertFalse(listing.isfile('minimal_IP_with_schemas/missing.xml'))
+
+    def test_open_archived_mets(self):
+        """METS.xml is streamed out of archived packages."""
+        ip_path = os.path.join(os.path.dirname(__file__), 'resources', 'ips', 'minimal',
+                               'minimal_IP_with_schemas.zip')
+        details = IP.validate_package_structure(ip_path)
+        self.assertTrue(details.name == 'minimal_IP_with_schemas')
+        with details.open(IP.METS_NAME) as mets_file:
+            self.assertTrue(b'<mets' in mets_file.read())
+
+    def test_open_tar_member_info(self):
+        """Tar members are opened from their listed TarInfo, not looked up by name."""
+        ip_path = os.path.join(os.path.dirname(__file__), 'resources', 'ips', 'minimal',
+                               'minimal_IP_with_schemas.tar.gz')
+        details = IP.validate_package_structure(ip_path)
+        with mock.patch.object(tarfile.TarFile, 'getmember',
+                               side_effect=AssertionError('Members were read again')):
+            with details.open(IP.METS_NAME) as mets_file:
+                self.assertTrue(b'<mets' in mets_file.read())
+            with details.listing.reader() as open_member:
+                with open_member(details.listing_path(IP.METS_NAME)) as mets_file:
+                    self.assertTrue(b'<mets' in mets_file.read())
+
+    def test_not_an_archive(self):
+        """Files that aren't archives can't be listed."""
+        ip_path = os.path.join(os.path.dirname(__file__), 'resources', 'empty.file')
+        self.assertRaises(IP.PackageStructError, IP.PackageListing.from_path, ip_path)
+        details = IP.validate_package_structure(ip_path)
+        self.assertTrue(details.structure_status == IP.StructureStatus.NotWellFormed)
+        self.assertTrue(contains_rule_id(details.errors, "CSIPSTR1"))
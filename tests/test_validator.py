@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# coding=UTF-8
+#
+# E-ARK Validation
+# Copyright (C) 2019
+# All rights reserved.
+#
+# Licensed to the E-ARK project under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The E-ARK project licenses
+# this file to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""Unit tests for the full package validation pipeline."""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import lxml.etree
+
+from ip_validation.infopacks import information_package as IP
+from ip_validation.infopacks.fixity import FixityCache
+from ip_validation.infopacks.registry import ValidatorRegistry
+from ip_validation.validator import PackageValidator
+
+IPS_ROOT = os.path.join(os.path.dirname(__file__), 'resources', 'ips')
+# Accepts any mets root element, so tests can use stub METS files
+LAX_SCHEMA = lxml.etree.XMLSchema(lxml.etree.XML(b"""
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" elementFormDefault="qualified"
+           targetNamespace="http://www.loc.gov/METS/">
+  <xs:element name="mets"><xs:complexType>
+    <xs:sequence><xs:any processContents="skip" minOccurs="0" maxOccurs="unbounded"/></xs:sequence>
+    <xs:anyAttribute processContents="skip"/>
+  </xs:complexType></xs:element>
+</xs:schema>"""))
+ROOT_METS = """<?xml version="1.0" encoding="UTF-8"?>
+<mets xmlns="http://www.loc.gov/METS/" xmlns:xlink="http://www.w3.org/1999/xlink">
+  <structMap><div LABEL="package">{}</div></structMap>
+</mets>"""
+REP_DIV = """<div LABEL="representations/{0}">
+  <mptr xlink:href="file://./representations/{0}/METS.xml"/></div>"""
+REP_METS = {'rep1_mig-1': b'<mets xmlns="http://www.loc.gov/METS/"/>',
+            'rep2_mig-1': b'<notMets xmlns="http://www.loc.gov/METS/"/>'}
+
+class LaxRegistry(ValidatorRegistry):
+    """Registry that hands out the lax METS schema."""
+    def get_schema(self, schema_path):
+        return LAX_SCHEMA
+
+class PackageValidatorTest(unittest.TestCase):
+    """Tests for package reports and validator reuse."""
+    def test_well_formed(self):
+        validator = PackageValidator()
+        report = validator.validate(os.path.join(IPS_ROOT, 'minimal',
+                                                 'minimal_IP_with_schemas.zip'))
+        self.assertTrue(report['package']['name'] == 'minimal_IP_with_schemas')
+        self.assertTrue(report['package']['structure_status'] == 'WellFormed')
+        # The METS schema's xlink import resolves to the bundled copy offline
+        self.assertTrue(report['schema_valid'] is True)
+        self.assertTrue(report['schema_errors'] == [])
+        self.assertTrue(report['metadata_valid'] is not None)
+
+    def test_schema_invalid(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            shutil.unpack_archive(os.path.join(IPS_ROOT, 'minimal', 'minimal_IP_with_schemas.zip'),
+                                  temp_dir)
+            mets_path = os.path.join(temp_dir, 'minimal_IP_with_schemas', IP.METS_NAME)
+            with open(mets_path) as mets_file:
+                mets = mets_file.read()
+            with open(mets_path, 'w') as mets_file:
+                mets_file.write(mets.replace('<metsHdr', '<unexpected/><metsHdr', 1))
+            report = PackageValidator().validate(temp_dir)
+        self.assertTrue(report['package']['structure_status'] == 'WellFormed')
+        self.assertTrue(report['schema_valid'] is False)
+        self.assertTrue(report['metadata_valid'] is None)
+        self.assertTrue(len(report['schema_errors']) == 1)
+        self.assertTrue(report['schema_errors'][0].startswith(
+            "Element '{http://www.loc.gov/METS/}unexpected': This element is not expected."))
+
+    def test_archived_mets_read_once(self):
+        # Both the schema and Schematron passes read the one copy of the METS
+        ip_path = os.path.join(IPS_ROOT, 'minimal', 'minimal_IP_with_schemas.tar.gz')
+        with mock.patch.object(IP.ArchiveListing, 'open', autospec=True,
+                               side_effect=IP.ArchiveListing.open) as open_member:
+            report = PackageValidator().validate(ip_path)
+        self.assertTrue(report['metadata_valid'] is not None)
+        self.assertTrue(open_member.call_count == 1)
+
+    def test_fixity_cache_report(self):
+        ip_path = os.path.join(IPS_ROOT, 'minimal', 'minimal_IP_with_schemas.zip')
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache = FixityCache(os.path.join(temp_dir, 'fixity.db'))
+            validator = PackageValidator(checksums=True, fixity_cache=cache)
+            # Archive members are never looked up in the cache
+            self.assertTrue('fixity_cache' not in validator.validate(ip_path))
+            shutil.unpack_archive(ip_path, os.path.join(temp_dir, 'ip'))
+            report = validator.validate(os.path.join(temp_dir, 'ip'))
+            self.assertTrue(report['fixity_cache']['misses'] > 0)
+
+    def test_not_well_formed(self):
+        progress = []
+        report = PackageValidator().validate(os.path.join(IPS_ROOT, 'struct', 'no_mets.tar.gz'),
+                                             progress.append)
+        self.assertTrue(report['package']['structure_status'] == 'NotWellFormed')
+        self.assertTrue(report['schema_valid'] is None)
+        self.assertTrue(report['metadata_valid'] is None)
+        self.assertTrue(progress == [1 / 3])
+
+    def test_limits(self):
+        validator = PackageValidator(limits=IP.ArchiveLimits(max_members=2))
+        report = validator.validate(os.path.join(IPS_ROOT, 'minimal',
+                                                 'minimal_IP_with_schemas.zip'))
+        self.assertTrue(report['package']['errors'][0]['rule_id'] == 'CSIPSTR3')
+
+    def test_profile_reused(self):
+        validator = PackageValidator()
+        profile = validator.profile
+        validator.validate(os.path.join(IPS_ROOT, 'struct', 'no_mets.tar.gz'))
+        self.assertTrue(validator.profile is profile)
+
+class RepresentationTest(unittest.TestCase):
+    """Tests for validation of representation METS files."""
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.temp_dir.name, 'package')
+        for folder in ('metadata', 'schemas'):
+            os.makedirs(os.path.join(self.root, folder))
+            with open(os.path.join(self.root, folder, 'file.xml'), 'wb') as out_file:
+                out_file.write(b'<file/>')
+        for rep, mets in REP_METS.items():
+            os.makedirs(os.path.join(self.root, 'representations', rep))
+            with open(os.path.join(self.root, 'representations', rep, IP.METS_NAME),
+                      'wb') as out_file:
+                out_file.write(mets)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _validate(self, reps, archive=False, divs=''):
+        with open(os.path.join(self.root, IP.METS_NAME), 'w') as mets_file:
+            mets_file.write(ROOT_METS.format(divs + ''.join(REP_DIV.format(rep) for rep in reps)))
+        to_validate = self.temp_dir.name
+        if archive:
+            to_validate = shutil.make_archive(self.root, 'zip', self.temp_dir.name, 'package')
+        return PackageValidator(registry=LaxRegistry(), mets_workers=2).validate(to_validate)
+
+    def test_representations(self):
+        for archive in (False, True):
+            report = self._validate(sorted(REP_METS), archive)
+            self.assertTrue(report['package']['structure_status'] == 'WellFormed')
+            reps = report['representations']
+            self.assertTrue([rep['mets'] for rep in reps] ==
+                            ['representations/rep1_mig-1/METS.xml',
+                             'representations/rep2_mig-1/METS.xml'])
+            self.assertTrue(reps[0]['schema_valid'] is True)
+            self.assertTrue(reps[0]['metadata_valid'] is not None)
+            self.assertTrue(reps[1]['schema_valid'] is False)
+            self.assertTrue(reps[1]['metadata_valid'] is None)
+            # Representation errors roll up into the package result
+            self.assertTrue(report['schema_valid'] is False)
+            self.assertTrue(report['schema_errors'][0].startswith(
+                'representations/rep2_mig-1/METS.xml: '))
+
+    def test_valid_representation(self):
+        report = self._validate(['rep1_mig-1'])
+        self.assertTrue(report['schema_valid'] is True)
+        self.assertTrue(report['schema_errors'] == [])
+        self.assertTrue(len(report['representations']) == 1)
+
+    def test_relative_path(self):
+        # Representation paths are resolved once against a relative package path
+        with open(os.path.join(self.root, IP.METS_NAME), 'w') as mets_file:
+            mets_file.write(ROOT_METS.format(REP_DIV.format('rep1_mig-1')))
+        cwd = os.getcwd()
+        os.chdir(os.path.dirname(self.temp_dir.name))
+        try:
+            report = PackageValidator(registry=LaxRegistry()).validate(
+                os.path.basename(self.temp_dir.name))
+        finally:
+            os.chdir(cwd)
+        self.assertTrue(report['representations'][0]['mets'] ==
+                        'representations/rep1_mig-1/METS.xml')
+        self.assertTrue(report['representations'][0]['schema_valid'] is True)
+        self.assertTrue(report['schema_valid'] is True)
+
+    def test_other_divs(self):
+        # Divs are released as they're parsed, representations are still found
+        divs = '<div><div LABEL="data/a.txt"/></div><div LABEL="representations/rep2"/>'
+        report = self._validate(['rep1_mig-1'], divs=divs)
+        self.assertTrue([rep['representation'] for rep in report['representations']] ==
+                        ['rep1_mig-1'])
+
+    def test_missing_representation(self):
+        report = self._validate(['rep3_mig-1'])
+        self.assertTrue(report['schema_valid'] is False)
+        self.assertTrue('not found' in report['representations'][0]['schema_errors'][0])
+
+    def test_not_migrated(self):
+        os.rename(os.path.join(self.root, 'representations', 'rep1_mig-1'),
+                  os.path.join(self.root, 'representations', 'rep1'))
+        report = self._validate(['rep1'])
+        self.assertTrue(report['representations'] == [])
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# coding=UTF-8
+#
+# E-ARK Validation
+# Copyright (C) 2019
+# All rights reserved.
+#
+# Licensed to the E-ARK project under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The E-ARK project licenses
+# this file to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""Unit tests for the unpacked package workspace."""
+import hashlib
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from ip_validation.infopacks import information_package as IP
+from ip_validation.infopacks import workspace as WS
+from ip_validation.infopacks.workspace import UnpackWorkspace, PART_PREFIX
+
+DIGESTS = {name: hashlib.sha1(name.encode()).hexdigest()
+           for name in ('abc', 'old', 'new', 'newest', 'in_use', 'other', 'broken')}
+
+def _write_tree(size):
+    def extract(dest):
+        with open(os.path.join(dest, 'content.bin'), 'wb') as content:
+            content.write(b'x' * size)
+    return extract
+
+def _trees(root):
+    # Lock files are kept alongside the trees
+    return sorted(name for name in os.listdir(root) if not name.endswith(WS.LOCK_EXT))
+
+def _exited_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+class UnpackWorkspaceTest(unittest.TestCase):
+    """Tests for tree reuse, quota eviction and reference counting."""
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_reuse(self):
+        workspace = UnpackWorkspace(self.root)
+        first = workspace.unpack(DIGESTS['abc'], _write_tree(10))
+        second = workspace.unpack(DIGESTS['abc'],
+                                  lambda dest: self.fail('Tree should be reused'))
+        self.assertTrue(first == second == os.path.join(self.root, DIGESTS['abc']))
+        stats = workspace.stats()
+        self.assertTrue(stats['hits'] == 1 and stats['misses'] == 1)
+        self.assertTrue(stats['bytes'] == 10 and stats['trees'] == 1)
+
+    def test_lru_eviction(self):
+        workspace = UnpackWorkspace(self.root, max_bytes=25)
+        workspace.unpack(DIGESTS['old'], _write_tree(10))
+        workspace.unpack(DIGESTS['new'], _write_tree(10))
+        os.utime(os.path.join(self.root, DIGESTS['old']), (100, 100))
+        os.utime(os.path.join(self.root, DIGESTS['new']), (200, 200))
+        workspace.unpack(DIGESTS['newest'], _write_tree(10))
+        self.assertTrue(sorted(_trees(self.root)) ==
+                        sorted([DIGESTS['new'], DIGESTS['newest']]))
+        self.assertTrue(workspace.stats()['evictions'] == 1)
+
+    def test_checkout_not_evicted(self):
+        workspace = UnpackWorkspace(self.root, max_bytes=15)
+        with workspace.checkout(DIGESTS['in_use'], _write_tree(10)) as path:
+            os.utime(path, (100, 100))
+            workspace.unpack(DIGESTS['other'], _write_tree(10))
+            self.assertTrue(os.path.isdir(path))
+            self.assertTrue(workspace.stats()['in_use'] == 1)
+        self.assertTrue(workspace.stats()['in_use'] == 0)
+        # Over quota on release, so the older tree goes
+        self.assertTrue(_trees(self.root) == [DIGESTS['other']])
+
+    @unittest.skipIf(WS.fcntl is None, "Trees can only be locked with fcntl")
+    def test_locked_not_evicted(self):
+        workspace = UnpackWorkspace(self.root, max_bytes=15)
+        path = workspace.unpack(DIGESTS['old'], _write_tree(10))
+        os.utime(path, (100, 100))
+        # Another process has the tree checked out
+        handle = os.open(path + WS.LOCK_EXT, os.O_RDWR)
+        try:
+            WS.fcntl.flock(handle, WS.fcntl.LOCK_SH)
+            workspace.unpack(DIGESTS['new'], _write_tree(10))
+            self.assertTrue(_trees(self.root) == sorted([DIGESTS['old'], DIGESTS['new']]))
+        finally:
+            os.close(handle)
+        workspace.unpack(DIGESTS['newest'], _write_tree(10))
+        self.assertTrue(DIGESTS['old'] not in _trees(self.root))
+        self.assertFalse(os.path.exists(path + WS.LOCK_EXT))
+
+    def test_failed_unpack(self):
+        workspace = UnpackWorkspace(self.root)
+        def extract(_):
+            raise IP.PackageStructError("Broken archive")
+        self.assertRaises(IP.PackageStructError, workspace.unpack, DIGESTS['broken'], extract)
+        self.assertTrue(os.listdir(self.root) == [])
+        self.assertTrue(workspace.stats()['in_use'] == 0)
+
+    def test_scan_existing(self):
+        os.makedirs(os.path.join(self.root, DIGESTS['abc']))
+        os.makedirs(os.path.join(self.root, '{}{}-interrupted'.format(PART_PREFIX, _exited_pid())))
+        workspace = UnpackWorkspace(self.root)
+        # The workspace is scanned on first use
+        self.assertTrue(len(_trees(self.root)) == 2)
+        workspace.unpack(DIGESTS['abc'], lambda dest: self.fail('Tree should be reused'))
+        self.assertTrue(_trees(self.root) == [DIGESTS['abc']])
+
+    def test_unmanaged_kept(self):
+        # Other directories sharing the root are never sized or evicted
+        live_part = '{}{}-unpacking'.format(PART_PREFIX, os.getpid())
+        for name in ('other_app', live_part):
+            os.makedirs(os.path.join(self.root, name))
+            with open(os.path.join(self.root, name, 'content.bin'), 'wb') as content:
+                content.write(b'x' * 100)
+        workspace = UnpackWorkspace(self.root, max_bytes=15)
+        workspace.unpack(DIGESTS['old'], _write_tree(10))
+        workspace.unpack(DIGESTS['new'], _write_tree(10))
+        self.assertTrue(sorted(_trees(self.root)) ==
+                        sorted([DIGESTS['new'], 'other_app', live_part]))
+        self.assertTrue(workspace.stats()['bytes'] == 10)
+        self.assertRaises(ValueError, workspace.unpack, '../other_app', _write_tree(10))
+
+    def test_handler_unpacked(self):
+        zip_path = os.path.join(os.path.dirname(__file__), 'resources', 'ips', 'minimal',
+                                'minimal_IP_with_schemas.zip')
+        handler = IP.ArchivePackageHandler(workspace=UnpackWorkspace(self.root))
+        with handler.unpacked(zip_path) as dest:
+            self.assertTrue(os.path.isfile(os.path.join(dest, 'minimal_IP_with_schemas',
+                                                        IP.METS_NAME)))
+        self.assertTrue(handler.unpack_package(zip_path) == dest)
+        self.assertTrue(handler.workspace.stats()['hits'] == 1)